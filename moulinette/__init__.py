@@ -24,7 +24,15 @@ __credits__ = """
     You should have received a copy of the GNU Affero General Public License
     along with this program; if not, see http://www.gnu.org/licenses
     """
-__all__ = ["init", "api", "cli", "m18n", "MoulinetteError", "Moulinette"]
+__all__ = [
+    "init",
+    "api",
+    "cli",
+    "cli_server",
+    "m18n",
+    "MoulinetteError",
+    "Moulinette",
+]
 
 
 m18n = Moulinette18n()
@@ -53,16 +61,52 @@ class Moulinette:
 
 
 # Easy access to interfaces
-def api(host="localhost", port=80, routes={}, actionsmap=None, locales_dir=None):
+def api(
+    host="localhost",
+    port=80,
+    routes={},
+    actionsmap=None,
+    locales_dir=None,
+    workers=None,
+    upload_max_size=None,
+    upload_checksum=None,
+    max_concurrency=None,
+    max_queued=None,
+    profile_dir=None,
+    reload_interval=None,
+    socket_mode=0o660,
+    socket_owner=None,
+):
     """Web server (API) interface
 
     Run a HTTP server with the moulinette for an API usage.
 
     Keyword arguments:
-        - host -- Server address to bind to
+        - host -- Server address to bind to, or 'unix:<path>' to listen on
+            a Unix domain socket - a socket passed by systemd socket
+            activation is used instead if any
         - port -- Server port to bind to
         - routes -- A dict of additional routes to add in the form of
             {(method, uri): callback}
+        - workers -- The number of worker processes to serve the requests
+            from, or None to serve them from this process
+        - upload_max_size -- The maximum size in bytes of a request body
+            and of each uploaded file, or None for no limit
+        - upload_checksum -- The name of a hashlib algorithm to compute
+            the checksum of uploaded files with while they are saved
+        - max_concurrency -- The maximum number of requests processed
+            concurrently, or None for no limit
+        - max_queued -- The maximum number of requests waiting for a
+            processing slot of each limit, default to the limit itself
+        - profile_dir -- The directory to write the profiles of requests
+            with a 'X-Moulinette-Profile' header in, or None to ignore it
+        - reload_interval -- The time period between two checks of the
+            actions map file to reload it once changed, or None - it is
+            reloaded on SIGHUP anyway
+        - socket_mode -- The permissions of the Unix domain socket
+        - socket_owner -- The owner of the Unix domain socket, as a
+            'user', 'user:group' or ':group' string - e.g. ':www-data' to
+            let the web server connect to it - or None
 
     """
     from moulinette.interfaces.api import Interface as Api
@@ -73,7 +117,19 @@ def api(host="localhost", port=80, routes={}, actionsmap=None, locales_dir=None)
         Api(
             routes=routes,
             actionsmap=actionsmap,
-        ).run(host, port)
+            upload_max_size=upload_max_size,
+            upload_checksum=upload_checksum,
+            max_concurrency=max_concurrency,
+            max_queued=max_queued,
+            profile_dir=profile_dir,
+        ).run(
+            host,
+            port,
+            workers=workers,
+            reload_interval=reload_interval,
+            socket_mode=socket_mode,
+            socket_owner=socket_owner,
+        )
     except MoulinetteError as e:
         import logging
 
@@ -87,7 +143,14 @@ def api(host="localhost", port=80, routes={}, actionsmap=None, locales_dir=None)
 
 
 def cli(
-    args, top_parser, output_as=None, timeout=None, actionsmap=None, locales_dir=None
+    args,
+    top_parser,
+    output_as=None,
+    timeout=None,
+    actionsmap=None,
+    locales_dir=None,
+    columns=None,
+    server=None,
 ):
     """Command line interface
 
@@ -99,22 +162,99 @@ def cli(
         - output_as -- Output result in another format, see
             moulinette.interfaces.cli.Interface for possible values
         - top_parser -- The top parser used to build the ActionsMapParser
+        - columns -- A list of the columns to output for the csv, tsv and
+            table formats
+        - server -- The path of the socket of a CLI server to run the
+            action through, see cli_server - it is run in this process if
+            the server is not available
 
     """
+    if server is not None:
+        from moulinette.interfaces.cliserver import run_client
+
+        status = run_client(
+            server,
+            args,
+            options={"output_as": output_as, "timeout": timeout, "columns": columns},
+        )
+        if status is not None:
+            return status
+
     from moulinette.interfaces.cli import Interface as Cli
 
     m18n.set_locales_dir(locales_dir)
 
-    try:
-        load_only_category = args[0] if args and not args[0].startswith("-") else None
-        Cli(
+    load_only_category = args[0] if args and not args[0].startswith("-") else None
+    return _run_cli(
+        lambda: Cli(
             top_parser=top_parser,
             load_only_category=load_only_category,
             actionsmap=actionsmap,
-        ).run(args, output_as=output_as, timeout=timeout)
+        ),
+        args,
+        output_as=output_as,
+        timeout=timeout,
+        columns=columns,
+    )
+
+
+def _run_cli(interface, args, **options):
+    """Run an action with the interface returned by a callable and return
+    the exit status"""
+    try:
+        interface().run(args, **options)
     except MoulinetteError as e:
         import logging
 
         logging.getLogger("moulinette").error(e.strerror)
         return 1
     return 0
+
+
+def cli_server(path, top_parser, actionsmap=None, locales_dir=None, fork=False):
+    """CLI server
+
+    Serve the actions sent by the clients - i.e. cli called with the path
+    of the socket as server - from a warm interpreter, in which the
+    moulinette and the modules of the actions map are imported once. The
+    actions map and its parsers are built once too - and again if its file
+    changed - and are shared copy-on-write by the forked children.
+
+    Keyword arguments:
+        - path -- The path of the Unix socket to listen on
+        - top_parser -- The top parser used to build the ActionsMapParser
+        - fork -- Whether to run each action in a child forked from the
+            server, see moulinette.interfaces.cliserver.CLIServer
+
+    """
+    from moulinette.interfaces.cliserver import CLIServer, preload_actionsmap
+
+    server = {}
+
+    def load():
+        from moulinette.interfaces.cli import Interface as Cli
+
+        server["interface"] = Cli(top_parser=top_parser, actionsmap=actionsmap)
+
+    def interface():
+        from moulinette.interfaces.cli import get_locale
+
+        if server["interface"].actionsmap.changed():
+            load()
+        else:
+            # The locale of the client may differ from the one of the server
+            m18n.set_locale(get_locale())
+        return server["interface"]
+
+    def handler(args, **options):
+        return _run_cli(interface, args, **options)
+
+    def warmup():
+        m18n.set_locales_dir(locales_dir)
+        if actionsmap is not None:
+            preload_actionsmap(actionsmap)
+        load()
+
+    CLIServer(
+        path, handler, preload=["moulinette.interfaces.cli"], warmup=warmup, fork=fork
+    ).serve_forever()
@@ -2,13 +2,16 @@
 
 import os
 import re
+import sys
 import logging
 import glob
 import pickle as pickle
 
 from typing import List, Optional
-from time import time
+from time import monotonic, time
 from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import ExitStack, contextmanager
 from importlib import import_module
 from functools import cache
 
@@ -21,6 +24,7 @@ from moulinette.core import (
 from moulinette.interfaces import BaseActionsMapParser
 from moulinette.utils.log import start_action_logging
 from moulinette.utils.filesystem import read_yaml
+from moulinette.utils.completion import completion_index_path, write_completion_index
 
 logger = logging.getLogger("moulinette.actionsmap")
 
@@ -365,6 +369,63 @@ class ExtraArgumentParser:
         return args
 
 
+@contextmanager
+def _measure(timings, phase):
+    """Record the duration in seconds of a block in a timings dict, if any"""
+    if timings is None:
+        yield
+        return
+    start = monotonic()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0) + monotonic() - start
+
+
+class _IterateThenExit(Iterator):
+    """Yield the items of an iterator and close the given ExitStack after
+
+    The stack is closed once the iterator is exhausted or raises, and also
+    when it is closed or garbage-collected - even if its iteration has not
+    started - so that e.g. the lock held for the action is always released.
+
+    """
+
+    def __init__(self, iterator, stack):
+        self._iterator = iterator
+        self._stack = stack
+
+    def __next__(self):
+        if self._stack is None:
+            raise StopIteration
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            stack, self._stack = self._stack, None
+            stack.close()
+            raise
+        except BaseException:
+            stack, self._stack = self._stack, None
+            if not stack.__exit__(*sys.exc_info()):
+                raise
+            raise StopIteration
+
+    def close(self):
+        """Close the iterator, then the ExitStack"""
+        stack, self._stack = self._stack, None
+        if stack is None:
+            return
+        try:
+            close = getattr(self._iterator, "close", None)
+            if close is not None:
+                close()
+        finally:
+            stack.close()
+
+    def __del__(self):
+        self.close()
+
+
 # Main class ----------------------------------------------------------
 
 
@@ -398,7 +459,20 @@ class ActionsMap:
         actionsmap_yml_file = os.path.basename(actionsmap_yml)
         actionsmap_yml_stat = os.stat(actionsmap_yml)
 
+        self.actionsmap_yml = actionsmap_yml
+        self.stamp = (actionsmap_yml_stat.st_size, actionsmap_yml_stat.st_mtime)
+
         actionsmap_pkl = f"{actionsmap_yml_dir}/.{actionsmap_yml_file}.{actionsmap_yml_stat.st_size}-{actionsmap_yml_stat.st_mtime}.pkl"
+        # The shell completion index is only meant for the CLI, which
+        # global arguments are those of its top parser
+        completion_index = None
+        if top_parser.interface == "cli":
+            completion_index = completion_index_path(actionsmap_yml)
+            global_arguments = (
+                top_parser.global_parser._group_actions
+                if top_parser.global_parser
+                else []
+            )
 
         def generate_cache():
             logger.debug("generating cache for actions map")
@@ -424,6 +498,10 @@ class ActionsMap:
             with open(actionsmap_pkl, "wb") as f:
                 pickle.dump(actionsmap, f)
 
+            # Along with the index used by the shell completion
+            if completion_index is not None:
+                write_completion_index(completion_index, actionsmap, global_arguments)
+
             return actionsmap
 
         if os.path.exists(actionsmap_pkl):
@@ -433,6 +511,18 @@ class ActionsMap:
                     actionsmap = pickle.load(f)
 
                 self.from_cache = True
+
+                # The cache may predate the shell completion index, or have
+                # been generated by another interface
+                if completion_index is not None and not os.path.exists(
+                    completion_index
+                ):
+                    try:
+                        write_completion_index(
+                            completion_index, actionsmap, global_arguments
+                        )
+                    except OSError as e:
+                        logger.warning("unable to write the completion index: %s", e)
             # TODO: Switch to python3 and catch proper exception
             except (IOError, EOFError):
                 actionsmap = generate_cache()
@@ -454,6 +544,14 @@ class ActionsMap:
         self.extraparser = ExtraArgumentParser(top_parser.interface)
         self.parser = self._construct_parser(actionsmap, top_parser)
 
+    def changed(self):
+        """Tell whether the actions map file changed since it was loaded"""
+        try:
+            stat = os.stat(self.actionsmap_yml)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime) != self.stamp
+
     @cache
     def get_authenticator(self, auth_method):
         if auth_method == "default":
@@ -475,6 +573,15 @@ class ActionsMap:
             return mod.Authenticator()
 
     def check_authentication_if_required(self, *args, **kwargs):
+        """Authenticate with the authenticator of the action if it needs one
+
+        Keyword arguments:
+            - args -- The arguments of the action
+            - namespace -- The namespace returned by the parser for args, if
+                they have already been parsed
+            - **kwargs -- Additional interface arguments
+
+        """
         auth_method = self.parser.auth_method(*args, **kwargs)
 
         if auth_method is None:
@@ -483,7 +590,7 @@ class ActionsMap:
         authenticator = self.get_authenticator(auth_method)
         Moulinette.interface.authenticate(authenticator)
 
-    def process(self, args, timeout=None, **kwargs):
+    def process(self, args, timeout=None, timings=None, profiler=None, **kwargs):
         """
         Parse arguments and process the proper action
 
@@ -491,21 +598,37 @@ class ActionsMap:
             - args -- The arguments to parse
             - timeout -- The time period before failing if the lock
                 cannot be acquired for the action
+            - timings -- A dict in which the duration in seconds of each
+                processing phase (auth, parse, lock, import and action) is
+                recorded
+            - profiler -- A started SamplingProfiler, which is tagged with
+                the id of the action
             - **kwargs -- Additional interface arguments
 
         """
 
-        # Perform authentication if needed
-        self.check_authentication_if_required(args, **kwargs)
-
-        # Parse arguments
-        arguments = vars(self.parser.parse_args(args, **kwargs))
+        # Parse arguments once, either before authentication if the parser
+        # needs them to know the action, or only once authenticated
+        namespace = None
+        if self.parser.parse_before_auth:
+            with _measure(timings, "parse"):
+                namespace = self.parser.parse_args(args, **kwargs)
 
-        # Retrieve tid and parse arguments with extra parameters
-        tid = arguments.pop("_tid")
-        arguments = self.extraparser.parse_args(tid, arguments)
+        # Perform authentication if needed
+        with _measure(timings, "auth"):
+            self.check_authentication_if_required(args, namespace=namespace, **kwargs)
+
+        with _measure(timings, "parse"):
+            if namespace is None:
+                namespace = self.parser.parse_args(args, **kwargs)
+            want_to_take_lock = self.parser.want_to_take_lock(
+                args, namespace=namespace, **kwargs
+            )
 
-        want_to_take_lock = self.parser.want_to_take_lock(args, **kwargs)
+            # Retrieve tid and parse arguments with extra parameters
+            arguments = vars(namespace)
+            tid = arguments.pop("_tid")
+            arguments = self.extraparser.parse_args(tid, arguments)
 
         # Retrieve action information
         if len(tid) == 4:
@@ -529,15 +652,22 @@ class ActionsMap:
             full_action_name = "{}.{}.{}".format(namespace, category, action)
 
         # Lock the moulinette for the namespace
-        with MoulinetteLock(namespace, timeout, self.enable_lock and want_to_take_lock):
+        with ExitStack() as stack:
+            with _measure(timings, "lock"):
+                stack.enter_context(
+                    MoulinetteLock(
+                        namespace, timeout, self.enable_lock and want_to_take_lock
+                    )
+                )
             start = time()
             try:
-                mod = __import__(
-                    "{}.{}".format(namespace, category),
-                    globals=globals(),
-                    level=0,
-                    fromlist=[func_name],
-                )
+                with _measure(timings, "import"):
+                    mod = __import__(
+                        "{}.{}".format(namespace, category),
+                        globals=globals(),
+                        level=0,
+                        fromlist=[func_name],
+                    )
                 logger.debug(
                     "loading python module %s took %.3fs",
                     "{}.{}".format(namespace, category),
@@ -557,6 +687,8 @@ class ActionsMap:
                 raise MoulinetteError(error_message, raw_msg=True)
             else:
                 log_id = start_action_logging()
+                if profiler is not None:
+                    profiler.tag = log_id
                 if logger.isEnabledFor(logging.DEBUG):
                     # Log arguments in debug mode only for safety reasons
                     logger.debug(
@@ -571,11 +703,18 @@ class ActionsMap:
                 # Load translation and process the action
                 start = time()
                 try:
-                    return func(**arguments)
+                    with _measure(timings, "action"):
+                        ret = func(**arguments)
                 finally:
                     stop = time()
                     logger.debug("action [%s] executed in %.3fs", log_id, stop - start)
 
+                if isinstance(ret, Iterator):
+                    # The action goes on while its result is consumed, keep
+                    # the lock until then
+                    return _IterateThenExit(ret, stack.pop_all())
+                return ret
+
     # Private methods
 
     def _construct_parser(self, actionsmap, top_parser):
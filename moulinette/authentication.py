@@ -1,6 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import os
+import json
+import copy
+import hashlib
 import logging
+import secrets
+import threading
+import sys
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import monotonic, sleep, time
 
 from moulinette.core import MoulinetteError, MoulinetteAuthenticationError
 
@@ -22,12 +33,43 @@ class BaseAuthenticator:
     must be given on instantiation - with the corresponding vendor
     configuration of the authenticator.
 
+    Authenticators with an expensive backend may set credentials_cache to
+    a CredentialsCache instance, so that successful verifications are not
+    repeated for a while - see its security notes.
+
+    Authenticators which keep connections to their backend may implement
+    the _connect method - and _check_connection and _close_connection if
+    needed - then get connections from a pool of at most pool_size ones
+    with the connection method, see ConnectionPool.
+
+    The session methods used by the API - set_session_cookie,
+    get_session_cookie and delete_session_cookie - must be implemented,
+    unless session_store is set to a SessionStore instance: the session
+    infos are then kept by the server and the session cookie only holds
+    their key.
+
     """
 
+    credentials_cache = None
+
+    session_store = None
+
+    """The maximum number of backend connections open at once"""
+    pool_size = 4
+
+    """The time period in seconds after which an idle connection is closed"""
+    pool_max_idle = 300
+
     # Virtual methods
     # Each authenticator classes must implement these methods.
 
     def authenticate_credentials(self, credentials):
+        cache = self.credentials_cache
+        if cache is not None:
+            auth_info = cache.get(credentials)
+            if auth_info is not None:
+                return auth_info
+
         try:
             # Attempt to authenticate
             auth_info = self._authenticate_credentials(credentials) or {}
@@ -37,4 +79,485 @@ class BaseAuthenticator:
             logger.exception(f"authentication {self.name} failed because '{e}'")
             raise MoulinetteAuthenticationError("unable_authenticate")
 
+        if cache is not None:
+            cache.set(credentials, auth_info)
         return auth_info
+
+    @property
+    def pool(self):
+        """The pool of backend connections, created on first use"""
+        pool = getattr(self, "_pool", None)
+        if pool is None:
+            pool = self._pool = ConnectionPool(
+                self._connect,
+                maxsize=self.pool_size,
+                max_idle=self.pool_max_idle,
+                check=self._check_connection,
+                close=self._close_connection,
+            )
+        return pool
+
+    def connection(self):
+        """Get a connection to the backend from the pool, to be used as
+        a context manager"""
+        return self.pool.connection()
+
+    def _connect(self):
+        """Open a new connection to the backend"""
+        raise NotImplementedError(
+            "derived class '%s' must override this method" % self.__class__.__name__
+        )
+
+    def _check_connection(self, connection):
+        """Return whether a connection to the backend is still usable"""
+        return True
+
+    def _close_connection(self, connection):
+        """Close a connection to the backend"""
+        if hasattr(connection, "close"):
+            connection.close()
+
+    def invalidate_credentials(self, credentials=None):
+        """Forget the cached verification of some credentials - or of all of
+        them - e.g. after a password change"""
+        if self.credentials_cache is not None:
+            self.credentials_cache.invalidate(credentials)
+
+    # Sessions
+
+    @property
+    def session_cookie_name(self):
+        return f"session.{self.name}"
+
+    def set_session_cookie(self, infos):
+        """Start a new session with the given infos - keeping the id of
+        the current one, if any - and set its cookie"""
+        from bottle import request, response
+
+        store = self._get_session_store()
+        current_infos = self.get_session_cookie(raise_if_no_session_exists=False)
+        new_infos = {"id": current_infos["id"]}
+        new_infos.update(infos)
+
+        # A new key is given on login, so that a key known before it is
+        # not of any use
+        previous_key = request.get_cookie(self.session_cookie_name)
+        if previous_key:
+            store.delete(previous_key)
+        response.set_cookie(
+            self.session_cookie_name,
+            store.create(new_infos),
+            secure=True,
+            httponly=True,
+        )
+
+    def get_session_cookie(self, raise_if_no_session_exists=True):
+        """Return the infos of the current session"""
+        from bottle import request
+        from moulinette.utils.text import random_ascii
+
+        store = self._get_session_store()
+        key = request.get_cookie(self.session_cookie_name)
+        infos = store.get(key) if key else None
+        if infos is None:
+            if not raise_if_no_session_exists:
+                return {"id": random_ascii()}
+            raise MoulinetteAuthenticationError("unable_authenticate")
+        return dict(infos)
+
+    def delete_session_cookie(self):
+        """Delete the current session and its cookie"""
+        from bottle import request, response
+
+        key = request.get_cookie(self.session_cookie_name)
+        if key:
+            self._get_session_store().delete(key)
+        response.delete_cookie(self.session_cookie_name)
+
+    def _get_session_store(self):
+        if self.session_store is None:
+            raise NotImplementedError(
+                "derived class '%s' must override the session methods or set "
+                "session_store" % self.__class__.__name__
+            )
+        return self.session_store
+
+
+# Connections ----------------------------------------------------------
+
+
+class ConnectionPool:
+    """Bounded pool of connections to a backend
+
+    A connection is used by a single greenlet or thread at a time, from
+    its checkout to its checkin. At most maxsize connections are open at
+    once and a checkout waits for one to be checked in if needed - letting
+    the other greenlets run meanwhile. The pool may be shared by the
+    greenlets of several threads: its state is guarded by a lock, which is
+    never held while connecting to or talking with the backend.
+
+    Idle connections are reused last in, first out, checked on checkout
+    and closed once they have been idle for more than max_idle seconds -
+    which is checked on each checkout and checkin.
+
+    Keyword arguments:
+        - connect -- A function which opens a new connection
+        - maxsize -- The maximum number of connections open at once
+        - timeout -- The time period in seconds to wait for a connection
+        - max_idle -- The time period in seconds after which an idle
+            connection is closed
+        - check -- A function which returns whether a connection is still
+            usable, if any
+        - close -- A function which closes a connection, if any
+
+    """
+
+    # The time period in seconds between two attempts of a waiting checkout
+    wait_interval = 0.01
+
+    def __init__(
+        self, connect, maxsize=4, timeout=10, max_idle=300, check=None, close=None
+    ):
+        self.connect = connect
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check = check
+        self.close_connection = close
+
+        self._lock = threading.Lock()
+        self._idle = []  # list((connection, last_used))
+        self._stats = dict.fromkeys(
+            ["in_use", "created", "reused", "discarded", "reaped", "timeouts"], 0
+        )
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a with block
+
+        The connection is discarded if an exception is raised in the block
+        and it is not usable anymore.
+
+        """
+        connection = self.checkout()
+        try:
+            yield connection
+        except BaseException:
+            self.checkin(connection, broken=not self._is_usable(connection))
+            raise
+        self.checkin(connection)
+
+    def checkout(self):
+        """Get a connection, waiting for one to be free if needed"""
+        self._acquire_slot()
+        try:
+            self.reap()
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    connection, _ = self._idle.pop()
+                if self._is_usable(connection):
+                    self._count("reused")
+                    return connection
+                self._discard(connection)
+
+            connection = self.connect()
+            self._count("created")
+            return connection
+        except BaseException:
+            self._count("in_use", -1)
+            raise
+
+    def checkin(self, connection, broken=False):
+        """Give back a connection - which is closed if it is broken"""
+        if broken:
+            self._discard(connection)
+            self._count("in_use", -1)
+        else:
+            with self._lock:
+                self._idle.append((connection, monotonic()))
+                self._stats["in_use"] -= 1
+        self.reap()
+
+    def reap(self):
+        """Close the connections which have been idle for too long"""
+        deadline = monotonic() - self.max_idle
+        expired = []
+        with self._lock:
+            # Idle connections are sorted from the least recently used
+            while self._idle and self._idle[0][1] < deadline:
+                expired.append(self._idle.pop(0)[0])
+            self._stats["reaped"] += len(expired)
+        for connection in expired:
+            self._close(connection)
+
+    def close(self):
+        """Close all the idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close(connection)
+
+    def stats(self):
+        """Return the statistics of the pool as a dict"""
+        with self._lock:
+            stats = dict(self._stats, idle=len(self._idle), maxsize=self.maxsize)
+        stats["open"] = stats["in_use"] + stats["idle"]
+        return stats
+
+    def _acquire_slot(self):
+        # Checked out connections are counted by in_use, which is polled -
+        # so that waiting neither blocks the gevent loop of the thread nor
+        # relies on a primitive shared with the loops of the other threads
+        deadline = monotonic() + self.timeout
+        while True:
+            with self._lock:
+                if self._stats["in_use"] < self.maxsize:
+                    self._stats["in_use"] += 1
+                    return
+                if monotonic() >= deadline:
+                    self._stats["timeouts"] += 1
+                    raise MoulinetteError("connection_pool_exhausted")
+            _wait(min(self.wait_interval, max(deadline - monotonic(), 0)))
+
+    def _count(self, stat, n=1):
+        with self._lock:
+            self._stats[stat] += n
+
+    def _is_usable(self, connection):
+        if self.check is None:
+            return True
+        try:
+            return self.check(connection)
+        except Exception:
+            return False
+
+    def _discard(self, connection):
+        self._close(connection)
+        self._count("discarded")
+
+    def _close(self, connection):
+        if self.close_connection is None:
+            return
+        try:
+            self.close_connection(connection)
+        except Exception as e:
+            logger.warning(f"unable to close connection {connection}: {e}")
+
+
+def _wait(seconds):
+    # Let the other greenlets of the thread run meanwhile, if any
+    gevent = sys.modules.get("gevent")
+    if gevent is not None:
+        gevent.sleep(seconds)
+    else:
+        sleep(seconds)
+
+
+# Credentials ----------------------------------------------------------
+
+
+class CredentialsCache:
+    """Cache of successful credentials verifications
+
+    It allows repeated logins with the same credentials to skip the
+    verification by the authenticator backend - e.g. a LDAP bind - for
+    ttl seconds.
+
+    Security notes:
+        - Only successful verifications are cached, so failed attempts
+          always reach the backend and its rate limiting.
+        - Credentials are never kept: entries are keyed by a PBKDF2 hash
+          of them, salted with a random salt of the process. Iterations
+          make recovering credentials from a memory dump costly, but
+          raising them makes cache hits slower.
+        - A changed or revoked password is still accepted until its entry
+          expires, unless invalidate is called - e.g. by the action which
+          changes it. Keep ttl short.
+        - Only string and bytes credentials are cached.
+
+    Keyword arguments:
+        - ttl -- The time period in seconds a verification is cached for
+        - maxsize -- The maximum number of cached verifications
+        - iterations -- The number of PBKDF2 iterations of the keys
+
+    """
+
+    def __init__(self, ttl=60, maxsize=128, iterations=1000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.iterations = iterations
+
+        self._salt = secrets.token_bytes(16)
+        self._entries = OrderedDict()  # dict({key: (auth_info, expires)})
+
+    def get(self, credentials):
+        """Return a copy of the auth info of cached credentials, or None"""
+        key = self._key(credentials)
+        if key is None:
+            return None
+        try:
+            auth_info, expires = self._entries[key]
+        except KeyError:
+            return None
+        if expires <= time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return copy.deepcopy(auth_info)
+
+    def set(self, credentials, auth_info):
+        """Cache the auth info of successfully verified credentials"""
+        key = self._key(credentials)
+        if key is None:
+            return
+        self._entries[key] = (copy.deepcopy(auth_info), time() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, credentials=None):
+        """Forget some credentials, or all of them if None"""
+        if credentials is None:
+            self._entries.clear()
+            return
+        key = self._key(credentials)
+        if key is not None:
+            self._entries.pop(key, None)
+
+    def _key(self, credentials):
+        if isinstance(credentials, str):
+            credentials = credentials.encode()
+        elif not isinstance(credentials, bytes):
+            return None
+        return hashlib.pbkdf2_hmac("sha256", credentials, self._salt, self.iterations)
+
+
+# Sessions -------------------------------------------------------------
+
+
+class SessionStore:
+    """Server-side store of the sessions infos
+
+    It allows an authenticator to put only the opaque key of a session in
+    its cookie - as returned by create - instead of the whole signed
+    session infos, which are then retrieved with a single dict lookup
+    rather than decoded and verified on each request. It is used by the
+    session methods of BaseAuthenticator once set as its session_store.
+
+    Sessions are kept in memory, in a LRU map of at most maxsize entries,
+    and expire once they have not been used for ttl seconds. Without a
+    database, a session evicted from memory is lost - i.e. the user has to
+    log in again.
+
+    With a database, sessions are also stored in SQLite so that they are
+    shared by several processes - e.g. the workers of a prefork server -
+    and survive restarts. In-memory entries are then trusted for recheck
+    seconds at most, which bounds the time a session deleted by a process
+    may still be accepted by the other ones.
+
+    Keyword arguments:
+        - maxsize -- The maximum number of sessions kept in memory
+        - ttl -- The time period in seconds after which an unused session
+            expires
+        - path -- The path of the SQLite database, if any
+        - recheck -- The time period in seconds after which an in-memory
+            session is checked again against the database
+
+    """
+
+    def __init__(self, maxsize=1024, ttl=86400, path=None, recheck=5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.recheck = recheck
+
+        self._sessions = OrderedDict()  # dict({key: (infos, expires, checked)})
+        self._db = None
+        self._db_pid = None
+        self._last_purge = 0
+
+    def create(self, infos):
+        """Store the infos of a new session and return its key"""
+        key = secrets.token_urlsafe(32)
+        self.set(key, infos)
+        return key
+
+    def get(self, key):
+        """Return the infos of a session, or None if there is no such
+        session or if it has expired"""
+        now = time()
+        try:
+            infos, expires, checked = self._sessions[key]
+        except KeyError:
+            pass
+        else:
+            if expires <= now:
+                del self._sessions[key]
+            elif self.path is None or now - checked < self.recheck:
+                self._cache(key, infos, now, checked)
+                return infos
+
+        if self.path is None:
+            return None
+
+        row = self._execute(
+            "SELECT infos FROM sessions WHERE key = ? AND expires > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            self._sessions.pop(key, None)
+            return None
+
+        infos = json.loads(row[0])
+        self._execute(
+            "UPDATE sessions SET expires = ? WHERE key = ?", (now + self.ttl, key)
+        )
+        self._cache(key, infos, now, now)
+        return infos
+
+    def set(self, key, infos):
+        """Store the infos of a session"""
+        now = time()
+        self._cache(key, infos, now, now)
+        if self.path is not None:
+            self._execute(
+                "INSERT OR REPLACE INTO sessions (key, infos, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(infos), now + self.ttl),
+            )
+            self._purge(now)
+
+    def delete(self, key):
+        """Delete a session"""
+        self._sessions.pop(key, None)
+        if self.path is not None:
+            self._execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+    def _cache(self, key, infos, now, checked):
+        self._sessions[key] = (infos, now + self.ttl, checked)
+        self._sessions.move_to_end(key)
+        while len(self._sessions) > self.maxsize:
+            self._sessions.popitem(last=False)
+
+    def _purge(self, now):
+        # Remove expired sessions from the database at most once per minute
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        self._execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+
+    def _execute(self, query, parameters=()):
+        # A connection cannot be shared with forked processes
+        if self._db is None or self._db_pid != os.getpid():
+            import sqlite3
+
+            self._db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._db_pid = os.getpid()
+            # Sessions infos are only meant for the server
+            os.chmod(self.path, 0o600)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(key TEXT PRIMARY KEY, infos TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+        return self._db.execute(query, parameters)
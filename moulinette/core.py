@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import time
 import json
 import logging
@@ -284,6 +285,11 @@ class MoulinetteLock:
 
     base_lockfile = "/var/run/moulinette_%s.lock"
 
+    # The pid of the client process for which the command is run by a CLI
+    # server, which sets it once the client has been identified - see
+    # moulinette.interfaces.cliserver
+    client_pid = None
+
     def __init__(self, namespace, timeout=None, enable_lock=True, interval=0.5):
         self.namespace = namespace
         self.timeout = timeout
@@ -348,7 +354,7 @@ class MoulinetteLock:
                 warning_treshold *= 4
 
             # Wait before checking again
-            time.sleep(self.interval)
+            self._sleep(self.interval)
 
         # we have warned the user that we were waiting, for better UX also them
         # that we have stop waiting and that the command is processing now
@@ -373,6 +379,15 @@ class MoulinetteLock:
             logger.debug("lock has been released")
             self._locked = False
 
+    def _sleep(self, seconds):
+        # In a gevent server - e.g. a prefork worker of the API waiting for
+        # another one - let the other greenlets run meanwhile
+        gevent = sys.modules.get("gevent")
+        if gevent is not None:
+            gevent.sleep(seconds)
+        else:
+            time.sleep(seconds)
+
     def _lock(self):
         try:
             with open(self._lockfile, "w") as f:
@@ -398,17 +413,25 @@ class MoulinetteLock:
         if lock_pids == []:
             return False
 
-        # Start with self
-        parent = psutil.Process()
-
-        # While there is a parent... (e.g. init has no parent)
-        while parent is not None:
-            # If parent PID is the lock, then yes! we are a son of the process
-            # with the lock...
-            if parent.pid in lock_pids:
-                return True
-            # Otherwise, try 'next' parent
-            parent = parent.parent()
+        # Start with self, then with the client process of the command if it
+        # is run by a CLI server since it is then not a son of the process
+        # which requested it
+        processes = [psutil.Process()]
+        if self.client_pid is not None:
+            try:
+                processes.append(psutil.Process(self.client_pid))
+            except psutil.NoSuchProcess:
+                pass
+
+        for parent in processes:
+            # While there is a parent... (e.g. init has no parent)
+            while parent is not None:
+                # If parent PID is the lock, then yes! we are a son of the
+                # process with the lock...
+                if parent.pid in lock_pids:
+                    return True
+                # Otherwise, try 'next' parent
+                parent = parent.parent()
 
         return False
 
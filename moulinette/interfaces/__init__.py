@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import re
+import json
+import enum
+import math
+import uuid
 import logging
 import argparse
 import copy
 import datetime
+import importlib.util
 from collections import OrderedDict
 from json.encoder import JSONEncoder
 from typing import Optional
@@ -41,6 +46,11 @@ class BaseActionsMapParser:
     """The name of the interface for which it is the parser"""
     interface: Optional[str] = None
 
+    """Whether the arguments must be parsed to know the requested action -
+    and so its authentication and lock mode - in which case they are parsed
+    once before the authentication"""
+    parse_before_auth = False
+
     # Virtual methods
     # Each parser classes must implement these methods.
 
@@ -116,6 +126,8 @@ class BaseActionsMapParser:
 
         Keyword arguments:
             - args -- Arguments string or dict (TODO)
+            - namespace -- The namespace returned by parse_args for args, if
+                they have already been parsed
 
         Returns:
             False, or the authentication profile required
@@ -453,23 +465,31 @@ class JSONExtendedEncoder(JSONEncoder):
     instead.
 
     The following objects and types are supported:
-        - set: converted into list
+        - set and iterators: converted into list
+        - date, datetime and time: converted into ISO-8601 string
+        - enum: converted into its value
+        - UUID: converted into its string
 
     """
 
     def default(self, o):
-        import pytz  # Lazy loading, this takes like 3+ sec on a RPi2 ?!
-
         """Return a serializable object"""
         # Convert compatible containers into list
-        if isinstance(o, set) or (hasattr(o, "__iter__") and hasattr(o, "next")):
+        if isinstance(o, set) or (hasattr(o, "__iter__") and hasattr(o, "__next__")):
             return list(o)
 
         # Display the date in its iso format ISO-8601 Internet Profile (RFC 3339)
         if isinstance(o, datetime.date):
-            if o.tzinfo is None:
-                o = o.replace(tzinfo=pytz.utc)
+            if isinstance(o, datetime.datetime) and o.tzinfo is None:
+                o = o.replace(tzinfo=datetime.timezone.utc)
             return o.isoformat()
+        if isinstance(o, datetime.time):
+            return o.isoformat()
+
+        if isinstance(o, enum.Enum):
+            return o.value
+        if isinstance(o, uuid.UUID):
+            return str(o)
 
         # Return the repr for object that json can't encode
         logger.warning(
@@ -478,3 +498,92 @@ class JSONExtendedEncoder(JSONEncoder):
             o,
         )
         return repr(o)
+
+
+# JSON serialization ---------------------------------------------------
+
+
+# Both backends must give the same output: NaN and infinite floats are
+# encoded as null - as orjson does - instead of the invalid NaN and Infinity
+# of the standard library, while tuple subclasses - e.g. namedtuples - are
+# encoded as lists and dataclasses are not serialized - as the standard
+# library does.
+
+
+def _json_encode_stdlib(content):
+    try:
+        return json.dumps(content, cls=JSONExtendedEncoder, allow_nan=False)
+    except ValueError as e:
+        if "JSON compliant" not in str(e):
+            raise
+    return json.dumps(_finite_floats(content), cls=JSONExtendedEncoder)
+
+
+def _finite_floats(content):
+    """Return the content with NaN and infinite floats replaced by None"""
+    if isinstance(content, float):
+        return content if math.isfinite(content) else None
+    if isinstance(content, dict):
+        return {k: _finite_floats(v) for k, v in content.items()}
+    if isinstance(content, (list, tuple, set)):
+        return [_finite_floats(v) for v in content]
+    return content
+
+
+def _orjson_default(o):
+    if isinstance(o, tuple):
+        return list(o)
+    return _json_extended_encoder.default(o)
+
+
+def _json_encode_orjson(content):
+    import orjson
+
+    try:
+        return orjson.dumps(
+            content,
+            default=_orjson_default,
+            option=orjson.OPT_NAIVE_UTC
+            | orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_PASSTHROUGH_DATACLASS,
+        ).decode("utf-8")
+    except orjson.JSONEncodeError:
+        # e.g. integers exceeding 64 bits, which the standard library handles
+        return _json_encode_stdlib(content)
+
+
+_json_extended_encoder = JSONExtendedEncoder()
+
+"""
+The available JSON serialization backends, by order of preference. Each one
+is given as its name, the module it requires and the encoding function.
+
+"""
+json_backends = [
+    ("orjson", "orjson", _json_encode_orjson),
+    ("json", "json", _json_encode_stdlib),
+]
+
+_json_encode = None
+
+
+def json_encode(content):
+    """Encode content into a JSON string
+
+    Serialize the content with the fastest available backend - orjson if
+    it is installed, the standard library otherwise. Whatever the backend,
+    the extended types of JSONExtendedEncoder are supported the same way
+    and naive datetimes are considered as UTC.
+
+    Keyword arguments:
+        - content -- The content to serialize
+
+    """
+    global _json_encode
+    if _json_encode is None:
+        for name, module, encode in json_backends:
+            if importlib.util.find_spec(module) is not None:
+                logger.debug("using %s as JSON serialization backend", name)
+                _json_encode = encode
+                break
+    return _json_encode(content)
@@ -1,19 +1,34 @@
 # -*- coding: utf-8 -*-
 
+import os
 import re
+import json
 import errno
+import pickle
+import signal
+import stat
+import struct
+import hashlib
 import logging
 import argparse
+import itertools
+import types
 
-from json import dumps as json_encode
+from collections import OrderedDict, deque
+from collections.abc import Iterator
 from tempfile import mkdtemp
-from shutil import rmtree
-
-from gevent import sleep
-from gevent.queue import Queue
-from geventwebsocket import WebSocketError
-
-from bottle import request, response, Bottle, HTTPResponse, FileUpload
+from shutil import chown, rmtree
+from time import monotonic
+
+from gevent import signal_handler, sleep, spawn
+from gevent.event import Event
+from gevent.lock import BoundedSemaphore, Semaphore
+from gevent.os import fork, waitpid
+from gevent.socket import socket, socketpair, AF_UNIX, SOCK_STREAM
+from gevent.pool import Pool
+from gevent.queue import Full, Queue
+
+from bottle import request, response, Bottle, HTTPError, HTTPResponse, FileUpload
 from bottle import abort
 
 from moulinette import m18n, Moulinette
@@ -21,24 +36,49 @@ from moulinette.actionsmap import ActionsMap
 from moulinette.core import (
     MoulinetteError,
     MoulinetteValidationError,
-    MoulinetteAuthenticationError,
 )
 from moulinette.interfaces import (
     BaseActionsMapParser,
     ExtendedArgumentParser,
-    JSONExtendedEncoder,
+    json_encode,
 )
 from moulinette.utils import log
+from moulinette.utils.lazy import lazy_import
+from moulinette.utils.profiling import SamplingProfiler
+
+# Only needed once a WebSocket is open
+geventwebsocket = lazy_import("geventwebsocket")
 
 logger = log.getLogger("moulinette.interface.api")
+access_logger = log.getLogger("moulinette.interface.api.access")
 
 
 # API helpers ----------------------------------------------------------
-# We define a global variable to manage in a dirty way the upload...
-UPLOAD_DIR = None
+
+# Size of the chunks in which uploaded files are written to disk
+UPLOAD_CHUNK_SIZE = 65536
 
 CSRF_TYPES = {"text/plain", "application/x-www-form-urlencoded", "multipart/form-data"}
 
+# Server-Sent Events settings for the messages stream, in seconds - except
+# SSE_RETRY, the reconnection delay given to clients, in milliseconds
+SSE_FLUSH_INTERVAL = 0.1
+SSE_KEEPALIVE_INTERVAL = 15
+SSE_RETRY = 3000
+
+# Maximum number of actions in a batch request, and of its GET actions
+# processed concurrently
+BATCH_MAX_ENTRIES = 100
+BATCH_CONCURRENCY = 10
+
+# Maximum time in seconds a request waits for a processing slot, and delay
+# in seconds after which rejected requests are asked to retry
+ADMISSION_QUEUE_TIMEOUT = 10
+ADMISSION_RETRY_AFTER = 1
+
+# Minimum time period in seconds between two profiled requests
+PROFILE_MIN_INTERVAL = 10
+
 
 def is_csrf():
     """Checks is this is a CSRF request."""
@@ -65,10 +105,409 @@ def filter_csrf(callback):
     return wrapper
 
 
+class RequestUploads:
+    """Files uploaded with a request
+
+    Save the files uploaded with a request into a temporary directory of
+    its own, which is removed at the end of the request. Files are copied
+    chunk by chunk, their size is checked and their checksum is computed on
+    the fly if requested.
+
+    Keyword arguments:
+        - max_size -- The maximum size of a file in bytes, or None
+        - checksum -- The name of a hashlib algorithm to compute the
+            checksum of the files with, or None
+
+    """
+
+    def __init__(self, max_size=None, checksum=None):
+        self.max_size = max_size
+        self.checksum = checksum
+        self.checksums = {}  # dict({path: hexdigest})
+        self.directory = None
+
+    def save(self, upload):
+        """Save an uploaded file and return its path
+
+        Keyword arguments:
+            - upload -- The bottle FileUpload to save
+
+        """
+        if self.directory is None:
+            self.directory = mkdtemp(prefix="moulinette_upload_")
+        path = os.path.join(self.directory, upload.filename)
+
+        digest = hashlib.new(self.checksum) if self.checksum else None
+        size = 0
+        upload.file.seek(0)
+        with open(path, "wb") as f:
+            while True:
+                chunk = upload.file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if self.max_size is not None and size > self.max_size:
+                    raise HTTPResponse(
+                        m18n.g("upload_too_large", max_size=self.max_size), 413
+                    )
+                f.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+
+        if digest is not None:
+            self.checksums[path] = digest.hexdigest()
+            logger.debug(
+                "uploaded file %s has %s checksum %s",
+                upload.filename,
+                self.checksum,
+                self.checksums[path],
+            )
+        return path
+
+    def cleanup(self):
+        """Remove the uploaded files"""
+        if self.directory is not None:
+            rmtree(self.directory, True)
+            self.directory = None
+
+
+class LimitedInput:
+    """Wrap the input stream of a request to limit the size of its body
+
+    Reading more than the limit aborts the request with a 413 error, so that
+    a body is never read - and buffered - beyond it, whatever its
+    Content-Length header.
+
+    Keyword arguments:
+        - stream -- The wsgi.input stream of the request
+        - max_size -- The maximum size of the body in bytes
+
+    """
+
+    def __init__(self, stream, max_size):
+        self.stream = stream
+        self.max_size = max_size
+        self.size = 0
+
+    def _count(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise HTTPResponse(m18n.g("upload_too_large", max_size=self.max_size), 413)
+        return data
+
+    def read(self, *args):
+        return self._count(self.stream.read(*args))
+
+    def readline(self, *args):
+        return self._count(self.stream.readline(*args))
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def request_uploads():
+    """Return the RequestUploads of the current request
+
+    It is set up by the API interface for each request, a default one is
+    set up - and cleaned up at the end of the request - if it is missing.
+
+    """
+    uploads = request.environ.get("moulinette.uploads")
+    if uploads is None:
+        uploads = request.environ["moulinette.uploads"] = RequestUploads()
+    return uploads
+
+
+def merge_params(params, req_params):
+    """Merge the params of a request into the params of its route
+
+    A param given once - i.e. as a single-item list - is unwrapped, and
+    values of a param which is already set are appended to it.
+
+    Keyword arguments:
+        - params -- The dict of the params of the route, e.g. the URL ones
+        - req_params -- An iterable of (name, value) params of the request
+
+    Returns:
+        The merged params dict
+
+    """
+    for k, v in req_params:
+        if isinstance(v, list) and len(v) == 1:
+            v = v[0]
+        if k not in params:
+            params[k] = v
+        else:
+            curr_v = params[k]
+            # Append param value to the list
+            if not isinstance(curr_v, list):
+                curr_v = [curr_v]
+            if isinstance(v, list):
+                curr_v.extend(v)
+            else:
+                curr_v.append(v)
+            params[k] = curr_v
+    return params
+
+
+def get_session_id(actionsmap):
+    """Get the session id of the current request
+
+    The session cookie is decoded and verified once per request, the id is
+    then cached in the request environ so that routing each log record or
+    displayed message to the session stream is just a dict lookup. A
+    random id - which matches no stream - is returned if there is no valid
+    session.
+
+    Keyword arguments:
+        - actionsmap -- The ActionsMap instance serving the request
+
+    """
+    try:
+        return request.environ["moulinette.session_id"]
+    except KeyError:
+        pass
+
+    profile = request.params.get("profile", actionsmap.default_authentication)
+    authenticator = actionsmap.get_authenticator(profile)
+    s_id = authenticator.get_session_cookie(raise_if_no_session_exists=False)["id"]
+
+    request.environ["moulinette.session_id"] = s_id
+    return s_id
+
+
+class SessionStream:
+    """Bounded and replayable stream of the messages of a session
+
+    Messages are kept in a ring buffer of at most `maxlen` items and are
+    numbered by an increasing sequence number. Each subscriber reads the
+    stream through its own cursor - i.e. the sequence number of the last
+    message it has seen - so that all of them get every message, and a
+    reconnecting one can resume from where it was.
+
+    Keyword arguments:
+        - maxlen -- The maximum number of messages to keep
+
+    """
+
+    def __init__(self, maxlen):
+        self.seq = 0
+        self.subscribers = 0
+        self.last_activity = monotonic()
+
+        self._messages = deque(maxlen=maxlen)  # deque((seq, item))
+        self._new_message = Event()
+
+    def put(self, item):
+        """Append an item to the stream and wake up the subscribers"""
+        self.seq += 1
+        self._messages.append((self.seq, item))
+        self.last_activity = monotonic()
+
+        new_message, self._new_message = self._new_message, Event()
+        new_message.set()
+
+    def get(self, cursor, timeout=None):
+        """Retrieve the messages following a cursor
+
+        Wait for new messages if there is none after the cursor yet.
+
+        Keyword arguments:
+            - cursor -- The sequence number of the last seen message
+            - timeout -- The time period to wait for new messages
+
+        Returns:
+            A list of (seq, item) tuples, which is empty on timeout
+
+        """
+        if self.seq <= cursor:
+            self._new_message.wait(timeout)
+        if not self._messages:
+            return []
+
+        # Sequence numbers are contiguous in the buffer, so the position of
+        # the first unseen message can be deduced from the oldest one
+        start = max(cursor - self._messages[0][0] + 1, 0)
+        return list(itertools.islice(self._messages, start, None))
+
+
 class LogQueues(dict):
-    """Map of session ids to queue."""
+    """Map of session ids to their SessionStream
+
+    Streams are created when a client subscribes to the messages of a
+    session, and are removed once they have no subscriber and have been
+    inactive for more than `ttl` seconds.
+
+    In a prefork worker, the `channel` to the parent process is set: new
+    streams and publications are then sent to the parent, which relays
+    them to every worker - including this one - through `receive`. So all
+    the workers hold the same streams with the same sequence numbers, and
+    a client gets the messages of a session whichever worker it reaches.
+    A worker may publish for a stream created by another one before
+    having received its notice: such publications are kept for up to
+    `pending_ttl` seconds and sent once the notice is received. Each worker
+    evicts its idle streams on its own - since it only counts its own
+    subscribers - so a worker publishing for a stream it evicted announces
+    it again, for the workers whose clients still listen to it.
+
+    """
+
+    """The maximum number of messages kept for each session"""
+    maxlen = 500
+
+    """The time period after which an idle session stream is removed"""
+    ttl = 3600
+
+    """The time period during which the publications of a prefork worker
+    for a session stream it does not know yet are kept"""
+    pending_ttl = 5
+
+    """The maximum number of evicted streams remembered by a prefork
+    worker"""
+    max_evicted = 10000
+
+    def __init__(self, *args, **kwargs):
+        super(LogQueues, self).__init__(*args, **kwargs)
+        self._last_eviction = monotonic()
+        self._pending = {}  # dict({s_id: (deadline, deque)})
+        self._evicted = OrderedDict()  # dict({s_id: None})
+        self.channel = None
+
+    def stream(self, s_id):
+        """Get the stream of a session, creating it if needed"""
+        self.evict_idle()
+        try:
+            return self[s_id]
+        except KeyError:
+            stream = self[s_id] = SessionStream(self.maxlen)
+            if self.channel is not None:
+                # Let the other workers create the stream too
+                self.channel.send(s_id, None)
+            return stream
+
+    def publish(self, s_id, item):
+        """Put an item in the stream of a session if it exists
+
+        Returns:
+            True if the item has been published, otherwise False
+
+        """
+        try:
+            stream = self[s_id]
+        except KeyError:
+            if self.channel is None:
+                # Session is not initialized, abandon.
+                return False
+            if s_id not in self._evicted:
+                # The stream may have been created by another worker, which
+                # notice has not been relayed yet: keep the item until then
+                self._keep_pending(s_id, item)
+                return False
+            del self._evicted[s_id]
+            stream = self.stream(s_id)
+        if self.channel is not None:
+            # The item will be put once relayed by the parent process
+            self.channel.send(s_id, item)
+        else:
+            stream.put(item)
+        return True
+
+    def receive(self, s_id, item):
+        """Apply a new stream - if item is None - or a publication relayed
+        by the parent process of a prefork worker"""
+        try:
+            stream = self[s_id]
+        except KeyError:
+            stream = self[s_id] = SessionStream(self.maxlen)
+            self._evicted.pop(s_id, None)
+        if item is not None:
+            stream.put(item)
+            return
+
+        # Publish the items which were kept until the stream is known
+        deadline, items = self._pending.pop(s_id, (0, None))
+        if items and deadline >= monotonic():
+            for pending in items:
+                self.channel.send(s_id, pending)
+
+    def _keep_pending(self, s_id, item):
+        self.evict_idle()
+        now = monotonic()
+        deadline, items = self._pending.get(s_id, (0, None))
+        if deadline < now:
+            deadline, items = now + self.pending_ttl, deque(maxlen=self.maxlen)
+            self._pending[s_id] = (deadline, items)
+        items.append(item)
+
+    def evict_idle(self, force=False):
+        """Remove the idle streams which have no subscriber
+
+        It is done at most once per minute, unless force is True.
+
+        """
+        now = monotonic()
+        if not force and now - self._last_eviction < 60:
+            return
+        self._last_eviction = now
+
+        for s_id, (deadline, _) in list(self._pending.items()):
+            if deadline < now:
+                del self._pending[s_id]
+        for s_id, stream in list(self.items()):
+            if stream.subscribers == 0 and now - stream.last_activity > self.ttl:
+                logger.debug("removing idle messages stream of session %s", s_id)
+                del self[s_id]
+                if self.channel is not None:
+                    self._evicted[s_id] = None
+                    if len(self._evicted) > self.max_evicted:
+                        self._evicted.popitem(last=False)
+
 
-    pass
+class LogChannel:
+    """Channel between a prefork worker and its parent process
+
+    It carries length-prefixed frames over a socket, each of which is
+    either a pickled (s_id, item) publication of a session stream or an
+    empty heartbeat.
+
+    Keyword arguments:
+        - sock -- A connected stream socket
+
+    """
+
+    _header = struct.Struct("!I")
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._lock = Semaphore()
+
+    def send(self, s_id, item):
+        """Send a publication of a session stream"""
+        self.send_frame(pickle.dumps((s_id, item)))
+
+    def recv(self):
+        """Receive a publication as a (s_id, item) tuple, or None for a
+        heartbeat - raise EOFError once the channel is closed"""
+        frame = self.recv_frame()
+        return pickle.loads(frame) if frame else None
+
+    def send_frame(self, frame=b""):
+        # Greenlets cannot write on the same socket concurrently
+        with self._lock:
+            self.sock.sendall(self._header.pack(len(frame)) + frame)
+
+    def recv_frame(self):
+        (size,) = self._header.unpack(self._recv_exactly(self._header.size))
+        return self._recv_exactly(size)
+
+    def _recv_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise EOFError("the channel has been closed")
+            data += chunk
+        return data
 
 
 class APIQueueHandler(logging.Handler):
@@ -88,24 +527,27 @@ class APIQueueHandler(logging.Handler):
         # is being initialized with --debug
         if not self.actionsmap or len(request.cookies) == 0:
             return
+        # Access log lines are for the server logs, not for the session
+        if record.name == access_logger.name:
+            return
 
-        profile = request.params.get("profile", self.actionsmap.default_authentication)
-        authenticator = self.actionsmap.get_authenticator(profile)
+        s_id = get_session_id(self.actionsmap)
 
-        s_id = authenticator.get_session_cookie(raise_if_no_session_exists=False)["id"]
-        try:
-            queue = self.queues[s_id]
-        except KeyError:
-            # Session is not initialized, abandon.
-            return
-        else:
-            # Put the message as a 2-tuple in the queue
-            queue.put_nowait((record.levelname.lower(), record.getMessage()))
+        # Put the message as a 2-tuple in the session stream
+        if self.queues.publish(s_id, (record.levelname.lower(), record.getMessage())):
             # Put the current greenlet to sleep for 0 second in order to
-            # populate the new message in the queue
+            # populate the new message in the stream
             sleep(0)
 
 
+# Argument actions which can be bound without argparse
+BINDABLE_ACTIONS = (
+    argparse._StoreAction,
+    argparse._StoreConstAction,
+    argparse._AppendAction,
+)
+
+
 class _HTTPArgumentParser:
     """Argument parser for HTTP requests
 
@@ -123,7 +565,7 @@ class _HTTPArgumentParser:
 
         self._positional = []  # list(arg_name)
         self._optional = {}  # dict({arg_name: option_strings})
-        self._upload_dir = None
+        self._binders = None  # list((action, is_option, is_flag, is_file))
 
     def set_defaults(self, **kwargs):
         return self._parser.set_defaults(**kwargs)
@@ -162,9 +604,176 @@ class _HTTPArgumentParser:
         else:
             self._optional[action.dest] = action
 
+        # Binders will be compiled again on next parsing
+        self._binders = None
+
         return action
 
     def parse_args(self, args={}, namespace=None):
+        if self._binders is None:
+            self._binders = self._compile_binders()
+        if self._binders is False:
+            return self._parse_arg_strings(args, namespace)
+
+        if namespace is None:
+            namespace = argparse.Namespace()
+        try:
+            return self._bind(args, namespace)
+        except argparse.ArgumentError as e:
+            self._error(str(e))
+
+    def _compile_binders(self):
+        """Compile how the request params are bound to the namespace
+
+        Return a list of the actions to bind - in the order argparse
+        would consume them - with their precomputed kind, or False if
+        one of them can only be handled by argparse.
+
+        """
+        if self._parser._mutually_exclusive_groups:
+            return False
+
+        binders = []
+        for action in self._positional + list(self._optional.values()):
+            if not isinstance(action, BINDABLE_ACTIONS) or action.nargs in [
+                argparse.PARSER,
+                argparse.REMAINDER,
+                argparse.SUPPRESS,
+            ]:
+                return False
+            binders.append(
+                (
+                    action,
+                    len(action.option_strings) > 0,
+                    isinstance(action.const, bool),
+                    isinstance(action.type, argparse.FileType) or action.type == open,
+                )
+            )
+        return binders
+
+    def _bind(self, args, namespace):
+        """Bind the request params to the namespace
+
+        It follows argparse semantics - i.e. defaults, nargs, type
+        conversion and choices - and raises the same errors, but the
+        params are mapped directly to their destination and keep their
+        type if they are not strings.
+
+        """
+        seen_actions = set()
+        extras = []
+
+        for action, is_option, is_flag, is_file in self._binders:
+            if action.dest not in args:
+                continue
+            value = args[action.dest]
+
+            if is_flag or isinstance(value, bool):
+                # Only give the option string if the value is true
+                if not is_option or value == 0:
+                    continue
+                values = []
+            else:
+                values = value if isinstance(value, list) else [value]
+                if is_file:
+                    # Upload the files in the temp directory of the request
+                    values = [
+                        (request_uploads().save(v) if isinstance(v, FileUpload) else v)
+                        for v in values
+                    ]
+                if is_option and values == [""]:
+                    # TODO: Review this fix
+                    values = []
+                elif not is_option and not values:
+                    continue
+
+            self._bind_action(action, values, namespace, extras)
+            seen_actions.add(action)
+
+        # argparse consumes the positionals which may be empty as long as
+        # the previous ones have been consumed
+        for action in self._positional:
+            if action in seen_actions:
+                continue
+            if action.nargs not in [argparse.OPTIONAL, argparse.ZERO_OR_MORE]:
+                break
+            self._bind_action(action, [], namespace, extras)
+            seen_actions.add(action)
+
+        required_actions = []
+        for action in self._parser._actions:
+            if action in seen_actions:
+                continue
+            if action.required:
+                required_actions.append(argparse._get_action_name(action))
+            elif action.default is not argparse.SUPPRESS and not hasattr(
+                namespace, action.dest
+            ):
+                default = action.default
+                if isinstance(default, str):
+                    default = self._parser._get_value(action, default)
+                setattr(namespace, action.dest, default)
+
+        for dest, default in self._parser._defaults.items():
+            if not hasattr(namespace, dest):
+                setattr(namespace, dest, default)
+
+        if required_actions:
+            self._error(
+                "the following arguments are required: %s" % ", ".join(required_actions)
+            )
+        if extras:
+            self._error("unrecognized arguments: %s" % " ".join(str(v) for v in extras))
+        return namespace
+
+    def _bind_action(self, action, values, namespace, extras):
+        """Bind the given values of an action to the namespace"""
+        nargs = action.nargs
+
+        if isinstance(action, argparse._StoreConstAction):
+            value = action.const
+            extras.extend(values)
+        elif not values and nargs == argparse.OPTIONAL:
+            value = action.const if action.option_strings else action.default
+            if isinstance(value, str):
+                value = self._get_value(action, value)
+        elif (
+            not values and nargs == argparse.ZERO_OR_MORE and not action.option_strings
+        ):
+            value = action.default if action.default is not None else []
+            self._parser._check_value(action, value)
+        elif nargs in [None, argparse.OPTIONAL]:
+            if not values:
+                raise argparse.ArgumentError(action, "expected one argument")
+            value = self._get_value(action, values[0])
+            extras.extend(values[1:])
+        else:
+            if nargs == argparse.ONE_OR_MORE and not values:
+                raise argparse.ArgumentError(action, "expected at least one argument")
+            if isinstance(nargs, int):
+                if len(values) < nargs:
+                    raise argparse.ArgumentError(
+                        action,
+                        "expected %s argument%s" % (nargs, "" if nargs == 1 else "s"),
+                    )
+                extras.extend(values[nargs:])
+                values = values[:nargs]
+            value = [self._get_value(action, v) for v in values]
+
+        if isinstance(action, argparse._AppendAction):
+            items = getattr(namespace, action.dest, None)
+            value = (list(items) if items else []) + [value]
+        setattr(namespace, action.dest, value)
+
+    def _get_value(self, action, value):
+        """Convert a string value and check it against the choices"""
+        if isinstance(value, str):
+            value = self._parser._get_value(action, value)
+        self._parser._check_value(action, value)
+        return value
+
+    def _parse_arg_strings(self, args, namespace):
+        """Parse the request params with argparse as option strings"""
         arg_strings = []
 
         # Append an argument to the current one
@@ -180,14 +789,11 @@ class _HTTPArgumentParser:
             elif isinstance(value, FileUpload) and (
                 isinstance(action.type, argparse.FileType) or action.type == open
             ):
-                # Upload the file in a temp directory
-                global UPLOAD_DIR
-                if UPLOAD_DIR is None:
-                    UPLOAD_DIR = mkdtemp(prefix="moulinette_upload_")
-                value.save(UPLOAD_DIR)
+                # Upload the file in the temp directory of the request
+                path = request_uploads().save(value)
                 if option_string is not None:
                     arg_strings.append(option_string)
-                arg_strings.append(UPLOAD_DIR + "/" + value.filename)
+                arg_strings.append(path)
             elif isinstance(value, str):
                 if option_string is not None:
                     arg_strings.append(option_string)
@@ -235,6 +841,264 @@ class _HTTPArgumentParser:
         raise MoulinetteValidationError(message, raw_msg=True)
 
 
+class ConcurrencyLimit:
+    """Limit the number of concurrent holders with a bounded wait queue
+
+    Up to 'limit' holders at once acquire a slot, up to 'queue' more wait
+    for one at most 'timeout' seconds and other ones fail straight away.
+
+    Keyword arguments:
+        - limit -- The maximum number of concurrent holders
+        - queue -- The maximum number of waiters, default to limit
+        - timeout -- The maximum time in seconds to wait for a slot
+
+    """
+
+    def __init__(self, limit, queue=None, timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.limit = limit
+        self.queue = limit if queue is None else queue
+        self.timeout = timeout
+        self.waiting = 0
+        self._semaphore = BoundedSemaphore(limit)
+
+    def acquire(self):
+        """Attempt to acquire a slot and return whether it succeeded"""
+        if self._semaphore.acquire(blocking=False):
+            return True
+        if self.waiting >= self.queue:
+            return False
+
+        self.waiting += 1
+        try:
+            return self._semaphore.acquire(timeout=self.timeout)
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self._semaphore.release()
+
+
+class _AdmissionPlugin:
+    """Admission control Bottle Plugin
+
+    Limit the number of requests processed concurrently by the server and
+    by each route which defines a concurrency limit. Requests which cannot
+    get a slot in time are rejected with a 503 - or a 429 for a route
+    limit - and a 'Retry-After' header, instead of piling up.
+
+    Keyword arguments:
+        - max_concurrency -- The maximum number of requests processed
+            concurrently, or None for no limit
+        - max_queued -- The maximum number of requests waiting for a
+            slot of a limit, default to the limit itself
+        - route_limit -- A function returning the concurrency limit of a
+            route given as a 2-tuple (method, path), or None
+
+    """
+
+    name = "admission"
+    api = 2
+
+    def __init__(self, max_concurrency=None, max_queued=None, route_limit=None):
+        self.max_queued = max_queued
+        self.route_limit = route_limit
+        self.limit = None
+        if max_concurrency:
+            self.limit = ConcurrencyLimit(max_concurrency, max_queued)
+        self._route_limits = {}  # dict({(method, path): ConcurrencyLimit})
+
+    def apply(self, callback, route):
+        """Apply plugin to the route callback
+
+        Install a wrapper which processes the request only once it got a
+        slot of the route limit - if any - then of the global limit.
+
+        Keyword arguments:
+            callback -- The route callback
+            route -- An instance of Route
+
+        """
+        limits = []
+
+        route_limit = self.get_route_limit((route.method, route.rule))
+        if route_limit is not None:
+            limits.append((route_limit, 429))
+        if self.limit is not None:
+            limits.append((self.limit, 503))
+
+        if not limits:
+            return callback
+
+        def release(acquired):
+            for limit in acquired:
+                limit.release()
+
+        def release_after(acquired, ret):
+            try:
+                yield from ret
+            finally:
+                release(acquired)
+
+        def wrapper(*args, **kwargs):
+            timings = request.environ.get("moulinette.timings")
+            acquired = []
+            try:
+                start = monotonic()
+                for limit, status in limits:
+                    if not limit.acquire():
+                        if status == 429:
+                            message = m18n.g("too_many_requests")
+                        else:
+                            message = m18n.g("server_overloaded")
+                        raise HTTPResponse(
+                            message,
+                            status,
+                            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+                        )
+                    acquired.append(limit)
+                if timings is not None:
+                    timings["queue"] = monotonic() - start
+                ret = callback(*args, **kwargs)
+            except BaseException:
+                release(acquired)
+                raise
+
+            # Streamed responses hold their slots until they are sent
+            if isinstance(ret, types.GeneratorType):
+                return release_after(acquired, ret)
+            release(acquired)
+            return ret
+
+        return wrapper
+
+    def get_route_limit(self, key):
+        """Return the ConcurrencyLimit of a route, or None if it has none
+
+        Keyword arguments:
+            key -- The route as a 2-tuple (method, path)
+
+        """
+        limit = self._route_limits.get(key)
+        if limit is None:
+            route_limit = self.route_limit(key) if self.route_limit else None
+            if not route_limit:
+                return None
+            limit = self._route_limits[key] = ConcurrencyLimit(
+                route_limit, self.max_queued
+            )
+        return limit
+
+
+def server_timing(timings, total):
+    """Format the phase durations of a request as a Server-Timing header
+
+    Keyword arguments:
+        - timings -- A dict of phase durations in seconds
+        - total -- The total duration of the request in seconds
+
+    """
+    metrics = ["%s;dur=%.2f" % (k, v * 1000) for k, v in timings.items()]
+    metrics.append("total;dur=%.2f" % (total * 1000))
+    return ", ".join(metrics)
+
+
+class _TimingPlugin:
+    """Timing Bottle Plugin
+
+    Measure the duration of each request - and of its processing phases
+    recorded by the other plugins and the actions map in the
+    'moulinette.timings' dict of the request environ - and report them in
+    a 'Server-Timing' header. A JSON line with the route, status, size and
+    timings of the request is also logged to the access logger once its
+    response has been sent.
+
+    """
+
+    name = "timing"
+    api = 2
+
+    def apply(self, callback, route):
+        """Apply plugin to the route callback
+
+        Keyword arguments:
+            callback -- The route callback
+            route -- An instance of Route
+
+        """
+        rule = route.rule
+
+        def log_access(environ, start, status, size):
+            if not access_logger.isEnabledFor(logging.INFO):
+                return
+            access_logger.info(
+                json.dumps(
+                    {
+                        "method": environ["REQUEST_METHOD"],
+                        "path": environ.get("PATH_INFO", "/"),
+                        "route": rule,
+                        "status": status,
+                        "size": size,
+                        "duration": round((monotonic() - start) * 1000, 2),
+                        "timings": {
+                            k: round(v * 1000, 2)
+                            for k, v in environ["moulinette.timings"].items()
+                        },
+                    }
+                )
+            )
+
+        def log_after(environ, start, status, ret):
+            size = 0
+            try:
+                for chunk in ret:
+                    size += len(chunk)
+                    yield chunk
+            finally:
+                log_access(environ, start, status, size)
+
+        def body_size(body):
+            if isinstance(body, str):
+                return len(body.encode("utf-8"))
+            elif isinstance(body, bytes):
+                return len(body)
+            return None
+
+        def wrapper(*args, **kwargs):
+            environ = request.environ
+            timings = environ["moulinette.timings"] = {}
+            start = monotonic()
+            try:
+                ret = callback(*args, **kwargs)
+            except HTTPResponse as e:
+                e.set_header(
+                    "Server-Timing", server_timing(timings, monotonic() - start)
+                )
+                log_access(environ, start, e.status_code, body_size(e.body))
+                raise
+            except Exception:
+                log_access(environ, start, 500, None)
+                raise
+
+            if isinstance(ret, HTTPResponse):
+                ret.set_header(
+                    "Server-Timing", server_timing(timings, monotonic() - start)
+                )
+                log_access(environ, start, ret.status_code, body_size(ret.body))
+                return ret
+
+            response.set_header(
+                "Server-Timing", server_timing(timings, monotonic() - start)
+            )
+            if isinstance(ret, types.GeneratorType):
+                if access_logger.isEnabledFor(logging.INFO):
+                    return log_after(environ, start, response.status_code, ret)
+                return ret
+            log_access(environ, start, response.status_code, body_size(ret))
+            return ret
+
+        return wrapper
+
+
 class _ActionsMapPlugin:
     """Actions map Bottle Plugin
 
@@ -243,15 +1107,25 @@ class _ActionsMapPlugin:
 
     Keyword arguments:
         - actionsmap -- An ActionsMap instance
+        - log_queues -- A LogQueues instance to publish messages to
+        - profile_dir -- The directory to write the profiles of requests
+            with a 'X-Moulinette-Profile' header in, or None to ignore it -
+            it is only honoured for the actions which require an
+            authenticated session, at most once per PROFILE_MIN_INTERVAL
 
     """
 
     name = "actionsmap"
     api = 2
 
-    def __init__(self, actionsmap, log_queues={}):
+    def __init__(self, actionsmap, log_queues=None, profile_dir=None):
         self.actionsmap = actionsmap
-        self.log_queues = log_queues
+        self.log_queues = log_queues if log_queues is not None else LogQueues()
+        self.profile_dir = profile_dir
+        self._last_profile = None
+        # The _AdmissionPlugin of the application, which limits the batch
+        # actions too
+        self.admission = None
 
     def setup(self, app):
         """Setup plugin on the application
@@ -284,6 +1158,15 @@ class _ActionsMapPlugin:
             "/messages",
             name="messages",
             callback=self.messages,
+            skip=["actionsmap", "admission"],
+        )
+
+        # Append batch route
+        app.route(
+            "/batch",
+            name="batch",
+            method="POST",
+            callback=self.batch,
             skip=["actionsmap"],
         )
 
@@ -291,6 +1174,8 @@ class _ActionsMapPlugin:
         for m, p in self.actionsmap.parser.routes:
             app.route(p, method=m, callback=self.process)
 
+        self.router = app.router
+
     def apply(self, callback, context):
         """Apply plugin to the route callback
 
@@ -303,12 +1188,8 @@ class _ActionsMapPlugin:
 
         """
 
-        def _format(value):
-            if isinstance(value, list) and len(value) == 1:
-                return value[0]
-            return value
-
         def wrapper(*args, **kwargs):
+            start = monotonic()
             params = kwargs
             # Format boolean params
             for a in args:
@@ -318,21 +1199,11 @@ class _ActionsMapPlugin:
             req_params = list(request.params.dict.items())
             # TODO test special chars in filename
             req_params += list(request.files.dict.items())
-            for k, v in req_params:
-                v = _format(v)
-                if k not in params.keys():
-                    params[k] = v
-                else:
-                    curr_v = params[k]
-                    # Append param value to the list
-                    if not isinstance(curr_v, list):
-                        curr_v = [curr_v]
-                    if isinstance(v, list):
-                        for i in v:
-                            curr_v.append(i)
-                    else:
-                        curr_v.append(v)
-                    params[k] = curr_v
+            merge_params(params, req_params)
+
+            timings = request.environ.get("moulinette.timings")
+            if timings is not None:
+                timings["params"] = monotonic() - start
 
             # Process the action
             return callback((request.method, context.rule), params)
@@ -371,12 +1242,21 @@ class _ActionsMapPlugin:
 
     # This is called before each time a route is going to be processed
     def authenticate(self, authenticator):
+        # The session is verified once per request - and so once for all
+        # the actions of a batch request
+        sessions = request.environ.setdefault("moulinette.sessions", {})
+        try:
+            return sessions[authenticator.name]
+        except KeyError:
+            pass
+
         try:
             session_infos = authenticator.get_session_cookie()
         except Exception:
             msg = m18n.g("authentication_required")
             raise HTTPResponse(msg, 401)
 
+        sessions[authenticator.name] = session_infos
         return session_infos
 
     def logout(self):
@@ -397,41 +1277,141 @@ class _ActionsMapPlugin:
 
         Retrieve the WebSocket stream and send to it each messages displayed by
         the display method. They are JSON encoded as a dict { style: message }.
+
+        A client which gives the 'last_seq' parameter also gets the messages
+        of the session which followed this sequence number - if they are
+        still buffered - and each message comes with its 'seq' number, so
+        that it can resume from there when reconnecting. The ends of the
+        requests replayed this way do not close the WebSocket, only the
+        ones following its connection do.
+
+        A plain HTTP request accepting 'text/event-stream' gets the messages
+        as Server-Sent Events instead, see the _event_stream method.
         """
 
         profile = request.params.get("profile", self.actionsmap.default_authentication)
         authenticator = self.actionsmap.get_authenticator(profile)
 
-        s_id = authenticator.get_session_cookie()["id"]
-        try:
-            queue = self.log_queues[s_id]
-        except KeyError:
-            # Create a new queue for the session
-            queue = Queue()
-            self.log_queues[s_id] = queue
+        s_id = self.authenticate(authenticator)["id"]
+        stream = self.log_queues.stream(s_id)
 
         wsock = request.environ.get("wsgi.websocket")
         if not wsock:
+            if "text/event-stream" in (request.get_header("Accept") or ""):
+                return self._event_stream(stream)
             raise HTTPResponse(m18n.g("websocket_request_expected"), 500)
 
-        while True:
-            item = queue.get()
+        last_seq = request.params.get("last_seq")
+        try:
+            cursor = min(int(last_seq), stream.seq)
+        except (TypeError, ValueError):
+            cursor = stream.seq
+
+        # The clients do not get the sequence numbers of the ends of the
+        # requests, so they resume from before the last one
+        subscribed = stream.seq
+
+        stream.subscribers += 1
+        try:
+            while not wsock.closed:
+                for seq, item in stream.get(cursor, timeout=30):
+                    cursor = seq
+                    try:
+                        # Retrieve the message
+                        style, message = item
+                    except TypeError:
+                        if item == StopIteration:
+                            if seq > subscribed:
+                                return
+                            continue
+                        logger.exception(
+                            "invalid item in the messages stream: %r", item
+                        )
+                        continue
+
+                    content = {style: message}
+                    if last_seq is not None:
+                        content["seq"] = seq
+                    try:
+                        # Send the message
+                        wsock.send(json_encode(content))
+                    except geventwebsocket.WebSocketError:
+                        return
+                sleep(0)
+        finally:
+            stream.subscribers -= 1
+            stream.last_activity = monotonic()
+
+    def _event_stream(self, stream):
+        """Send the messages of a session stream as Server-Sent Events
+
+        The messages emitted within SSE_FLUSH_INTERVAL seconds are coalesced
+        into a single 'message' event, which data is a JSON encoded list of
+        { style: message } dicts and which id is the sequence number of its
+        last message. The client resumes from there thanks to the
+        'Last-Event-ID' header when reconnecting. An 'end' event is sent
+        once the action of the session is over, after which the client
+        should close the stream.
+
+        Keyword arguments:
+            - stream -- The SessionStream to listen to
+
+        """
+        last_event_id = request.get_header("Last-Event-ID")
+        if last_event_id is None:
+            last_event_id = request.params.get("last_seq")
+        try:
+            cursor = min(int(last_event_id), stream.seq)
+        except (TypeError, ValueError):
+            cursor = stream.seq
+
+        response.content_type = "text/event-stream"
+        response.set_header("Cache-Control", "no-cache")
+        # Prevent reverse proxies from buffering the stream
+        response.set_header("X-Accel-Buffering", "no")
+
+        def events(cursor):
+            stream.subscribers += 1
             try:
-                # Retrieve the message
-                style, message = item
-            except TypeError:
-                if item == StopIteration:
-                    # Delete the current queue and break
-                    del self.log_queues[s_id]
-                    break
-                logger.exception("invalid item in the messages queue: %r", item)
-            else:
-                try:
-                    # Send the message
-                    wsock.send(json_encode({style: message}))
-                except WebSocketError:
-                    break
-            sleep(0)
+                # Send something right away so that headers are sent
+                yield "retry: %d\n\n" % SSE_RETRY
+                while True:
+                    messages = stream.get(cursor, timeout=SSE_KEEPALIVE_INTERVAL)
+                    if not messages:
+                        # Keep the connection alive and detect gone clients
+                        yield ": keepalive\n\n"
+                        continue
+
+                    # Wait a bit to send a burst of messages at once
+                    sleep(SSE_FLUSH_INTERVAL)
+                    messages += stream.get(messages[-1][0], timeout=0)
+
+                    batch, end = [], False
+                    for seq, item in messages:
+                        cursor = seq
+                        try:
+                            # Retrieve the message
+                            style, message = item
+                        except TypeError:
+                            if item == StopIteration:
+                                end = True
+                                break
+                            logger.exception(
+                                "invalid item in the messages stream: %r", item
+                            )
+                        else:
+                            batch.append({style: message})
+
+                    if batch:
+                        yield "id: %d\ndata: %s\n\n" % (cursor, json_encode(batch))
+                    if end:
+                        yield "id: %d\nevent: end\ndata: \n\n" % cursor
+                        return
+            finally:
+                stream.subscribers -= 1
+                stream.last_activity = monotonic()
+
+        return events(cursor)
 
     def process(self, _route, arguments={}):
         """Process the relevant action for the route
@@ -446,11 +1426,36 @@ class _ActionsMapPlugin:
 
         """
 
+        # The actions map may be swapped by a reload while processing, and
+        # its routes which have been removed are still in the router
+        actionsmap = self.actionsmap
+        if _route not in actionsmap.parser.routes:
+            abort(404, "Not found: %r" % request.path)
+
+        environ = request.environ
+        timings = environ.get("moulinette.timings")
+        get_session_id(actionsmap)
+
+        profiler = None
         try:
-            ret = self.actionsmap.process(arguments, timeout=30, route=_route)
+            profiler = self._start_profiler(actionsmap, _route)
+            ret = actionsmap.process(
+                arguments, timeout=30, timings=timings, profiler=profiler, route=_route
+            )
+            action = ret
+            if isinstance(ret, Iterator):
+                # Fetch the first item now so that errors raised at the very
+                # beginning of the action still end up in a proper response
+                first = next(ret, StopIteration)
+                if first is not StopIteration:
+                    ret = itertools.chain([first], ret)
+                else:
+                    ret = iter(())
         except MoulinetteError as e:
+            self._end_request(environ)
             raise moulinette_error_to_http_response(e)
         except Exception as e:
+            self._end_request(environ)
             if isinstance(e, HTTPResponse):
                 raise e
             import traceback
@@ -458,47 +1463,207 @@ class _ActionsMapPlugin:
             tb = traceback.format_exc()
             logs = {"route": _route, "arguments": arguments, "traceback": tb}
             return HTTPResponse(json_encode(logs), 500)
-        else:
-            return format_for_response(ret)
-        finally:
-            # Clean upload directory
-            # FIXME do that in a better way
-            global UPLOAD_DIR
-            if UPLOAD_DIR is not None:
-                rmtree(UPLOAD_DIR, True)
-                UPLOAD_DIR = None
-
-            # Close opened WebSocket by putting StopIteration in the queue
-            profile = request.params.get(
-                "profile", self.actionsmap.default_authentication
-            )
-            authenticator = self.actionsmap.get_authenticator(profile)
+
+        if profiler is not None:
+            response.set_header("X-Moulinette-Profile", profiler.tag)
+
+        if not isinstance(ret, Iterator):
+            self._end_request(environ)
+            start = monotonic()
+            ret = format_for_response(ret)
+            if timings is not None:
+                timings["encode"] = monotonic() - start
+            return ret
+
+        # The action is still running while its result is being sent, so the
+        # request ends only once the stream is exhausted (or closed)
+        end_request = self._end_request
+
+        def stream():
             try:
-                s_id = authenticator.get_session_cookie()["id"]
-                queue = self.log_queues[s_id]
-            except MoulinetteAuthenticationError:
-                pass
-            except KeyError:
-                pass
-            else:
-                queue.put(StopIteration)
+                yield from format_for_response(ret)
+            finally:
+                # Make sure the action ends - and e.g. releases its lock -
+                # even if the stream is closed before being exhausted
+                close = getattr(action, "close", None)
+                if close is not None:
+                    close()
+                end_request(environ)
+
+        return stream()
+
+    def batch(self):
+        """Process several actions in a single request
+
+        The request body is a JSON list of { method, path, params } entries,
+        which are dispatched through the routes of the actions map and
+        processed as if they were requested on their own - except that the
+        session is authenticated only once. Consecutive GET entries are
+        processed concurrently, other ones in order.
+
+        The response is a JSON list of { status, result } - in the order of
+        the entries - where result is either the result of the action or
+        the error content.
 
-    def display(self, message, style="info"):
-        profile = request.params.get("profile", self.actionsmap.default_authentication)
-        authenticator = self.actionsmap.get_authenticator(profile)
-        s_id = authenticator.get_session_cookie(raise_if_no_session_exists=False)["id"]
+        """
+        try:
+            entries = request.json
+        except (HTTPError, ValueError):
+            entries = None
+        if not isinstance(entries, list):
+            raise HTTPResponse("A JSON list of actions is expected", 400)
+        if len(entries) > BATCH_MAX_ENTRIES:
+            raise HTTPResponse(
+                "Too many actions (maximum: %d)" % BATCH_MAX_ENTRIES, 413
+            )
+
+        environ = request.environ
+        get_session_id(self.actionsmap)
+
+        results = [None] * len(entries)
 
+        def process_entry(i, entry):
+            # Greenlets may not share the request with the current one
+            request.bind(environ)
+            results[i] = self._process_entry(entry)
+
+        pool = Pool(BATCH_CONCURRENCY)
         try:
-            queue = self.log_queues[s_id]
-        except KeyError:
-            return
+            for i, entry in enumerate(entries):
+                if isinstance(entry, dict) and entry.get("method") == "GET":
+                    pool.spawn(process_entry, i, entry)
+                else:
+                    pool.join()
+                    process_entry(i, entry)
+            pool.join()
+        finally:
+            pool.kill()
+            self._end_request(environ)
+
+        response.content_type = "application/json"
+        return json_encode(
+            [{"status": status, "result": result} for status, result in results]
+        )
+
+    def _process_entry(self, entry):
+        """Process an entry of a batch request
+
+        Keyword arguments:
+            - entry -- A { method, path, params } dict
+
+        Returns:
+            A 2-tuple (status, result)
+
+        """
+        try:
+            method = entry["method"].upper()
+            path = entry["path"]
+            params = list(dict(entry.get("params") or {}).items())
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return 400, "Invalid action, a { method, path, params } dict is expected"
+
+        try:
+            route, url_args = self.router.match(
+                {"PATH_INFO": path, "REQUEST_METHOD": method}
+            )
+        except HTTPError as e:
+            return e.status_code, e.body
+        _route = (route.method, route.rule)
+        actionsmap = self.actionsmap
+        if route.callback != self.process or _route not in actionsmap.parser.routes:
+            return 404, "Not found: %r" % path
+        # Format the params as for a request on its own
+        arguments = merge_params(dict(url_args), params)
+
+        # The batch request holds a slot of the global limit, but each action
+        # must get one of the limit of its route
+        limit = None
+        if self.admission is not None:
+            limit = self.admission.get_route_limit(_route)
+        if limit is not None and not limit.acquire():
+            return 429, m18n.g("too_many_requests")
+
+        try:
+            ret = actionsmap.process(arguments, timeout=30, route=_route)
+            if isinstance(ret, Iterator):
+                ret = list(ret)
+        except MoulinetteError as e:
+            return e.http_code, e.content()
+        except HTTPResponse as e:
+            return e.status_code, e.body
+        except Exception:
+            import traceback
 
-        # Put the message as a 2-tuple in the queue
-        queue.put_nowait((style, message))
+            tb = traceback.format_exc()
+            return 500, {"route": _route, "arguments": arguments, "traceback": tb}
+        finally:
+            if limit is not None:
+                limit.release()
 
-        # Put the current greenlet to sleep for 0 second in order to
-        # populate the new message in the queue
-        sleep(0)
+        status = response_status(route.method, ret)
+        return status, ret if status != 204 else None
+
+    def _end_request(self, environ):
+        """Clean up what has been set up for a request
+
+        Keyword arguments:
+            - environ -- The WSGI environ of the request
+
+        """
+        # Clean upload directory
+        uploads = environ.get("moulinette.uploads")
+        if uploads is not None:
+            uploads.cleanup()
+
+        # Write the profile of the action
+        profiler = environ.pop("moulinette.profiler", None)
+        if profiler is not None:
+            profiler.stop()
+
+        # Close opened WebSocket by putting StopIteration in the stream
+        self.log_queues.publish(environ["moulinette.session_id"], StopIteration)
+
+    def _start_profiler(self, actionsmap, route):
+        """Start profiling the action if the server allows it and it is
+        requested by an authenticated session
+
+        Returns:
+            The started SamplingProfiler, or None
+
+        """
+        if not self.profile_dir or not request.get_header("X-Moulinette-Profile"):
+            return None
+
+        auth_method = actionsmap.parser.auth_method(None, route)
+        if auth_method is None:
+            return None
+        # The session is cached for the request, the action does not check
+        # it again
+        self.authenticate(actionsmap.get_authenticator(auth_method))
+
+        now = monotonic()
+        if (
+            self._last_profile is not None
+            and now - self._last_profile < PROFILE_MIN_INTERVAL
+        ):
+            logger.debug("ignoring the profiling request, one was done recently")
+            return None
+        self._last_profile = now
+
+        profiler = request.environ["moulinette.profiler"] = SamplingProfiler(
+            self.profile_dir
+        )
+        profiler.start()
+        return profiler
+
+    def display(self, message, style="info"):
+        s_id = get_session_id(self.actionsmap)
+
+        # Put the message as a 2-tuple in the session stream
+        if self.log_queues.publish(s_id, (style, message)):
+            # Put the current greenlet to sleep for 0 second in order to
+            # populate the new message in the stream
+            sleep(0)
 
     def prompt(self, *args, **kwargs):
         raise NotImplementedError("Prompt is not implemented for this interface")
@@ -520,24 +1685,87 @@ def moulinette_error_to_http_response(error):
 
 
 def format_for_response(content):
-    """Format the resulted content of a request for the HTTP response."""
-    if request.method == "POST":
-        response.status = 201  # Created
-    elif request.method == "GET":
-        response.status = 200  # Ok
-    else:
+    """Format the resulted content of a request for the HTTP response.
+
+    An iterator (e.g. the result of a generator action) is streamed as a JSON
+    array - or as newline-delimited JSON if the client accepts
+    'application/x-ndjson' - instead of being encoded at once.
+
+    """
+    if isinstance(content, Iterator):
+        response.status = 201 if request.method == "POST" else 200
+        if "application/x-ndjson" in (request.get_header("Accept") or ""):
+            response.content_type = "application/x-ndjson"
+            return _stream_ndjson(content)
+        response.content_type = "application/json"
+        return _stream_json_array(content)
+
+    response.status = response_status(request.method, content)
+    if response.status_code == 204:
         # Return empty string if no content
-        if content is None or len(content) == 0:
-            response.status = 204  # No Content
-            return ""
-        response.status = 200
+        return ""
 
     if isinstance(content, HTTPResponse):
         return content
 
     # Return JSON-style response
     response.content_type = "application/json"
-    return json_encode(content, cls=JSONExtendedEncoder)
+    return json_encode(content)
+
+
+def response_status(method, content):
+    """Return the HTTP status of the response to a request
+
+    Keyword arguments:
+        - method -- The HTTP method of the request
+        - content -- The resulted content of the request
+
+    """
+    if method == "POST":
+        return 201  # Created
+    elif method == "GET":
+        return 200  # Ok
+    elif content is None or len(content) == 0:
+        return 204  # No Content
+    return 200
+
+
+# Size above which the encoded items of a stream are sent as a chunk
+STREAM_CHUNK_SIZE = 16384
+
+
+def _stream_json_array(items):
+    """Encode the items of an iterator as a JSON array, chunk by chunk"""
+    # Send the opening bracket straight away so that the client gets the
+    # response headers and first bytes without waiting for the first item
+    yield "["
+    chunk, size, separator = [], 0, ""
+    for item in items:
+        encoded = json_encode(item)
+        chunk.append(separator)
+        chunk.append(encoded)
+        size += len(encoded) + 1
+        separator = ","
+        if size >= STREAM_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    chunk.append("]")
+    yield "".join(chunk)
+
+
+def _stream_ndjson(items):
+    """Encode the items of an iterator as newline-delimited JSON"""
+    chunk, size = [], 0
+    for item in items:
+        line = json_encode(item)
+        chunk.append(line)
+        chunk.append("\n")
+        size += len(line) + 1
+        if size >= STREAM_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield "".join(chunk)
 
 
 # API Classes Implementation -------------------------------------------
@@ -584,11 +1812,13 @@ class ActionsMapParser(BaseActionsMapParser):
     def add_subcategory_parser(self, name, **kwargs):
         return self
 
-    def add_action_parser(self, name, tid, api=None, **kwargs):
+    def add_action_parser(self, name, tid, api=None, concurrency=None, **kwargs):
         """Add a parser for an action
 
         Keyword arguments:
             - api -- The action route (e.g. 'GET /' )
+            - concurrency -- The maximum number of requests processed
+                concurrently on each route of the action
 
         Returns:
             A new _HTTPArgumentParser object for the route
@@ -616,13 +1846,14 @@ class ActionsMapParser(BaseActionsMapParser):
 
         # Create and append parser
         parser = _HTTPArgumentParser()
+        parser.concurrency = concurrency
         for k in keys:
             self._parsers[k] = (tid, parser)
 
         # Return the created parser
         return parser
 
-    def auth_method(self, _, route):
+    def auth_method(self, _, route, namespace=None):
         try:
             # Retrieve the tid for the route
             _, parser = self._parsers[route]
@@ -635,7 +1866,16 @@ class ActionsMapParser(BaseActionsMapParser):
 
         return parser.authentication
 
-    def want_to_take_lock(self, _, route):
+    def concurrency_limit(self, route):
+        """Return the concurrency limit of a route, if any"""
+        try:
+            _, parser = self._parsers[route]
+        except KeyError:
+            return None
+
+        return parser.concurrency
+
+    def want_to_take_lock(self, _, route, namespace=None):
         _, parser = self._parsers[route]
 
         return getattr(parser, "want_to_take_lock", True)
@@ -695,17 +1935,37 @@ class Interface:
     Keyword arguments:
         - routes -- A dict of additional routes to add in the form of
             {(method, path): callback}
-        - log_queues -- A LogQueues object or None to retrieve it from
-            registered logging handlers
+        - actionsmap -- The path of the actions map
+        - upload_max_size -- The maximum size in bytes of a request body
+            and of each uploaded file, or None for no limit
+        - upload_checksum -- The name of a hashlib algorithm to compute
+            the checksum of uploaded files with while they are saved
+        - max_concurrency -- The maximum number of requests processed
+            concurrently, or None for no limit - routes may define their
+            own limit with the 'concurrency' option of their action
+        - max_queued -- The maximum number of requests waiting for a
+            processing slot of each limit, default to the limit itself
+        - profile_dir -- The directory to write the profiles of requests
+            with a 'X-Moulinette-Profile' header in, or None to ignore it
 
     """
 
     type = "api"
 
-    def __init__(self, routes={}, actionsmap=None):
+    def __init__(
+        self,
+        routes={},
+        actionsmap=None,
+        upload_max_size=None,
+        upload_checksum=None,
+        max_concurrency=None,
+        max_queued=None,
+        profile_dir=None,
+    ):
         actionsmap = ActionsMap(actionsmap, ActionsMapParser())
 
         # Attempt to retrieve log queues from an APIQueueHandler
+        log_queues = None
         handler = log.getHandlersByClass(APIQueueHandler, limit=1)
         if handler:
             log_queues = handler.queues
@@ -734,13 +1994,50 @@ class Interface:
 
             return wrapper
 
+        # Scope uploaded files to the request and reject too large bodies
+        # before they are read - or while they are, as announced sizes are
+        # not trusted, and chunked ones cannot be checked beforehand
+        def apiuploads(callback):
+            def wrapper(*args, **kwargs):
+                if upload_max_size is not None:
+                    if request.chunked:
+                        raise HTTPResponse(m18n.g("upload_length_required"), 411)
+                    if request.content_length > upload_max_size:
+                        raise HTTPResponse(
+                            m18n.g("upload_too_large", max_size=upload_max_size),
+                            413,
+                        )
+                    request.environ["wsgi.input"] = LimitedInput(
+                        request.environ["wsgi.input"], upload_max_size
+                    )
+                request.environ["moulinette.uploads"] = RequestUploads(
+                    upload_max_size, upload_checksum
+                )
+                return callback(*args, **kwargs)
+
+            return wrapper
+
+        actionsmapplugin = _ActionsMapPlugin(actionsmap, log_queues, profile_dir)
+
+        def route_limit(route):
+            return actionsmapplugin.actionsmap.parser.concurrency_limit(route)
+
+        admissionplugin = _AdmissionPlugin(max_concurrency, max_queued, route_limit)
+        actionsmapplugin.admission = admissionplugin
+
         # Install plugins
+        app.install(_TimingPlugin())
+        app.install(admissionplugin)
         app.install(filter_csrf)
         app.install(apiheader)
+        app.install(apiuploads)
         app.install(api18n)
-        actionsmapplugin = _ActionsMapPlugin(actionsmap, log_queues)
         app.install(actionsmapplugin)
 
+        self.log_queues = actionsmapplugin.log_queues
+        self._actionsmapplugin = actionsmapplugin
+        self._admissionplugin = admissionplugin
+
         self.authenticate = actionsmapplugin.authenticate
         self.display = actionsmapplugin.display
         self.prompt = actionsmapplugin.prompt
@@ -754,37 +2051,502 @@ class Interface:
 
         Moulinette._interface = self
 
-    def run(self, host="localhost", port=80):
+    @property
+    def actionsmap(self):
+        """The ActionsMap instance serving the requests"""
+        return self._actionsmapplugin.actionsmap
+
+    def reload_actionsmap(self, force=False):
+        """Reload the actions map if its file changed
+
+        A new ActionsMap is built and swapped in for the next requests,
+        while the ones being processed finish with the previous one. The
+        authenticators - and so the sessions - are kept. Routes which have
+        been added are registered, the ones which changed their
+        concurrency limit are reset and the removed ones respond with a
+        404 from then on.
+
+        Keyword arguments:
+            - force -- Whether to reload the actions map even if its file
+                did not change
+
+        Returns:
+            Whether the actions map has been reloaded
+
+        """
+        current = self.actionsmap
+        if not force and not current.changed():
+            return False
+
+        logger.info("reloading the actions map")
+        try:
+            actionsmap = ActionsMap(current.actionsmap_yml, ActionsMapParser())
+        except Exception:
+            logger.exception(
+                "unable to reload the actions map, keeping the current one"
+            )
+            return False
+        actionsmap.get_authenticator = current.get_authenticator
+
+        self._actionsmapplugin.actionsmap = actionsmap
+        for handler in log.getHandlersByClass(APIQueueHandler):
+            handler.actionsmap = actionsmap
+
+        app = self._app
+        routes = {(r.method, r.rule): r for r in app.routes}
+        for key in actionsmap.parser.routes:
+            route = routes.get(key)
+            if route is None:
+                app.route(
+                    key[1], method=key[0], callback=self._actionsmapplugin.process
+                )
+            elif current.parser.concurrency_limit(
+                key
+            ) != actionsmap.parser.concurrency_limit(key):
+                self._admissionplugin._route_limits.pop(key, None)
+                route.reset()
+        return True
+
+    def run(
+        self,
+        host="localhost",
+        port=80,
+        workers=None,
+        worker_timeout=None,
+        reload_interval=None,
+        socket_mode=0o660,
+        socket_owner=None,
+    ):
         """Run the moulinette
 
         Start a server instance on the given port to serve moulinette
-        actions.
+        actions. See get_listener for the supported listeners.
 
         Keyword arguments:
-            - host -- Server address to bind to
+            - host -- Server address to bind to, or 'unix:<path>' to
+                listen on a Unix domain socket
             - port -- Server port to bind to
+            - workers -- The number of worker processes to fork to serve
+                the requests, see PreforkServer, or None to serve them
+                from this process
+            - worker_timeout -- The time period after which a worker
+                which stopped sending heartbeats is killed, or None
+            - reload_interval -- The time period between two checks of
+                the actions map file to reload it once changed, or None -
+                it is reloaded on SIGHUP anyway
+            - socket_mode -- The permissions of the Unix domain socket
+            - socket_owner -- The owner of the Unix domain socket, as a
+                'user', 'user:group' or ':group' string, or None
 
         """
 
-        logger.debug(
-            "starting the server instance in %s:%d",
-            host,
-            port,
-        )
+        address = host if host.startswith("unix:") else "%s:%d" % (host, port)
+        logger.debug("starting the server instance in %s", address)
+
+        # The socket passed by systemd is not ours to remove
+        unix_path = None
+        if host.startswith("unix:") and not _socket_activated():
+            unix_path = host[len("unix:") :]
 
         try:
             from gevent.pywsgi import WSGIServer
             from geventwebsocket.handler import WebSocketHandler
 
-            server = WSGIServer((host, port), self._app, handler_class=WebSocketHandler)
-            server.serve_forever()
+            listener = get_listener(host, port, socket_mode, socket_owner)
+            server = WSGIServer(listener, self._app, handler_class=WebSocketHandler)
+            if workers:
+                server.init_socket()
+                PreforkServer(
+                    server,
+                    workers,
+                    self.log_queues,
+                    worker_timeout,
+                    reload=self.reload_actionsmap,
+                    reload_interval=reload_interval,
+                ).serve_forever()
+            else:
+                handler = signal_handler(
+                    signal.SIGHUP, spawn, self.reload_actionsmap, True
+                )
+                watcher = None
+                if reload_interval is not None:
+                    watcher = spawn(self._watch_actionsmap, reload_interval)
+                try:
+                    server.serve_forever()
+                finally:
+                    handler.cancel()
+                    if watcher is not None:
+                        watcher.kill(block=False)
         except IOError as e:
-            error_message = "unable to start the server instance on %s:%d: %s" % (
-                host,
-                port,
+            error_message = "unable to start the server instance on %s: %s" % (
+                address,
                 e,
             )
             logger.exception(error_message)
             if e.args[0] == errno.EADDRINUSE:
+                # Do not remove the socket of the running instance
+                unix_path = None
                 raise MoulinetteError("server_already_running")
             raise MoulinetteError(error_message)
+        finally:
+            if unix_path is not None:
+                _remove_unix_listener(unix_path)
+
+    def _watch_actionsmap(self, interval):
+        while True:
+            sleep(interval)
+            self.reload_actionsmap()
+
+
+# Server listeners -----------------------------------------------------
+
+# First file descriptor passed by systemd socket activation
+SD_LISTEN_FDS_START = 3
+
+
+def _socket_activated():
+    return os.environ.get("LISTEN_PID") == str(os.getpid()) and (
+        int(os.environ.get("LISTEN_FDS", 0)) > 0
+    )
+
+
+def get_listener(host, port, socket_mode=0o660, socket_owner=None):
+    """Get the listener to serve the API on
+
+    It is - in order of precedence - the socket passed by systemd socket
+    activation (see sd_listen_fds(3)), a Unix domain socket if host is
+    given as 'unix:<path>', or else the (host, port) address to bind a
+    TCP socket to.
+
+    Keyword arguments:
+        - host -- Server address to bind to, or 'unix:<path>'
+        - port -- Server port to bind to
+        - socket_mode -- The permissions of a Unix domain socket
+        - socket_owner -- The owner of a Unix domain socket, as a
+            'user', 'user:group' or ':group' string, or None
+
+    Returns:
+        A listening socket or an address for a gevent server
+
+    """
+    if _socket_activated():
+        # The variables are not meant for child processes
+        for name in ["LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"]:
+            os.environ.pop(name, None)
+        logger.debug("using the socket passed by systemd")
+        sock = socket(fileno=SD_LISTEN_FDS_START)
+        sock.setblocking(False)
+        return sock
+
+    if host.startswith("unix:"):
+        return _unix_listener(host[len("unix:") :], socket_mode, socket_owner)
+
+    return (host, port)
+
+
+def _unix_listener(path, mode=0o660, owner=None):
+    """Create a listening Unix domain socket, replacing a stale one"""
+    sock = socket(AF_UNIX, SOCK_STREAM)
+    try:
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            try:
+                sock.connect(path)
+            except ConnectionRefusedError:
+                # Nothing listens to it anymore
+                os.unlink(path)
+            else:
+                raise OSError(errno.EADDRINUSE, os.strerror(errno.EADDRINUSE))
+            sock.close()
+            sock = socket(AF_UNIX, SOCK_STREAM)
+
+        sock.bind(path)
+        if owner is not None:
+            user, group = [
+                int(name) if name.isdigit() else name or None
+                for name in owner.partition(":")[::2]
+            ]
+            chown(path, user, group)
+        os.chmod(path, mode)
+        sock.listen(256)
+    except OSError:
+        sock.close()
+        raise
+    sock.setblocking(False)
+    return sock
+
+
+def _remove_unix_listener(path):
+    """Remove the file of a Unix domain socket which is no longer used"""
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except OSError:
+        pass
+
+
+# Prefork server -------------------------------------------------------
+
+# Intervals in seconds at which the parent checks its workers and at which
+# workers send heartbeats, and time period given to workers to finish their
+# requests when stopping
+PREFORK_SUPERVISE_INTERVAL = 0.5
+PREFORK_HEARTBEAT_INTERVAL = 5
+PREFORK_GRACEFUL_TIMEOUT = 30
+
+# Maximum number of publications waiting to be relayed to a worker, which is
+# restarted once exceeded since it does not read them
+PREFORK_RELAY_QUEUE_SIZE = 1000
+
+
+class _Worker:
+    def __init__(self, pid, channel):
+        self.pid = pid
+        self.channel = channel
+        self.last_seen = monotonic()
+        self.retiring = False
+        self.lagging = False
+        self.relay = None
+        self.sender = None
+        self.outgoing = Queue(PREFORK_RELAY_QUEUE_SIZE)
+
+
+class PreforkServer:
+    """Serve the API from several forked worker processes
+
+    The parent process - which has loaded the actions map - binds the
+    listening socket, then forks the workers which inherit it and accept
+    the connections. It respawns the workers which die - or which stop
+    sending heartbeats for more than worker_timeout seconds - gracefully
+    replaces all of them on SIGHUP and stops them on SIGTERM or SIGINT.
+    The application is reloaded before replacing the workers on SIGHUP,
+    and they are also replaced once it has been reloaded because it
+    changed.
+
+    It also relays the new session streams and publications of each
+    worker to all of them, see LogQueues.
+
+    Keyword arguments:
+        - server -- A gevent server which socket has been initialized
+        - workers -- The number of worker processes
+        - log_queues -- The LogQueues instance of the application
+        - worker_timeout -- The time period after which a worker which
+            stopped sending heartbeats is killed, or None
+        - reload -- A function reloading the application if it changed -
+            or anyway if called with force=True - which returns whether
+            it has been reloaded, or None
+        - reload_interval -- The time period between two calls of reload
+            to check if the application changed, or None
+
+    """
+
+    def __init__(
+        self,
+        server,
+        workers,
+        log_queues,
+        worker_timeout=None,
+        reload=None,
+        reload_interval=None,
+    ):
+        self.server = server
+        self.workers = workers
+        self.log_queues = log_queues
+        self.worker_timeout = worker_timeout
+        self.reload = reload
+        self.reload_interval = reload_interval
+        self._reload_checked = monotonic()
+
+        self._workers = {}  # dict({pid: _Worker})
+        self._signal_handlers = []
+        self._restarting = False
+        self._stopping = False
+
+    def serve_forever(self):
+        """Fork the workers and supervise them until being stopped"""
+        self._signal_handlers = [
+            signal_handler(signal.SIGHUP, self.restart),
+            signal_handler(signal.SIGTERM, self.stop),
+            signal_handler(signal.SIGINT, self.stop),
+        ]
+        logger.info("starting %d workers", self.workers)
+        try:
+            while not self._stopping or self._workers:
+                self._supervise()
+                sleep(PREFORK_SUPERVISE_INTERVAL)
+        finally:
+            for handler in self._signal_handlers:
+                handler.cancel()
+            self.server.close()
+
+    def restart(self):
+        """Gracefully replace the workers by new ones"""
+        self._restarting = True
+
+    def stop(self):
+        """Gracefully stop the workers, then the server"""
+        self._stopping = True
+
+    def _supervise(self):
+        # Reap the dead workers - which are watched by gevent since forked
+        # with its fork, so that its waitpid must be used
+        while self._workers:
+            try:
+                pid, status = waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            worker = self._workers.pop(pid, None)
+            if worker is None:
+                continue
+            worker.relay.kill(block=False)
+            worker.sender.kill(block=False)
+            worker.channel.sock.close()
+            if not (worker.retiring or self._stopping):
+                logger.warning(
+                    "worker %d died (status: %d), respawning it", pid, status
+                )
+
+        if self._stopping:
+            self._retire(self._workers.values())
+            return
+
+        if self._restarting:
+            self._restarting = False
+            if self.reload is not None:
+                self.reload(force=True)
+            logger.info("restarting the workers")
+            self._retire(self._workers.values())
+        elif (
+            self.reload is not None
+            and self.reload_interval is not None
+            and monotonic() - self._reload_checked >= self.reload_interval
+        ):
+            self._reload_checked = monotonic()
+            if self.reload():
+                logger.info("restarting the workers")
+                self._retire(self._workers.values())
+
+        # Kill the unresponsive workers, which will be respawned once reaped
+        if self.worker_timeout is not None:
+            now = monotonic()
+            for worker in self._workers.values():
+                if now - worker.last_seen > self.worker_timeout:
+                    logger.error("worker %d is unresponsive, killing it", worker.pid)
+                    self._kill(worker.pid, signal.SIGKILL)
+
+        # Kill the retiring workers which exceeded their graceful timeout
+        self._retire([w for w in self._workers.values() if w.retiring])
+
+        active = [w for w in self._workers.values() if not w.retiring]
+        for _ in range(self.workers - len(active)):
+            self._spawn_worker()
+
+    def _retire(self, workers):
+        now = monotonic()
+        for worker in workers:
+            if not worker.retiring:
+                worker.retiring = now
+                self._kill(worker.pid, signal.SIGTERM)
+            elif now - worker.retiring > PREFORK_GRACEFUL_TIMEOUT + 5:
+                self._kill(worker.pid, signal.SIGKILL)
+
+    def _kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _spawn_worker(self):
+        parent_sock, child_sock = socketpair()
+
+        pid = fork()
+        if pid == 0:
+            parent_sock.close()
+            self._run_worker(LogChannel(child_sock))
+
+        child_sock.close()
+        worker = self._workers[pid] = _Worker(pid, LogChannel(parent_sock))
+        worker.relay = spawn(self._relay, worker)
+        worker.sender = spawn(self._send, worker)
+        logger.debug("worker %d started", pid)
+
+    def _relay(self, worker):
+        """Relay the publications of a worker to all of them"""
+        try:
+            while True:
+                frame = worker.channel.recv_frame()
+                worker.last_seen = monotonic()
+                if not frame:
+                    # Heartbeat
+                    continue
+                # Never wait for a worker, so that a slow one does not
+                # hold up the publications of the others
+                for w in list(self._workers.values()):
+                    if w.lagging:
+                        continue
+                    try:
+                        w.outgoing.put_nowait(frame)
+                    except Full:
+                        logger.error(
+                            "worker %d does not read its publications, restarting it",
+                            w.pid,
+                        )
+                        w.lagging = True
+                        self._retire([w])
+        except (EOFError, OSError):
+            pass
+
+    def _send(self, worker):
+        """Send the publications relayed to a worker"""
+        try:
+            while True:
+                worker.channel.send_frame(worker.outgoing.get())
+        except OSError:
+            # The worker is gone, it will be reaped
+            pass
+
+    def _run_worker(self, channel):
+        """Serve the requests in a forked worker - never returns"""
+        status = 0
+        try:
+            # Drop what belongs to the parent process
+            for handler in self._signal_handlers:
+                handler.cancel()
+            for worker in self._workers.values():
+                worker.relay.kill(block=False)
+                worker.sender.kill(block=False)
+                worker.channel.sock.close()
+            self._workers = {}
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+            def stop():
+                self.server.stop(timeout=PREFORK_GRACEFUL_TIMEOUT)
+
+            def heartbeat():
+                while True:
+                    channel.send_frame()
+                    sleep(PREFORK_HEARTBEAT_INTERVAL)
+
+            def listen():
+                try:
+                    while True:
+                        message = channel.recv()
+                        if message is not None:
+                            self.log_queues.receive(*message)
+                except (EOFError, OSError):
+                    # The parent process is gone
+                    spawn(stop)
+
+            self.log_queues.channel = channel
+            signal_handler(signal.SIGTERM, stop)
+            spawn(heartbeat)
+            spawn(listen)
+
+            self.server.serve_forever()
+        except BaseException:
+            logger.exception("worker %d failed", os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
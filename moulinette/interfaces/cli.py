@@ -1,14 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import os
+import csv
 import sys
 import locale
+import signal
+import functools
+import itertools
 import logging
 import argparse
-import tempfile
 from collections import OrderedDict
-from datetime import date, datetime
-from subprocess import call
+from collections.abc import Iterator
+from datetime import date, datetime, timezone
 
 from moulinette import m18n, Moulinette
 from moulinette.actionsmap import ActionsMap
@@ -16,9 +19,10 @@ from moulinette.core import MoulinetteError, MoulinetteValidationError
 from moulinette.interfaces import (
     BaseActionsMapParser,
     ExtendedArgumentParser,
-    JSONExtendedEncoder,
+    json_encode,
 )
 from moulinette.utils import log
+from moulinette.utils.profiling import PROFILE_ENV, SamplingProfiler
 
 # Monkeypatch _get_action_name function because there is an annoying bug
 # Explained here: https://bugs.python.org/issue29298
@@ -85,6 +89,119 @@ def colorize(astr, color):
         return astr
 
 
+# Size above which the buffered output is written to the standard output
+OUTPUT_CHUNK_SIZE = 65536
+
+# Number of rows from which the widths of the columns of a table are computed
+TABLE_SAMPLE_SIZE = 100
+
+# Name of the column holding the key of the records of a dictionary
+RECORD_KEY = "key"
+
+# The formats in which the result of an action can be output
+OUTPUT_FORMATS = ["json", "ndjson", "csv", "tsv", "table", "plain", "none"]
+
+# Key of the entries of a list, which are output without key
+_NO_KEY = object()
+
+
+class OutputBuffer:
+    """Buffer the output of a result to write it by chunks
+
+    Lines are written to the standard output - as it is when the buffer is
+    created - once OUTPUT_CHUNK_SIZE characters are buffered, when the
+    buffer is flushed and when it is closed. Whether the output should be
+    colorized, i.e. whether it is a terminal, is checked once.
+
+    It is meant to be used as a context manager:
+
+      >>> with OutputBuffer() as out:
+      ...     out.write_line(out.colorize("key", "purple"))
+
+    """
+
+    def __init__(self, stream=None, chunk_size=OUTPUT_CHUNK_SIZE):
+        self.stream = stream if stream is not None else sys.stdout
+        self.chunk_size = chunk_size
+        self.color = os.isatty(1)
+        self._chunk = []
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def write(self, s):
+        """Buffer a string"""
+        self._chunk.append(s)
+        self._size += len(s)
+        if self._size >= self.chunk_size:
+            self.flush()
+
+    def write_line(self, s):
+        """Buffer a string followed by a newline"""
+        self.write(s + "\n")
+
+    def flush(self):
+        """Write the buffered strings to the stream"""
+        if self._chunk:
+            self.stream.write("".join(self._chunk))
+            self._chunk, self._size = [], 0
+        self.stream.flush()
+
+    def colorize(self, astr, color):
+        """Colorize a string if the output is a terminal, see colorize"""
+        if self.color:
+            return "{:s}{:s}{:s}".format(colors_codes[color], astr, END_CLI_COLOR)
+        return astr
+
+    def iterate(self, items):
+        """Iterate over items, flushing the output before waiting for the
+        next one - so that the output of each item of a generator result is
+        displayed as soon as it is rendered"""
+        for item in items:
+            yield item
+            self.flush()
+
+
+def render_plain(d, out, depth=0):
+    """Render in a plain way a value recursively, see plain_print_dict
+
+    Keyword arguments:
+        - d -- The value to render
+        - out -- The OutputBuffer to render to
+        - depth -- The recursive depth of the value
+
+    """
+    # skip first key printing
+    if depth == 0 and (isinstance(d, dict) and len(d) == 1):
+        d = next(iter(d.values()))
+
+    # Stack of the iterators over the (key, value) entries being rendered,
+    # with the depth of their values
+    stack = [(iter([(_NO_KEY, d)]), depth)]
+    write_line = out.write_line
+    while stack:
+        entries, depth = stack[-1]
+        for k, v in entries:
+            if k is not _NO_KEY:
+                write_line("{}{}".format("#" * depth, k))
+            if isinstance(v, (tuple, set)):
+                v = list(v)
+            if isinstance(v, list):
+                stack.append((((_NO_KEY, i) for i in v), depth + 1))
+                break
+            elif isinstance(v, dict):
+                stack.append((iter(v.items()), depth + 1))
+                break
+            else:
+                write_line(str(v))
+        else:
+            stack.pop()
+
+
 def plain_print_dict(d, depth=0):
     """Print in a plain way a dictionary recursively
 
@@ -107,20 +224,87 @@ def plain_print_dict(d, depth=0):
         - depth -- The recursive depth of the dictionary
 
     """
-    # skip first key printing
-    if depth == 0 and (isinstance(d, dict) and len(d) == 1):
-        _, d = d.popitem()
-    if isinstance(d, (tuple, set)):
-        d = list(d)
-    if isinstance(d, list):
-        for v in d:
-            plain_print_dict(v, depth + 1)
-    elif isinstance(d, dict):
-        for k, v in d.items():
-            print("{}{}".format("#" * (depth + 1), k))
-            plain_print_dict(v, depth + 1)
-    else:
-        print(d)
+    with OutputBuffer() as out:
+        render_plain(d, out, depth)
+
+
+def local_timezone():
+    """Return the time zone of the system
+
+    It is the zone named by the TZ environment variable if any - or read
+    from the file it gives the absolute path of, e.g. ':/etc/localtime' -
+    otherwise the one of /etc/localtime. If none can be loaded, fall back
+    to the current UTC offset of the system - which ignores daylight
+    saving time.
+
+    """
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+    tz = os.environ.get("TZ", "").lstrip(":") or "/etc/localtime"
+    try:
+        if os.path.isabs(tz):
+            with open(tz, "rb") as f:
+                return ZoneInfo.from_file(f, key=os.path.basename(tz))
+        return ZoneInfo(tz)
+    except (OSError, ValueError, ZoneInfoNotFoundError):
+        return datetime.now().astimezone().tzinfo
+
+
+class DateFormatter:
+    """Format dates in a time zone without ms and tzinfo
+
+    Naive datetimes are considered as UTC, aware ones are converted. Dates
+    are formatted as is.
+
+    Keyword arguments:
+        - tz -- The time zone to display datetimes in
+
+    """
+
+    def __init__(self, tz):
+        self.tz = tz
+
+    def format(self, _date):
+        """Format a date or datetime"""
+        if not isinstance(_date, datetime):
+            return _date.isoformat()
+        if _date.tzinfo is None:
+            _date = _date.replace(tzinfo=timezone.utc)
+        # i.e. "%Y-%m-%d %H:%M:%S", but faster than strftime
+        _date = _date.astimezone(self.tz).replace(tzinfo=None)
+        return _date.isoformat(" ", "seconds")
+
+    def format_all(self, dates):
+        """Format a list of dates or datetimes"""
+        return [self.format(d) for d in dates]
+
+
+def date_formatter(tz=None):
+    """Return the date formatter of a time zone
+
+    Formatters are cached, so that the system time zone is resolved once -
+    per value of the TZ environment variable, which may differ between the
+    commands run by a CLI server.
+
+    Keyword arguments:
+        - tz -- The name of the time zone, by default the one of the system
+
+    """
+    if tz is None:
+        return _local_date_formatter(os.environ.get("TZ"))
+    return _date_formatter(tz)
+
+
+@functools.lru_cache(maxsize=None)
+def _local_date_formatter(tz_env):
+    return DateFormatter(local_timezone())
+
+
+@functools.lru_cache(maxsize=None)
+def _date_formatter(tz):
+    from zoneinfo import ZoneInfo
+
+    return DateFormatter(ZoneInfo(tz))
 
 
 def pretty_date(_date):
@@ -129,26 +313,80 @@ def pretty_date(_date):
     Argument:
         - date -- The date or datetime to display
     """
-    import pytz  # Lazy loading, this takes like 3+ sec on a RPi2 ?!
-
-    # Deduce system timezone
-    nowutc = datetime.now(tz=pytz.utc)
-    nowtz = datetime.now()
-    nowtz = nowtz.replace(tzinfo=pytz.utc)
-    offsetHour = nowutc - nowtz
-    offsetHour = int(round(offsetHour.total_seconds() / 3600))
-    localtz = "Etc/GMT%+d" % offsetHour
-
-    # Transform naive date into UTC date
-    if _date.tzinfo is None:
-        _date = _date.replace(tzinfo=pytz.utc)
-
-    # Convert UTC date into system locale date
-    _date = _date.astimezone(pytz.timezone(localtz))
-    if isinstance(_date, datetime):
-        return _date.strftime("%Y-%m-%d %H:%M:%S")
+    return date_formatter().format(_date)
+
+
+def _pretty_dict_entries(d):
+    keys = d.keys()
+    if not isinstance(d, OrderedDict):
+        keys = sorted(keys)
+    for k in keys:
+        yield k, d[k]
+
+
+def _pretty_list_entries(v):
+    for key, value in enumerate(v):
+        if isinstance(value, tuple):
+            yield value[0], value[1]
+        elif isinstance(value, dict):
+            yield key, value
+        else:
+            yield _NO_KEY, value
+
+
+def render_pretty(d, out, depth=0):
+    """Render in a pretty way a dictionary recursively, see pretty_print_dict
+
+    The dictionary may also be an iterator - e.g. the result of a generator
+    action - whose items are rendered as those of a list, as they come.
+
+    Keyword arguments:
+        - d -- The dictionary or iterator to render
+        - out -- The OutputBuffer to render to
+        - depth -- The recursive depth of the dictionary
+
+    """
+    if isinstance(d, dict):
+        entries = _pretty_dict_entries(d)
     else:
-        return _date.strftime("%Y-%m-%d")
+        entries = _pretty_list_entries(out.iterate(d))
+
+    # Stack of the iterators over the (key, value) entries being rendered,
+    # with their depth
+    stack = [(entries, depth)]
+    write_line = out.write_line
+    formatter = date_formatter()
+    while stack:
+        entries, depth = stack[-1]
+        indent = "  " * depth
+        for k, v in entries:
+            if k is _NO_KEY:
+                # Entry of a list
+                if isinstance(v, date):
+                    v = formatter.format(v)
+                write_line("{:s}- {}".format(indent, v))
+                continue
+
+            k = out.colorize(str(k), "purple")
+            if isinstance(v, (tuple, set)):
+                v = list(v)
+            if isinstance(v, list) and len(v) == 1:
+                v = v[0]
+            if isinstance(v, dict):
+                write_line("{:s}{}: ".format(indent, k))
+                stack.append((_pretty_dict_entries(v), depth + 1))
+                break
+            elif isinstance(v, list):
+                if all(isinstance(i, date) for i in v):
+                    v = formatter.format_all(v)
+                write_line("{:s}{}: ".format(indent, k))
+                stack.append((_pretty_list_entries(v), depth + 1))
+                break
+            elif isinstance(v, date):
+                v = formatter.format(v)
+            write_line("{:s}{}: {}".format(indent, k, v))
+        else:
+            stack.pop()
 
 
 def pretty_print_dict(d, depth=0):
@@ -161,34 +399,146 @@ def pretty_print_dict(d, depth=0):
         - depth -- The recursive depth of the dictionary
 
     """
-    keys = d.keys()
-    if not isinstance(d, OrderedDict):
-        keys = sorted(keys)
-    for k in keys:
-        v = d[k]
-        k = colorize(str(k), "purple")
-        if isinstance(v, (tuple, set)):
-            v = list(v)
-        if isinstance(v, list) and len(v) == 1:
-            v = v[0]
-        if isinstance(v, dict):
-            print("{:s}{}: ".format("  " * depth, k))
-            pretty_print_dict(v, depth + 1)
-        elif isinstance(v, list):
-            print("{:s}{}: ".format("  " * depth, k))
-            for key, value in enumerate(v):
-                if isinstance(value, tuple):
-                    pretty_print_dict({value[0]: value[1]}, depth + 1)
-                elif isinstance(value, dict):
-                    pretty_print_dict({key: value}, depth + 1)
-                else:
-                    if isinstance(v, date):
-                        v = pretty_date(v)
-                    print("{:s}- {}".format("  " * (depth + 1), value))
+    with OutputBuffer() as out:
+        render_pretty(d, out, depth)
+
+
+def iter_records(ret):
+    """Iterate over the records of a result
+
+    The records of a list, a tuple or an iterator - e.g. the result of a
+    generator action - are its items. A listing - i.e. a dictionary with a
+    single key whose value is a list or a dictionary of dictionaries - is
+    replaced by its value: the records of {'users': {'alice': {...}}} are
+    the dictionaries of the users, with their key in a RECORD_KEY column.
+    Any other result - e.g. {'status': 'ok'} - is a single record.
+
+    Keyword arguments:
+        - ret -- The result of an action
+
+    """
+    if isinstance(ret, dict) and len(ret) == 1:
+        value = next(iter(ret.values()))
+        if isinstance(value, (list, tuple)):
+            return iter(value)
+        if (
+            isinstance(value, dict)
+            and value
+            and all(isinstance(v, dict) for v in value.values())
+        ):
+            return ({RECORD_KEY: k, **v} for k, v in value.items())
+    if isinstance(ret, (list, tuple, Iterator)):
+        return iter(ret)
+    return iter([ret])
+
+
+def _cell(value):
+    """Return the string of a value in a CSV, TSV or table cell"""
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list, tuple, set)):
+        return json_encode(value)
+    return str(value)
+
+
+def _rows(records, columns=None):
+    """Iterate over the rows of records, the first being the header
+
+    Unless given, the columns are the keys of the first record. A record
+    which is not a dictionary is a row of a single 'value' column.
+
+    """
+    header = columns is not None
+    if header:
+        yield list(columns)
+    for record in records:
+        if not isinstance(record, dict):
+            record = {"value": record}
+        if not header:
+            columns, header = list(record), True
+            yield columns
+        yield [_cell(record.get(column)) for column in columns]
+
+
+def _render_table(rows, out):
+    """Render rows as an aligned table
+
+    The widths of the columns are computed from the first
+    TABLE_SAMPLE_SIZE rows, which are buffered. The next rows are rendered
+    as they come, longer cells overflowing their column.
+
+    """
+    sample = list(itertools.islice(rows, TABLE_SAMPLE_SIZE))
+    if not sample:
+        return
+    widths = [0] * len(sample[0])
+    for row in sample:
+        for i, cell in enumerate(row):
+            widths[i] = max(widths[i], len(cell))
+
+    def line(row):
+        return "  ".join(c.ljust(w) for c, w in zip(row, widths)).rstrip()
+
+    header = sample.pop(0)
+    out.write_line(out.colorize(line(header), "purple"))
+    out.write_line(line(["-" * w for w in widths]))
+    for row in itertools.chain(sample, rows):
+        out.write_line(line(row))
+
+
+def print_result(ret, output_as=None, columns=None):
+    """Print the result of an action
+
+    The result is rendered in a buffer written by chunks to the standard
+    output. An iterator result - e.g. of a generator action - is consumed
+    and rendered item by item, so that its first items are displayed
+    without waiting for the others.
+
+    Keyword arguments:
+        - ret -- The result to print
+        - output_as -- The output format, see Interface.run
+        - columns -- A list of the columns to output for the csv, tsv and
+            table formats, by default the keys of the first record
+
+    """
+    with OutputBuffer() as out:
+        if output_as == "json":
+            if isinstance(ret, Iterator):
+                # Open the array with the first item, so that nothing is
+                # output if the action fails before
+                separator = "["
+                for item in out.iterate(ret):
+                    out.write(separator)
+                    out.write(json_encode(item))
+                    separator = ","
+                if separator == "[":
+                    out.write(separator)
+                out.write_line("]")
+            else:
+                out.write_line(json_encode(ret))
+        elif output_as == "ndjson":
+            for record in out.iterate(iter_records(ret)):
+                out.write_line(json_encode(record))
+        elif output_as in ("csv", "tsv"):
+            writer = csv.writer(
+                out,
+                delimiter="," if output_as == "csv" else "\t",
+                lineterminator="\n",
+            )
+            for row in out.iterate(_rows(iter_records(ret), columns)):
+                writer.writerow(row)
+        elif output_as == "table":
+            _render_table(_rows(out.iterate(iter_records(ret)), columns), out)
+        elif output_as == "plain":
+            if isinstance(ret, Iterator):
+                for item in out.iterate(ret):
+                    render_plain(item, out, 1)
+            else:
+                render_plain(ret, out)
+        elif isinstance(ret, (dict, Iterator)):
+            render_pretty(ret, out)
         else:
-            if isinstance(v, date):
-                v = pretty_date(v)
-            print("{:s}{}: {}".format("  " * depth, k, v))
+            out.write_line(str(ret))
 
 
 def get_locale():
@@ -296,6 +646,9 @@ class ActionsMapParser(BaseActionsMapParser):
         self._parser = parser or ExtendedArgumentParser()
         self._subparsers = self._parser.add_subparsers(**subparser_kwargs)
         self.global_parser = parent.global_parser if parent else None
+        # The action parsers of the whole tree by tid, to retrieve them
+        # without walking the subparsers
+        self._action_parsers = parent._action_parsers if parent else {}
 
         if top_parser:
             self.global_parser = self._parser.add_argument_group("global arguments")
@@ -308,6 +661,7 @@ class ActionsMapParser(BaseActionsMapParser):
     # Implement virtual properties
 
     interface = "cli"
+    parse_before_auth = True
 
     # Implement virtual methods
 
@@ -383,7 +737,7 @@ class ActionsMapParser(BaseActionsMapParser):
             A new ExtendedArgumentParser object for the action
 
         """
-        return self._subparsers.add_parser(
+        parser = self._subparsers.add_parser(
             name,
             type_="action",
             help=action_help,
@@ -392,26 +746,21 @@ class ActionsMapParser(BaseActionsMapParser):
             deprecated_alias=deprecated_alias,
             hide_in_help=hide_in_help,
         )
+        self._action_parsers[tuple(tid)] = parser
+        return parser
 
-    def auth_method(self, args):
-        ret = self.parse_args(args)
-        tid = getattr(ret, "_tid", [])
-
-        # We go down in the subparser tree until we find the leaf
-        # corresponding to the tid with a defined authentication
-        # (yeah it's a mess because the datastructure is a mess..)
-        _p = self._subparsers
-        for word in tid[1:]:
-            _p = _p.choices[word]
-            if hasattr(_p, "authentication"):
-                return _p.authentication
-            else:
-                _p = _p._actions[1]
+    def auth_method(self, args, namespace=None):
+        if namespace is None:
+            namespace = self.parse_args(args)
+        tid = getattr(namespace, "_tid", [])
 
         if tid == []:
             return None
 
-        raise MoulinetteError(f"Authentication undefined for {tid} ?", raw_msg=True)
+        try:
+            return self._action_parsers[tuple(tid)].authentication
+        except (KeyError, AttributeError):
+            raise MoulinetteError(f"Authentication undefined for {tid} ?", raw_msg=True)
 
     def parse_args(self, args, **kwargs):
         try:
@@ -426,21 +775,12 @@ class ActionsMapParser(BaseActionsMapParser):
             logger.exception(error_message)
             raise MoulinetteValidationError(error_message, raw_msg=True)
 
-    def want_to_take_lock(self, args):
-        ret = self.parse_args(args)
-        tid = getattr(ret, "_tid", [])
-        if len(tid) == 3:
-            _p = self._subparsers.choices[tid[1]]._actions[1].choices[tid[2]]
-        elif len(tid) == 4:
-            _p = (
-                self._subparsers.choices[tid[1]]
-                ._actions[1]
-                .choices[tid[2]]
-                ._actions[1]
-                .choices[tid[3]]
-            )
+    def want_to_take_lock(self, args, namespace=None):
+        if namespace is None:
+            namespace = self.parse_args(args)
+        tid = getattr(namespace, "_tid", [])
 
-        return getattr(_p, "want_to_take_lock", True)
+        return getattr(self._action_parsers[tuple(tid)], "want_to_take_lock", True)
 
 
 class Interface:
@@ -474,48 +814,74 @@ class Interface:
 
         Moulinette._interface = self
 
-    def run(self, args, output_as=None, timeout=None):
+    def run(self, args, output_as=None, timeout=None, columns=None):
         """Run the moulinette
 
         Process the action corresponding to the given arguments 'args'
-        and print the result.
+        and print the result. The action is profiled if the
+        MOULINETTE_PROFILE environment variable is set to the directory to
+        write its profile in.
 
         Keyword arguments:
             - args -- A list of argument strings
             - output_as -- Output result in another format. Possible values:
                 - json: return a JSON encoded string
+                - ndjson: return a JSON encoded record per line
+                - csv, tsv: return comma or tab separated values, with a
+                  header line, a record per line
+                - table: return an aligned table of the records
                 - plain: return a script-readable output
                 - none: do not output the result
+              See iter_records for the records of a result
             - timeout -- Number of seconds before this command will timeout because it can't acquire the lock (meaning that another command is currently running), by default there is no timeout and the command will wait until it can get the lock
+            - columns -- A list of the columns to output for the csv, tsv
+                and table formats, by default the keys of the first record
 
         """
 
-        if output_as and output_as not in ["json", "plain", "none"]:
+        if output_as and output_as not in OUTPUT_FORMATS:
             raise MoulinetteValidationError("invalid_usage")
 
         if not args:
             raise MoulinetteValidationError("invalid_usage")
 
+        # Profile the action if requested
+        profiler = None
+        if os.environ.get(PROFILE_ENV):
+            profiler = SamplingProfiler(os.environ[PROFILE_ENV])
+            profiler.start()
+
         try:
-            ret = self.actionsmap.process(args, timeout=timeout)
+            ret = self.actionsmap.process(args, timeout=timeout, profiler=profiler)
+            if output_as == "none":
+                # Run generator actions entirely anyway
+                if isinstance(ret, Iterator):
+                    for _ in ret:
+                        pass
+            elif isinstance(ret, Iterator):
+                # Generator actions are run while their result is printed,
+                # and end - e.g. release their lock - even if interrupted
+                try:
+                    print_result(ret, output_as, columns)
+                finally:
+                    close = getattr(ret, "close", None)
+                    if close is not None:
+                        close()
+            elif ret is not None:
+                print_result(ret, output_as, columns)
         except (KeyboardInterrupt, EOFError):
             raise MoulinetteError("operation_interrupted")
-
-        if ret is None or output_as == "none":
-            return
-
-        # Format and print result
-        if output_as:
-            if output_as == "json":
-                import json
-
-                print(json.dumps(ret, cls=JSONExtendedEncoder))
-            else:
-                plain_print_dict(ret)
-        elif isinstance(ret, dict):
-            pretty_print_dict(ret)
-        else:
-            print(ret)
+        except BrokenPipeError:
+            # The output has been closed, e.g. by 'head': stop there and
+            # discard what is left to flush, then exit as if killed by
+            # SIGPIPE as shells report it
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+            os.close(devnull)
+            raise SystemExit(128 + signal.SIGPIPE)
+        finally:
+            if profiler is not None:
+                profiler.stop()
 
     def authenticate(self, authenticator):
         # Hmpf we have no-use case in yunohost anymore where we need to auth
@@ -597,6 +963,9 @@ class Interface:
                     elif value in ["y", "yes"]:
                         break
 
+                import tempfile
+                from subprocess import call
+
                 initial_message = prefill.encode("utf-8")
 
                 with tempfile.NamedTemporaryFile(suffix=".tmp") as tf:
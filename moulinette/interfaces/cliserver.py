@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import errno
+import signal
+import socket
+import struct
+import logging
+import threading
+import importlib
+
+from moulinette.core import MoulinetteLock
+
+logger = logging.getLogger("moulinette.interface.cliserver")
+
+# Name of the environment variable which holds the path of the socket of the
+# CLI server running a command in-process - commands run from this command
+# do not use the server, which is busy with it
+SERVER_BUSY_ENV = "MOULINETTE_CLI_SERVER_BUSY"
+
+# Header of the request of a client, which gives the size of its payload
+_HEADER = struct.Struct("!I")
+
+# Exit status of a command sent back to the client
+_STATUS = struct.Struct("!i")
+
+# Signals which are forwarded by the client to the command
+FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+
+
+# Client ---------------------------------------------------------------
+
+
+def run_client(path, args, stdio=(0, 1, 2), options=None):
+    """Run a command through the CLI server listening on a socket
+
+    The arguments, environment, working directory and umask of the current
+    process are sent to the server along with its standard streams, so that
+    the command runs as if it was run by this process. The signals it
+    receives are forwarded to the command.
+
+    Keyword arguments:
+        - path -- The path of the Unix socket of the server
+        - args -- A list of argument strings
+        - stdio -- The file descriptors of the standard input, output and
+            error of the command
+        - options -- A dict of keyword arguments to give to the handler of
+            the server along with the arguments, which must be JSON
+            serializable
+
+    Returns:
+        The exit status of the command, or None if the server is not
+        available - in which case the command should be run in-process
+
+    """
+    # This command has been run by a command of the server, which is busy
+    if os.environ.get(SERVER_BUSY_ENV) == path:
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+
+    umask = os.umask(0)
+    os.umask(umask)
+    payload = json.dumps(
+        {
+            "args": list(args),
+            "argv0": sys.argv[0] if sys.argv else "",
+            "env": dict(os.environ),
+            "cwd": os.getcwd(),
+            "umask": umask,
+            "options": options or {},
+        }
+    ).encode("utf-8")
+
+    def forward(signum, frame):
+        try:
+            sock.send(bytes([signum]))
+        except OSError:
+            pass
+
+    previous = {}
+    with sock:
+        socket.send_fds(sock, [_HEADER.pack(len(payload)) + payload], list(stdio))
+        for signum in FORWARDED_SIGNALS:
+            previous[signum] = signal.signal(signum, forward)
+        try:
+            data = _recv_exactly(sock, _STATUS.size)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    if data is None:
+        logger.error("the CLI server closed the connection unexpectedly")
+        return 1
+    return _STATUS.unpack(data)[0]
+
+
+# Server ---------------------------------------------------------------
+
+
+class CLIServer:
+    """Serve CLI commands from a warm interpreter
+
+    The server listens on a Unix socket which only the user running it -
+    i.e. root - can connect to. It receives the commands of the clients,
+    see run_client, and runs them with the standard streams, environment,
+    working directory and umask of the client. The lock of the moulinette
+    held by an ancestor of the client - as identified by the credentials of
+    its connection - is also considered as held by the command, see
+    MoulinetteLock.client_pid. Commands thus save the
+    start of the interpreter, the import of the moulinette - and of the
+    given modules - and the warmup - e.g. loading the actions map cache and
+    building its parsers, see moulinette.cli_server - which are done once.
+
+    By default, commands are run one at a time in the server process
+    itself. If fork is set, each command is run in a child forked from the
+    server instead, which shares its warm state copy-on-write but
+    starts from a clean state, is isolated from the other commands - which
+    run concurrently - and receives the signals of the client as is.
+
+    Keyword arguments:
+        - path -- The path of the Unix socket to listen on
+        - handler -- A function which runs a command given its list of
+            argument strings - and the options of the client as keyword
+            arguments - and returns its exit status
+        - preload -- A list of names of modules to import beforehand
+        - warmup -- A function to call beforehand to warm the server up,
+            e.g. preload_actionsmap
+        - fork -- Whether to run each command in a forked child
+
+    """
+
+    def __init__(self, path, handler, preload=[], warmup=None, fork=False):
+        self.path = path
+        self.handler = handler
+        self.preload = preload
+        self.warmup = warmup
+        self.fork = fork
+
+        self._sock = None
+
+    def serve_forever(self):
+        """Listen on the socket and serve the commands"""
+        for name in self.preload:
+            importlib.import_module(name)
+        if self.warmup is not None:
+            self.warmup()
+
+        # Make sure that the standard streams can be saved and restored
+        for fd in (0, 1, 2):
+            try:
+                os.fstat(fd)
+            except OSError:
+                devnull = os.open(os.devnull, os.O_RDWR)
+                if devnull != fd:
+                    os.dup2(devnull, fd)
+                    os.close(devnull)
+
+        self._sock = self._listen()
+        logger.info("serving CLI commands on %s", self.path)
+        try:
+            while True:
+                conn, _ = self._sock.accept()
+                self.handle(conn)
+        finally:
+            self._sock.close()
+            self._sock = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def handle(self, conn):
+        """Receive a command from a connection and run it"""
+        try:
+            # Only serve the user running the server
+            pid, uid, _ = struct.unpack(
+                "3i", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, 12)
+            )
+            if uid != os.getuid():
+                logger.warning("refusing CLI command from uid %d", uid)
+                conn.close()
+                return
+
+            request, fds = self._receive(conn)
+            # Never trust the client about its identity
+            request["pid"] = pid
+        except (OSError, ValueError) as e:
+            logger.warning("invalid CLI command request: %s", e)
+            conn.close()
+            return
+
+        if self.fork:
+            try:
+                pid = self._fork(conn, request, fds)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+            # Wait for the child in the background, to serve other commands
+            threading.Thread(
+                target=self._supervise, args=(conn, pid), daemon=True
+            ).start()
+            return
+
+        with conn:
+            try:
+                status = self.run(conn, request, fds)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+            _send_status(conn, status)
+
+    def run(self, conn, request, fds):
+        """Run a command in this process, as if it was run by the client"""
+        done = threading.Event()
+        main_thread = threading.main_thread().ident
+
+        def interrupt(signum):
+            # Any forwarded signal interrupts the command, but not the server
+            signal.pthread_kill(main_thread, signal.SIGINT)
+
+        watcher = threading.Thread(
+            target=self._watch, args=(conn, done, interrupt), daemon=True
+        )
+
+        saved_fds = [os.dup(fd) for fd in (0, 1, 2)]
+        saved_env = dict(os.environ)
+        saved_cwd = os.getcwd()
+        saved_argv = sys.argv
+        saved_umask = os.umask(request["umask"])
+        try:
+            _flush()
+            _apply_request(request, fds)
+            # This server is busy until the end of the command
+            os.environ[SERVER_BUSY_ENV] = self.path
+
+            watcher.start()
+            return _run_handler(self.handler, request)
+        finally:
+            done.set()
+            _flush()
+            MoulinetteLock.client_pid = None
+            sys.argv = saved_argv
+            os.umask(saved_umask)
+            os.chdir(saved_cwd)
+            os.environ.clear()
+            os.environ.update(saved_env)
+            for fd, saved_fd in zip((0, 1, 2), saved_fds):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+
+    def _fork(self, conn, request, fds):
+        """Run a command in a forked child, as if it was run by the client"""
+        _flush()
+        pid = os.fork()
+        if pid != 0:
+            return pid
+
+        status = 1
+        try:
+            self._sock.close()
+            conn.close()
+            for signum in FORWARDED_SIGNALS:
+                signal.signal(signum, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            os.umask(request["umask"])
+            _apply_request(request, fds)
+
+            status = _run_handler(self.handler, request)
+        finally:
+            _flush()
+            os._exit(status & 0xFF)
+
+    def _supervise(self, conn, pid):
+        # Forward the signals received by the client to the child, then
+        # send its exit status once it is done
+        done = threading.Event()
+
+        def interrupt(signum):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+        watcher = threading.Thread(
+            target=self._watch, args=(conn, done, interrupt), daemon=True
+        )
+        watcher.start()
+        with conn:
+            _, status = os.waitpid(pid, 0)
+            done.set()
+            status = os.waitstatus_to_exitcode(status)
+            if status < 0:
+                # Killed by a signal, as reported by shells
+                status = 128 - status
+            _send_status(conn, status)
+
+    def _listen(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            if os.path.exists(self.path):
+                # Replace the socket file left by a server which is gone
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(self.path)
+                except ConnectionRefusedError:
+                    os.unlink(self.path)
+                else:
+                    raise OSError(errno.EADDRINUSE, os.strerror(errno.EADDRINUSE))
+                finally:
+                    probe.close()
+            sock.bind(self.path)
+            os.chmod(self.path, 0o600)
+            sock.listen(64)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _receive(self, conn):
+        data, fds, _, _ = socket.recv_fds(conn, 65536, 3)
+        if len(fds) != 3 or len(data) < _HEADER.size:
+            for fd in fds:
+                os.close(fd)
+            raise ValueError("missing standard streams or payload")
+        size = _HEADER.unpack(data[: _HEADER.size])[0]
+        payload = data[_HEADER.size :]
+        if len(payload) < size:
+            rest = _recv_exactly(conn, size - len(payload))
+            if rest is None:
+                for fd in fds:
+                    os.close(fd)
+                raise ValueError("truncated payload")
+            payload += rest
+        return json.loads(payload), fds
+
+    def _watch(self, conn, done, interrupt):
+        # Forward the signals received by the client - or interrupt the
+        # command if the client is gone - until the command is done
+        while not done.is_set():
+            try:
+                data = conn.recv(1)
+            except OSError:
+                return
+            if done.is_set():
+                return
+            if not data:
+                logger.warning("the CLI client is gone, interrupting its command")
+                interrupt(signal.SIGHUP)
+                return
+            interrupt(data[0])
+
+
+def preload_actionsmap(actionsmap):
+    """Import the modules of the categories and of the authenticators of an
+    actions map, so that they are loaded once by a CLI server
+
+    Keyword arguments:
+        - actionsmap -- The path of the actions map
+
+    """
+    from moulinette.utils.filesystem import read_yaml
+
+    actionsmap = read_yaml(actionsmap)
+    _global = actionsmap.pop("_global", {})
+    namespace = _global["namespace"]
+
+    modules = ["%s.%s" % (namespace, category) for category in actionsmap]
+    modules += [
+        "%s.authenticators.%s" % (namespace, auth)
+        for auth in set(_global.get("authentication", {}).values())
+        if auth is not None
+    ]
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("unable to preload module %s: %s", name, e)
+
+
+def _apply_request(request, fds):
+    """Make the current process run the command of a client"""
+    for fd, client_fd in zip((0, 1, 2), fds):
+        os.dup2(client_fd, fd)
+    os.umask(request["umask"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    MoulinetteLock.client_pid = request["pid"]
+    os.chdir(request["cwd"])
+    sys.argv = [request["argv0"]] + request["args"]
+
+
+def _send_status(conn, status):
+    try:
+        conn.sendall(_STATUS.pack(status))
+    except OSError:
+        pass
+
+
+def _run_handler(handler, request):
+    """Run a command handler and return its exit status"""
+    try:
+        status = handler(request["args"], **request["options"])
+    except SystemExit as e:
+        status = e.code
+    except KeyboardInterrupt:
+        return 128 + signal.SIGINT
+    except BaseException:
+        import traceback
+
+        traceback.print_exc()
+        return 1
+
+    if status is None:
+        return 0
+    elif isinstance(status, int):
+        return status
+    print(status, file=sys.stderr)
+    return 1
+
+
+def _flush():
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except (OSError, ValueError):
+            pass
+
+
+def _recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
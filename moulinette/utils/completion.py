@@ -0,0 +1,294 @@
+"""Shell completion of the CLI from a precomputed index of the actions map
+
+This module only depends on the standard library, so that it can be run as
+a script by the shell completion hooks - see completion_hook - without the
+cost of importing the moulinette, its parsers or the actions modules.
+
+"""
+
+import os
+import sys
+import json
+
+# Version of the format of the completion index
+INDEX_VERSION = 1
+
+# Argument actions which do not take a value
+FLAG_ACTIONS = {"store_true", "store_false", "store_const", "count", "help", "version"}
+
+# Options which every action parser accepts
+HELP_OPTIONS = ["-h", "--help"]
+
+
+# Index ----------------------------------------------------------------
+
+
+def completion_index_path(actionsmap_yml):
+    """Return the path of the completion index of an actions map"""
+    return os.path.join(
+        os.path.dirname(actionsmap_yml),
+        ".%s.completion.json" % os.path.basename(actionsmap_yml),
+    )
+
+
+def build_completion_index(actionsmap, global_arguments=()):
+    """Build the completion index of an actions map
+
+    The index is a compact version of the actions map which only keeps
+    what is needed to complete a command line: the names and aliases of the
+    categories, subcategories and actions, the option strings of the
+    arguments of the actions and their choices - and those of the global
+    arguments, which are accepted anywhere in the command line.
+
+    Keyword arguments:
+        - actionsmap -- The actions map as a dict, as read from its file
+        - global_arguments -- The argparse actions of the global arguments
+            of the CLI, i.e. of its top parser
+
+    """
+
+    def names(name, options):
+        aliases = list(options.get("aliases", []))
+        aliases += list(options.get("deprecated_alias", []))
+        return {"name": name, "aliases": aliases}
+
+    def action(name, options):
+        ret = names(name, options)
+        ret["hidden"] = bool(options.get("hide_in_help") or options.get("deprecated"))
+        ret["options"] = {}
+        ret["positionals"] = []
+        for argument_name, argument in (options.get("arguments") or {}).items():
+            argument = argument or {}
+            choices = [str(c) for c in argument.get("choices", [])]
+            if not str(argument_name).startswith("-"):
+                ret["positionals"].append(choices)
+                continue
+            option = {
+                "flag": argument.get("action") in FLAG_ACTIONS
+                or argument.get("nargs") == 0,
+                "choices": choices,
+            }
+            for option_string in [argument_name, argument.get("full")]:
+                if option_string:
+                    ret["options"][str(option_string)] = option
+        return ret
+
+    def category(name, options):
+        ret = names(name, options)
+        ret["actions"] = [
+            action(n, o or {}) for n, o in (options.get("actions") or {}).items()
+        ]
+        ret["subcategories"] = [
+            category(n, o or {})
+            for n, o in (options.get("subcategories") or {}).items()
+        ]
+        return ret
+
+    global_options = {}
+    for argument in global_arguments:
+        option = {
+            "flag": argument.nargs == 0,
+            "choices": [str(c) for c in argument.choices or []],
+        }
+        for option_string in argument.option_strings:
+            global_options[option_string] = option
+
+    return {
+        "version": INDEX_VERSION,
+        "globals": global_options,
+        "categories": [
+            category(n, o or {}) for n, o in actionsmap.items() if n != "_global"
+        ],
+    }
+
+
+def write_completion_index(path, actionsmap, global_arguments=()):
+    """Build and write the completion index of an actions map
+
+    Keyword arguments:
+        - path -- The path of the index, see completion_index_path
+        - actionsmap -- The actions map as a dict, as read from its file
+        - global_arguments -- The argparse actions of the global arguments
+            of the CLI, i.e. of its top parser
+
+    """
+    index = build_completion_index(actionsmap, global_arguments)
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+# Completion -----------------------------------------------------------
+
+
+def complete(index, words, cword):
+    """Return the candidates to complete a word of a command line
+
+    Keyword arguments:
+        - index -- The completion index, see build_completion_index
+        - words -- The words of the command line, without the program
+        - cword -- The position of the word to complete in words
+
+    Returns:
+        The sorted list of the candidates starting with the word
+
+    """
+    current = words[cword] if cword < len(words) else ""
+    previous = words[:cword]
+    # Indexes written before the global arguments were added lack them
+    global_options = index.get("globals", {})
+
+    def find(nodes, word):
+        for node in nodes:
+            if word == node["name"] or word in node["aliases"]:
+                return node
+        return None
+
+    def visible(nodes):
+        return [n["name"] for n in nodes if not n.get("hidden")]
+
+    # Go down the categories until the action
+    candidates = []
+    nodes = index["categories"]
+    node = None
+    position = 0
+    expecting = None
+    while position < len(previous):
+        word = previous[position]
+        position += 1
+        if expecting is not None:
+            # The value of a global argument
+            expecting = None
+            continue
+        if word.startswith("-"):
+            if word in global_options and not global_options[word]["flag"]:
+                expecting = global_options[word]
+            continue
+        node = find(nodes, word)
+        if node is None:
+            return []
+        if "options" in node:
+            break
+        nodes = node["subcategories"] + node["actions"]
+    else:
+        if expecting is not None:
+            candidates = expecting["choices"]
+        elif current.startswith("-"):
+            candidates = list(global_options) + HELP_OPTIONS
+        elif node is None:
+            candidates = visible(nodes)
+        else:
+            candidates = visible(node["subcategories"] + node["actions"])
+        return sorted({c for c in candidates if c.startswith(current)})
+
+    # Complete the arguments of the action
+    options = dict(global_options)
+    options.update(node["options"])
+    positionals = 0
+    expecting = None
+    for word in previous[position:]:
+        if expecting is not None:
+            expecting = None
+        elif word in options:
+            if not options[word]["flag"]:
+                expecting = options[word]
+        elif not word.startswith("-"):
+            positionals += 1
+
+    if expecting is not None:
+        candidates = expecting["choices"]
+    elif current.startswith("-"):
+        candidates = list(options) + HELP_OPTIONS
+    elif positionals < len(node["positionals"]):
+        candidates = node["positionals"][positionals]
+    return sorted({c for c in candidates if c.startswith(current)})
+
+
+def load_index(path):
+    """Load a completion index, or return None if it is not usable"""
+    try:
+        with open(path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+        return None
+    return index
+
+
+# Shell hooks ----------------------------------------------------------
+
+BASH_HOOK = """\
+_{function}() {{
+    local IFS=$'\\n'
+    COMPREPLY=($({python} -S {script} {index} "$((COMP_CWORD - 1))" \\
+        "${{COMP_WORDS[@]:1}}" 2>/dev/null))
+}}
+complete -o default -F _{function} {prog}
+"""
+
+ZSH_HOOK = """\
+#compdef {prog}
+_{function}() {{
+    local -a candidates
+    candidates=("${{(@f)$({python} -S {script} {index} "$((CURRENT - 2))" \\
+        "${{(@)words[2,-1]}}" 2>/dev/null)}}")
+    compadd -a candidates
+}}
+compdef _{function} {prog}
+"""
+
+
+def completion_hook(shell, prog, index, python="python3"):
+    """Return the completion hook of a program for a shell
+
+    Keyword arguments:
+        - shell -- The shell, either 'bash' or 'zsh'
+        - prog -- The name of the program to complete
+        - index -- The path of the completion index of its actions map
+        - python -- The Python interpreter to run the completion with
+
+    """
+    hooks = {"bash": BASH_HOOK, "zsh": ZSH_HOOK}
+    if shell not in hooks:
+        raise ValueError("unsupported shell '%s'" % shell)
+    return hooks[shell].format(
+        function="%s_complete" % prog.replace("-", "_"),
+        prog=prog,
+        python=python,
+        script=os.path.abspath(__file__),
+        index=index,
+    )
+
+
+def main(argv):
+    """Print the completion candidates - or a shell hook - one per line
+
+    Usage:
+        completion.py <index> <cword> <word>...
+        completion.py --hook <shell> <prog> <index>
+
+    """
+    if argv[:1] == ["--hook"] and len(argv) == 4:
+        sys.stdout.write(completion_hook(argv[1], argv[2], argv[3]))
+        return 0
+    if len(argv) < 2:
+        sys.stderr.write(main.__doc__)
+        return 2
+
+    index = load_index(argv[0])
+    if index is None:
+        return 1
+    try:
+        cword = int(argv[1])
+    except ValueError:
+        return 2
+    candidates = complete(index, argv[2:], cword)
+    if candidates:
+        sys.stdout.write("\n".join(candidates) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
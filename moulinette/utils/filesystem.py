@@ -1,6 +1,4 @@
 import os
-import yaml
-import toml
 import errno
 import shutil
 import json
@@ -11,6 +9,10 @@ from collections import OrderedDict
 
 from moulinette import m18n
 from moulinette.core import MoulinetteError
+from moulinette.utils.lazy import lazy_import
+
+yaml = lazy_import("yaml")
+toml = lazy_import("toml")
 
 # Files & directories --------------------------------------------------
 
@@ -0,0 +1,32 @@
+import sys
+import importlib.util
+
+
+def lazy_import(name):
+    """Import a module lazily
+
+    Return the module if it has already been imported, otherwise a module
+    which is actually loaded on first access to one of its attributes. Heavy
+    dependencies which are not needed by every command - e.g. yaml or toml -
+    should be imported this way, see test_import_time.
+
+    Keyword arguments:
+        - name -- The name of a top-level module
+
+    Raises:
+        ImportError -- If the module cannot be found
+
+    """
+    try:
+        return sys.modules[name]
+    except KeyError:
+        pass
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError("No module named '%s'" % name, name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,101 @@
+import os
+import sys
+import logging
+import threading
+
+from collections import Counter
+
+logger = logging.getLogger("moulinette.utils.profiling")
+
+# Name of the environment variable which enables the profiling of a CLI run,
+# given the directory to write the profile in
+PROFILE_ENV = "MOULINETTE_PROFILE"
+
+# Time period in seconds between two samples of the stack
+PROFILE_INTERVAL = 0.005
+
+
+class SamplingProfiler:
+    """Sample the stack of a greenlet periodically
+
+    A thread captures the stack of the profiled greenlet - the one which
+    started the profiler - every 'interval' seconds, and counts identical
+    stacks. Once stopped, the stacks are written in the collapsed format
+    understood by flamegraph tools - one 'frame;frame;frame count' line per
+    stack - in a file named after the tag of the profiler, i.e. the id of
+    the profiled action.
+
+    While the greenlet runs, its stack is the one of its thread as given by
+    sys._current_frames. While it is switched out - e.g. waiting for I/O
+    while other greenlets of the server run - its suspended stack is
+    sampled instead, so that the profile is the one of the wall-clock time
+    of the action rather than of whatever runs in the thread.
+
+    Keyword arguments:
+        - directory -- The directory to write the profile in
+        - interval -- The time period in seconds between two samples
+
+    """
+
+    def __init__(self, directory, interval=PROFILE_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.tag = None
+        self.stacks = Counter()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start sampling the stack of the current greenlet"""
+        from greenlet import getcurrent
+
+        target = (threading.get_ident(), getcurrent())
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._sample, args=target, name="profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and write the profile
+
+        Returns:
+            The path of the profile, or None if it was not started
+
+        """
+        if self._thread is None:
+            return None
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        return self.write()
+
+    def write(self):
+        """Write the sampled stacks in the collapsed format"""
+        tag = self.tag or "%d.0" % os.getpid()
+        path = os.path.join(self.directory, "%s.folded" % tag)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("%s %d\n" % (stack, count))
+        logger.debug("profile of action [%s] written to %s", tag, path)
+        return path
+
+    def _sample(self, thread_id, glet):
+        while not self._stopped.wait(self.interval):
+            # The frame of a greenlet is only set while it is switched out
+            frame = glet.gr_frame
+            if frame is None:
+                frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+
+
+def collapse_stack(frame):
+    """Return a stack as a string of frames from the outermost, separated
+    by semicolons"""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append("%s:%s" % (code.co_filename, code.co_name))
+        frame = frame.f_back
+    return ";".join(reversed(frames))
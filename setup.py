@@ -48,6 +48,8 @@ test_deps = [
 extras = {
     "install": install_deps,
     "tests": test_deps,
+    # Faster JSON serialization backend, see moulinette.interfaces.json_encode
+    "orjson": ["orjson"],
 }
 
 setup(
@@ -60,7 +62,7 @@ setup(
     license="AGPL",
     packages=find_packages(exclude=["test"]),
     data_files=[("/usr/share/moulinette/locales", locale_files)],
-    python_requires=">=3.7.0,<3.10",
+    python_requires=">=3.9.0,<3.10",
     install_requires=install_deps,
     tests_require=test_deps,
     extras_require=extras,
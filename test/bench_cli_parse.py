@@ -0,0 +1,76 @@
+"""Benchmark the parsing of CLI arguments on a wide actions map
+
+It compares the time needed to parse the arguments of an action and to
+retrieve its authentication and lock mode, either by parsing them for each
+of these - as it was done before - or once.
+
+Run it from the repository root with:
+
+    PYTHONPATH=. python3 test/bench_cli_parse.py
+
+"""
+
+import os
+import argparse
+import tempfile
+import timeit
+
+import yaml
+
+from moulinette import m18n
+from moulinette.actionsmap import ActionsMap
+from moulinette.interfaces.cli import ActionsMapParser
+
+
+def wide_actionsmap(categories=60, actions=30, arguments=8):
+    actionsmap = {
+        "_global": {
+            "namespace": "moulibench",
+            "authentication": {"api": "dummy", "cli": "dummy"},
+            "cache": False,
+        }
+    }
+    for c in range(categories):
+        actionsmap[f"category{c}"] = {
+            "actions": {
+                f"action{a}": {
+                    "arguments": {
+                        f"--option{i}": {"help": f"Option {i}"}
+                        for i in range(arguments)
+                    }
+                }
+                for a in range(actions)
+            }
+        }
+    return actionsmap
+
+
+def main():
+    m18n.set_locales_dir(os.path.join(os.path.dirname(__file__), "..", "locales"))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "moulibench.yml")
+        with open(path, "w") as f:
+            yaml.safe_dump(wide_actionsmap(), f)
+        parser = ActionsMapParser(top_parser=argparse.ArgumentParser(add_help=False))
+        ActionsMap(path, parser)
+
+    args = ["category59", "action29", "--option3", "value", "--option7", "value"]
+
+    def parse_each_time():
+        parser.auth_method(args)
+        parser.parse_args(args)
+        parser.want_to_take_lock(args)
+
+    def parse_once():
+        namespace = parser.parse_args(args)
+        parser.auth_method(args, namespace=namespace)
+        parser.want_to_take_lock(args, namespace=namespace)
+
+    for name, func in [("each time", parse_each_time), ("once", parse_once)]:
+        duration = min(timeit.repeat(func, number=100, repeat=5)) / 100
+        print(f"{name:>10}: {duration * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Benchmark the JSON serialization backends on large nested results
+
+Run it from the repository root with:
+
+    PYTHONPATH=. python3 test/bench_serialize.py
+
+"""
+
+import timeit
+
+from datetime import datetime
+
+from moulinette.interfaces import json_backends
+
+
+def large_nested_result(count=20000):
+    return {
+        "logs": [
+            {
+                "name": f"operation_{i}",
+                "started_at": datetime(2023, 1, 1, 12, i % 60, i % 60),
+                "success": i % 3 != 0,
+                "tags": {"app", f"tag{i % 10}"},
+                "metadata": {"args": ["--force", str(i)], "env": {"LANG": "C"}},
+            }
+            for i in range(count)
+        ]
+    }
+
+
+def main():
+    content = large_nested_result()
+    for name, module, encode in json_backends:
+        try:
+            __import__(module)
+        except ImportError:
+            print(f"{name:>8}: not installed")
+            continue
+        duration = min(timeit.repeat(lambda: encode(content), number=1, repeat=5))
+        print(f"{name:>8}: {duration * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
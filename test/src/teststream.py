@@ -0,0 +1,21 @@
+import logging
+
+from moulinette.core import MoulinetteValidationError
+
+logger = logging.getLogger("moulitest.teststream")
+
+
+def teststream_list(count):
+    for i in range(count):
+        yield {"id": i, "name": f"item{i}"}
+
+
+def teststream_error():
+    raise MoulinetteValidationError("invalid_usage")
+    yield
+
+
+def teststream_log(count):
+    for i in range(count):
+        logger.info(f"line {i}")
+    return count
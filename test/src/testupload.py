@@ -0,0 +1,3 @@
+def testupload_file(file):
+    with file:
+        return {"path": file.name, "content": file.read()}
@@ -275,6 +275,37 @@ def test_actions_map_import_error(mocker):
     assert expected_msg in str(exception)
 
 
+def test_lock_wait_is_cooperative(tmp_path, mocker):
+    import subprocess
+    import gevent
+    from moulinette.core import MoulinetteLock
+
+    mocker.patch.object(MoulinetteLock, "base_lockfile", str(tmp_path / "%s.lock"))
+    # The lock is held by another process, which is not an ancestor
+    holder = subprocess.Popen(["sleep", "30"])
+    try:
+        (tmp_path / "moulitest.lock").write_text(str(holder.pid))
+        lock = MoulinetteLock("moulitest", timeout=0.5, interval=0.05)
+
+        ticks = []
+
+        def tick():
+            while True:
+                ticks.append(1)
+                gevent.sleep(0.05)
+
+        ticker = gevent.spawn(tick)
+        with pytest.raises(MoulinetteError):
+            lock.acquire()
+        ticker.kill()
+    finally:
+        holder.kill()
+        holder.wait()
+
+    # Other greenlets ran while waiting for the lock
+    assert len(ticks) > 3
+
+
 def test_actions_map_cli():
     from moulinette.interfaces.cli import ActionsMapParser
     import argparse
@@ -307,3 +338,54 @@ def test_actions_map_cli():
     assert parser.auth_method(["testauth", "default"]) == "dummy"
     assert parser.auth_method(["testauth", "only-api"]) is None
     assert parser.auth_method(["testauth", "only-cli"]) == "dummy"
+
+    namespace = parser.parse_args(["testauth", "subcat", "default"])
+    assert parser.auth_method([], namespace=namespace) == "dummy"
+
+
+def test_actions_map_cli_parse_once(moulinette_cli, mocker, capsys):
+    from moulinette.interfaces.cli import ActionsMapParser
+
+    parse_args = mocker.spy(ActionsMapParser, "parse_args")
+
+    moulinette_cli.run(["testauth", "none"], output_as="plain")
+
+    assert parse_args.call_count == 1
+    assert "some_data_from_none" in capsys.readouterr().out
+
+
+def test_iterate_then_exit():
+    from contextlib import ExitStack
+    from moulinette.actionsmap import _IterateThenExit
+
+    def make(items):
+        released = []
+        stack = ExitStack()
+        stack.callback(released.append, True)
+        return _IterateThenExit(iter(items), stack), released
+
+    # Exhausted
+    it, released = make([1, 2])
+    assert list(it) == [1, 2]
+    assert released == [True]
+
+    # Closed or garbage-collected before its first item
+    it, released = make([1, 2])
+    it.close()
+    assert released == [True]
+    assert list(it) == []
+
+    it, released = make([1, 2])
+    del it
+    assert released == [True]
+
+    # Failing
+    def failing():
+        yield 1
+        raise ValueError()
+
+    it, released = make(failing())
+    assert next(it) == 1
+    with pytest.raises(ValueError):
+        next(it)
+    assert released == [True]
@@ -0,0 +1,1021 @@
+import os
+import json
+import pytest
+
+
+class TestStreaming:
+    def test_stream_json_array(self, moulinette_webapi):
+        r = moulinette_webapi.get("/test-stream/list/3", status=200)
+
+        assert r.content_type == "application/json"
+        assert r.json == [
+            {"id": 0, "name": "item0"},
+            {"id": 1, "name": "item1"},
+            {"id": 2, "name": "item2"},
+        ]
+
+    def test_stream_empty(self, moulinette_webapi):
+        r = moulinette_webapi.get("/test-stream/list/0", status=200)
+
+        assert r.json == []
+
+    def test_stream_large(self, moulinette_webapi):
+        r = moulinette_webapi.get("/test-stream/list/5000", status=200)
+
+        assert len(r.json) == 5000
+        assert r.json[-1] == {"id": 4999, "name": "item4999"}
+
+    def test_stream_ndjson(self, moulinette_webapi):
+        r = moulinette_webapi.get(
+            "/test-stream/list/3",
+            headers={"Accept": "application/x-ndjson"},
+            status=200,
+        )
+
+        assert r.content_type == "application/x-ndjson"
+        lines = r.text.splitlines()
+        assert [json.loads(line) for line in lines] == [
+            {"id": 0, "name": "item0"},
+            {"id": 1, "name": "item1"},
+            {"id": 2, "name": "item2"},
+        ]
+
+    def test_stream_error_before_first_item(self, moulinette_webapi):
+        moulinette_webapi.get("/test-stream/error", status=400)
+
+
+def test_stream_cli(moulinette_cli, capsys):
+    moulinette_cli.run(["teststream", "list", "2"], output_as="json")
+    message = capsys.readouterr()
+
+    assert json.loads(message.out) == [
+        {"id": 0, "name": "item0"},
+        {"id": 1, "name": "item1"},
+    ]
+
+
+class TestLogQueues:
+    def test_stream_ring_buffer(self):
+        from moulinette.interfaces.api import SessionStream
+
+        stream = SessionStream(maxlen=3)
+        for i in range(5):
+            stream.put(("info", f"message {i}"))
+
+        assert stream.seq == 5
+        # Only the last 3 messages are kept
+        assert stream.get(0, timeout=0) == [
+            (3, ("info", "message 2")),
+            (4, ("info", "message 3")),
+            (5, ("info", "message 4")),
+        ]
+        assert stream.get(4, timeout=0) == [(5, ("info", "message 4"))]
+        assert stream.get(5, timeout=0) == []
+
+    def test_stream_subscribers_cursors(self):
+        from moulinette.interfaces.api import LogQueues
+
+        queues = LogQueues()
+        stream = queues.stream("session")
+        cursor_a = cursor_b = stream.seq
+
+        assert queues.publish("session", ("info", "foo"))
+        assert queues.publish("session", ("warning", "bar"))
+        assert not queues.publish("unknown", ("info", "foo"))
+
+        # Each subscriber gets all messages through its own cursor
+        messages_a = stream.get(cursor_a, timeout=0)
+        messages_b = stream.get(cursor_b, timeout=0)
+        assert (
+            messages_a
+            == messages_b
+            == [
+                (1, ("info", "foo")),
+                (2, ("warning", "bar")),
+            ]
+        )
+
+        # ... and replays from its last seen sequence number
+        cursor_a = messages_a[0][0]
+        assert stream.get(cursor_a, timeout=0) == [(2, ("warning", "bar"))]
+
+    def test_evict_idle_streams(self):
+        from moulinette.interfaces.api import LogQueues
+
+        queues = LogQueues()
+        idle = queues.stream("idle")
+        busy = queues.stream("busy")
+        busy.subscribers = 1
+        queues.stream("recent")
+
+        idle.last_activity -= queues.ttl + 1
+        busy.last_activity -= queues.ttl + 1
+
+        queues.evict_idle(force=True)
+
+        assert "idle" not in queues
+        assert "busy" in queues
+        assert "recent" in queues
+
+
+def test_session_resolved_once_per_request(moulinette_webapi, mocker):
+    from moulitest.authenticators.dummy import Authenticator
+    from moulinette.interfaces.api import LogQueues
+
+    moulinette_webapi.post(
+        "/login", {"credentials": "dummy"}, headers={"X-Requested-With": ""}
+    )
+
+    get_session_cookie = mocker.spy(Authenticator, "get_session_cookie")
+    publish = mocker.spy(LogQueues, "publish")
+
+    moulinette_webapi.get("/test-stream/log/100", status=200)
+
+    # Every log line and the end of the request are routed to the same
+    # session, which cookie has been decoded only once
+    assert publish.call_count == 101
+    assert len({call.args[1] for call in publish.call_args_list}) == 1
+    assert get_session_cookie.call_count == 1
+
+
+class TestEventStream:
+    def login(self, webapi):
+        webapi.post(
+            "/login", {"credentials": "dummy"}, headers={"X-Requested-With": ""}
+        )
+
+    def events(self, text):
+        events = []
+        for block in text.split("\n\n"):
+            if not block.startswith("id:"):
+                continue
+            event = dict(line.split(": ", 1) for line in block.split("\n"))
+            if event["data"]:
+                event["data"] = json.loads(event["data"])
+            events.append(event)
+        return events
+
+    def ended_stream(self):
+        from moulinette.interfaces.api import SessionStream
+
+        stream = SessionStream(maxlen=10)
+        stream.put(("info", "foo"))
+        stream.put(("warning", "bar"))
+        stream.put(StopIteration)
+        return stream
+
+    def test_messages_event_stream(self, moulinette_webapi, mocker):
+        from moulinette.interfaces.api import LogQueues
+
+        self.login(moulinette_webapi)
+        mocker.patch.object(LogQueues, "stream", return_value=self.ended_stream())
+
+        r = moulinette_webapi.get(
+            "/messages",
+            headers={"Accept": "text/event-stream", "Last-Event-ID": "0"},
+            status=200,
+        )
+
+        assert r.content_type == "text/event-stream"
+        assert r.text.startswith("retry: 3000\n\n")
+        assert self.events(r.text) == [
+            {"id": "3", "data": [{"info": "foo"}, {"warning": "bar"}]},
+            {"id": "3", "event": "end", "data": ""},
+        ]
+
+    def test_messages_event_stream_resume(self, moulinette_webapi, mocker):
+        from moulinette.interfaces.api import LogQueues
+
+        self.login(moulinette_webapi)
+        mocker.patch.object(LogQueues, "stream", return_value=self.ended_stream())
+
+        r = moulinette_webapi.get(
+            "/messages",
+            headers={"Accept": "text/event-stream", "Last-Event-ID": "1"},
+            status=200,
+        )
+
+        assert self.events(r.text) == [
+            {"id": "3", "data": [{"warning": "bar"}]},
+            {"id": "3", "event": "end", "data": ""},
+        ]
+
+    def test_messages_websocket_resume(self, moulinette_webapi, mocker):
+        import gevent
+        from moulinette.interfaces.api import LogQueues
+
+        class WebSocket:
+            closed = False
+
+            def __init__(self):
+                self.sent = []
+
+            def send(self, message):
+                self.sent.append(json.loads(message))
+
+        self.login(moulinette_webapi)
+        stream = self.ended_stream()
+        stream.put(("info", "baz"))
+        mocker.patch.object(LogQueues, "stream", return_value=stream)
+        wsock = WebSocket()
+
+        def end_request():
+            # The end of a request following the connection closes it
+            assert wsock.sent[-1] == {"info": "baz", "seq": 4}
+            stream.put(StopIteration)
+
+        ender = gevent.spawn_later(0.1, end_request)
+        moulinette_webapi.get(
+            "/messages",
+            {"last_seq": 2},
+            extra_environ={"wsgi.websocket": wsock},
+            status=200,
+        )
+        ender.get(timeout=1)
+
+        # The end of the previous request is skipped
+        assert wsock.sent == [{"info": "baz", "seq": 4}]
+
+    def test_messages_not_logged(self, moulinette_webapi):
+        moulinette_webapi.get(
+            "/messages", headers={"Accept": "text/event-stream"}, status=401
+        )
+
+
+class TestUploads:
+    def upload(self, webapi, content, status=201):
+        return webapi.post(
+            "/test-upload/file",
+            upload_files=[("file", "foo.txt", content)],
+            headers={"X-Requested-With": ""},
+            status=status,
+        )
+
+    def test_upload(self, moulinette_webapi):
+        r = self.upload(moulinette_webapi, b"some content")
+
+        assert r.json["content"] == "some content"
+        assert os.path.basename(r.json["path"]) == "foo.txt"
+        # The upload directory of the request is removed at its end
+        assert not os.path.exists(os.path.dirname(r.json["path"]))
+
+    def test_upload_too_large(self, moulinette):
+        from webtest import TestApp
+        from moulinette.interfaces.api import Interface as Api
+
+        webapi = TestApp(
+            Api(actionsmap=moulinette._actionsmap_path, upload_max_size=1000)._app
+        )
+
+        self.upload(webapi, b"small")
+        r = self.upload(webapi, b"x" * 5000, status=413)
+        assert "too large" in r.text
+
+    def test_upload_chunked_rejected(self, moulinette):
+        from webtest import TestApp
+        from moulinette.interfaces.api import Interface as Api
+
+        webapi = TestApp(
+            Api(actionsmap=moulinette._actionsmap_path, upload_max_size=1000)._app
+        )
+
+        r = webapi.post(
+            "/test-upload/file",
+            b"x" * 10,
+            headers={
+                "X-Requested-With": "",
+                "Transfer-Encoding": "chunked",
+                "Content-Type": "application/octet-stream",
+            },
+            status=411,
+        )
+        assert "Content-Length" in r.text
+
+    def test_upload_limited_input(self):
+        import io
+        from bottle import HTTPResponse
+        from moulinette.interfaces.api import LimitedInput
+
+        stream = LimitedInput(io.BytesIO(b"x" * 100), 50)
+        assert stream.read(40) == b"x" * 40
+        with pytest.raises(HTTPResponse) as e:
+            stream.read(40)
+        assert e.value.status_code == 413
+
+    def test_upload_without_plugin(self):
+        import bottle
+        from moulinette.interfaces.api import request_uploads, RequestUploads
+
+        bottle.request.bind({})
+        uploads = request_uploads()
+
+        assert isinstance(uploads, RequestUploads)
+        assert bottle.request.environ["moulinette.uploads"] is uploads
+
+    def test_upload_checksum(self, moulinette, mocker):
+        import hashlib
+        from webtest import TestApp
+        from moulinette.interfaces.api import Interface as Api, RequestUploads
+
+        webapi = TestApp(
+            Api(actionsmap=moulinette._actionsmap_path, upload_checksum="sha256")._app
+        )
+        save = mocker.spy(RequestUploads, "save")
+
+        r = self.upload(webapi, b"some content")
+
+        uploads = save.call_args.args[0]
+        assert uploads.checksums == {
+            r.json["path"]: hashlib.sha256(b"some content").hexdigest()
+        }
+
+
+class TestArgumentBinding:
+    def parser(self):
+        from moulinette.interfaces.api import _HTTPArgumentParser
+
+        parser = _HTTPArgumentParser()
+        parser.set_defaults(_tid="test.binding")
+        parser.add_argument("name")
+        parser.add_argument("others", nargs="*")
+        parser.add_argument("@count", type=int, default="3")
+        parser.add_argument("@color", choices=["red", "blue"])
+        parser.add_argument("@pair", nargs=2)
+        parser.add_argument("@tags", nargs="+")
+        parser.add_argument("@maybe", nargs="?", const="yes")
+        parser.add_argument("@append", action="append")
+        parser.add_argument("@force", action="store_true")
+        parser.add_argument("@mode", action="store_const", const="fast")
+        return parser
+
+    def parse(self, parser, args):
+        from moulinette.core import MoulinetteValidationError
+
+        try:
+            return vars(parser.parse_args(args))
+        except MoulinetteValidationError as e:
+            return str(e)
+
+    def test_binding_without_argparse(self, mocker):
+        import argparse
+
+        parser = self.parser()
+        parse_args = mocker.spy(argparse.ArgumentParser, "parse_args")
+
+        assert self.parse(parser, {"name": "foo", "count": "5"}) == {
+            "_tid": "test.binding",
+            "name": "foo",
+            "others": [],
+            "count": 5,
+            "color": None,
+            "pair": None,
+            "tags": None,
+            "maybe": None,
+            "append": None,
+            "force": False,
+            "mode": None,
+        }
+        assert parse_args.call_count == 0
+
+    def test_binding_keeps_values_types(self):
+        parser = self.parser()
+
+        ret = self.parse(parser, {"name": "foo", "others": [1, "2", {"a": 3}]})
+        assert ret["others"] == [1, "2", {"a": 3}]
+
+    @pytest.mark.parametrize(
+        "args",
+        [
+            {"name": "foo"},
+            {"name": ""},
+            {"name": "foo", "others": ["bar", "baz"]},
+            {"name": "foo", "others": "bar"},
+            {"name": "foo", "count": "yoloswag"},
+            {"name": "foo", "count": ""},
+            {"name": "foo", "color": "red"},
+            {"name": "foo", "color": "green"},
+            {"name": "foo", "color": ["red", "blue"]},
+            {"name": "foo", "pair": ["a", "b"]},
+            {"name": "foo", "pair": "a"},
+            {"name": "foo", "pair": ["a", "b", "c"]},
+            {"name": "foo", "tags": []},
+            {"name": "foo", "tags": ["a", "b"]},
+            {"name": "foo", "maybe": ""},
+            {"name": "foo", "maybe": "no"},
+            {"name": "foo", "append": "a"},
+            {"name": "foo", "force": True},
+            {"name": "foo", "force": False},
+            {"name": "foo", "force": "1"},
+            {"name": "foo", "force": 0},
+            {"name": "foo", "mode": True},
+            {"name": "foo", "mode": "slow"},
+            {"name": "foo", "unknown": "bar"},
+            {"name": []},
+            {"count": "yoloswag"},
+            {},
+        ],
+    )
+    def test_binding_same_as_argparse(self, args):
+        parser = self.parser()
+        ret = self.parse(parser, args)
+
+        parser._binders = False
+        assert ret == self.parse(parser, args)
+
+
+class TestBatch:
+    def login(self, webapi):
+        webapi.post(
+            "/login", {"credentials": "dummy"}, headers={"X-Requested-With": ""}
+        )
+
+    def batch(self, webapi, entries, status=200):
+        return webapi.post_json(
+            "/batch", entries, headers={"X-Requested-With": ""}, status=status
+        )
+
+    def test_batch(self, moulinette_webapi, mocker):
+        from moulitest.authenticators.dummy import Authenticator
+
+        self.login(moulinette_webapi)
+        get_session_cookie = mocker.spy(Authenticator, "get_session_cookie")
+
+        r = self.batch(
+            moulinette_webapi,
+            [
+                {"method": "GET", "path": "/test-auth/default"},
+                {"method": "GET", "path": "/test-stream/list/2"},
+                {"method": "POST", "path": "/test-auth/subcat/post"},
+                {"method": "GET", "path": "/test-auth/subcat/default"},
+            ],
+        )
+
+        assert r.json == [
+            {"status": 200, "result": "some_data_from_default"},
+            {
+                "status": 200,
+                "result": [{"id": 0, "name": "item0"}, {"id": 1, "name": "item1"}],
+            },
+            {"status": 201, "result": "some_data_from_subcat_post"},
+            {"status": 200, "result": "some_data_from_subcat_default"},
+        ]
+        # The session is authenticated only once for all the actions
+        assert get_session_cookie.call_count == 2
+
+    def test_batch_errors(self, moulinette_webapi):
+        r = self.batch(
+            moulinette_webapi,
+            [
+                {"method": "GET", "path": "/test-auth/default"},
+                {"method": "GET", "path": "/test-stream/error"},
+                {"method": "GET", "path": "/unknown"},
+                {"method": "GET", "path": "/messages"},
+                {"method": "GET", "path": "/test-stream/list/yoloswag"},
+                {"path": "/test-auth/none"},
+                {"method": "GET", "path": "/test-auth/none"},
+            ],
+        )
+
+        assert [entry["status"] for entry in r.json] == [
+            401,
+            400,
+            404,
+            404,
+            400,
+            400,
+            200,
+        ]
+        assert r.json[-1]["result"] == "some_data_from_none"
+
+    def test_batch_route_limits(self, moulinette_webapi, mocker):
+        from moulinette.interfaces.api import ConcurrencyLimit
+
+        acquire = mocker.patch.object(ConcurrencyLimit, "acquire", return_value=False)
+
+        r = self.batch(
+            moulinette_webapi,
+            [
+                {"method": "GET", "path": "/test-stream/list/2"},
+                {"method": "GET", "path": "/test-auth/none"},
+            ],
+        )
+
+        # Only the route limited to one action at a time is limited
+        assert [entry["status"] for entry in r.json] == [429, 200]
+        assert acquire.call_count == 1
+
+    def test_batch_params(self, moulinette_webapi, mocker):
+        from moulinette.actionsmap import ActionsMap
+
+        process = mocker.spy(ActionsMap, "process")
+        self.batch(
+            moulinette_webapi,
+            [
+                {
+                    "method": "GET",
+                    "path": "/test-stream/list/2",
+                    "params": {"count": ["3"], "a": ["b"], "c": ["d", "e"]},
+                }
+            ],
+        )
+
+        # Params are formatted as those of a request on its own
+        assert process.call_args.args[1] == {
+            "count": ["2", "3"],
+            "a": "b",
+            "c": ["d", "e"],
+        }
+
+    def test_batch_invalid(self, moulinette_webapi):
+        self.batch(moulinette_webapi, {"method": "GET"}, status=400)
+        moulinette_webapi.post(
+            "/batch", "not json", headers={"X-Requested-With": ""}, status=400
+        )
+
+
+class TestAdmission:
+    def webapi(self, moulinette, **kwargs):
+        from webtest import TestApp
+        from moulinette.interfaces.api import Interface as Api
+
+        return TestApp(Api(actionsmap=moulinette._actionsmap_path, **kwargs)._app)
+
+    def plugin(self, webapi):
+        return next(p for p in webapi.app.plugins if p.name == "admission")
+
+    def test_concurrency_limit(self):
+        from moulinette.interfaces.api import ConcurrencyLimit
+
+        limit = ConcurrencyLimit(1, queue=1, timeout=0.01)
+
+        assert limit.acquire()
+        # Waits in the queue until the timeout expires
+        assert not limit.acquire()
+        limit.release()
+        assert limit.acquire()
+
+        limit.queue = 0
+        assert not limit.acquire()
+
+    def test_global_limit(self, moulinette):
+        webapi = self.webapi(moulinette, max_concurrency=1, max_queued=0)
+        limit = self.plugin(webapi).limit
+
+        webapi.get("/test-auth/none", status=200)
+
+        limit.acquire()
+        r = webapi.get("/test-auth/none", status=503)
+        assert r.headers["Retry-After"] == "1"
+
+        limit.release()
+        webapi.get("/test-auth/none", status=200)
+
+    def test_route_limit(self, moulinette):
+        webapi = self.webapi(moulinette, max_queued=0)
+
+        # The stream holds its slot until it has been sent
+        webapi.get("/test-stream/list/3", status=200)
+        limit = self.plugin(webapi)._route_limits[("GET", "/test-stream/list/<count>")]
+        assert limit.limit == 1
+
+        limit.acquire()
+        r = webapi.get("/test-stream/list/3", status=429)
+        assert r.headers["Retry-After"] == "1"
+        webapi.get("/test-auth/none", status=200)
+
+        limit.release()
+        webapi.get("/test-stream/list/3", status=200)
+
+
+class TestTiming:
+    def phases(self, r):
+        return dict(
+            metric.split(";dur=") for metric in r.headers["Server-Timing"].split(", ")
+        )
+
+    def test_server_timing(self, moulinette_webapi):
+        r = moulinette_webapi.get("/test-auth/none", status=200)
+
+        phases = self.phases(r)
+        for phase in ("params", "auth", "parse", "lock", "import", "action", "encode"):
+            assert float(phases[phase]) >= 0
+        assert float(phases["total"]) >= float(phases["action"])
+
+    def test_server_timing_error(self, moulinette_webapi):
+        r = moulinette_webapi.get("/test-auth/default", status=401)
+
+        assert "auth" in self.phases(r)
+        assert "action" not in self.phases(r)
+
+    def test_access_log(self, moulinette_webapi, caplog):
+        caplog.set_level("INFO", logger="moulinette.interface.api.access")
+
+        moulinette_webapi.get("/test-auth/none", status=200)
+        moulinette_webapi.get("/test-stream/list/3", status=200)
+
+        records = [
+            json.loads(r.message)
+            for r in caplog.records
+            if r.name == "moulinette.interface.api.access"
+        ]
+        assert records[0]["route"] == "/test-auth/none"
+        assert records[0]["status"] == 200
+        assert records[0]["size"] == len('"some_data_from_none"')
+        assert records[0]["duration"] >= records[0]["timings"]["action"]
+
+        # Streamed responses are logged once they have been sent
+        assert records[1]["path"] == "/test-stream/list/3"
+        assert records[1]["size"] > 0
+
+
+class TestProfiling:
+    def webapi(self, moulinette, **kwargs):
+        from webtest import TestApp
+        from moulinette.interfaces.api import Interface as Api
+
+        return TestApp(Api(actionsmap=moulinette._actionsmap_path, **kwargs)._app)
+
+    def test_profile_request(self, moulinette, tmp_path, mocker):
+        from moulinette.interfaces import api
+
+        webapi = self.webapi(moulinette, profile_dir=str(tmp_path))
+        headers = {"X-Moulinette-Profile": "1"}
+        webapi.post(
+            "/login", {"credentials": "dummy"}, headers={"X-Requested-With": ""}
+        )
+
+        webapi.get("/test-auth/default", status=200)
+        assert list(tmp_path.iterdir()) == []
+
+        r = webapi.get("/test-auth/default", headers=headers, status=200)
+        log_id = r.headers["X-Moulinette-Profile"]
+        assert [p.name for p in tmp_path.iterdir()] == ["%s.folded" % log_id]
+
+        # Profiled requests are rate limited
+        r = webapi.get("/test-auth/default", headers=headers, status=200)
+        assert "X-Moulinette-Profile" not in r.headers
+        mocker.patch.object(api, "PROFILE_MIN_INTERVAL", 0)
+        r = webapi.get("/test-auth/default", headers=headers, status=200)
+        assert "X-Moulinette-Profile" in r.headers
+
+    def test_profile_unauthenticated(self, moulinette, tmp_path):
+        webapi = self.webapi(moulinette, profile_dir=str(tmp_path))
+        headers = {"X-Moulinette-Profile": "1"}
+
+        # Only the actions of authenticated sessions are profiled
+        r = webapi.get("/test-auth/none", headers=headers, status=200)
+        assert "X-Moulinette-Profile" not in r.headers
+        webapi.get("/test-auth/default", headers=headers, status=401)
+        assert list(tmp_path.iterdir()) == []
+
+    def test_profile_not_allowed(self, moulinette_webapi):
+        r = moulinette_webapi.get(
+            "/test-auth/none", headers={"X-Moulinette-Profile": "1"}, status=200
+        )
+
+        assert "X-Moulinette-Profile" not in r.headers
+
+
+class TestReload:
+    def interface(self, moulinette, tmp_path):
+        import shutil
+        from moulinette.interfaces.api import Interface as Api
+
+        path = tmp_path / "moulitest.yml"
+        shutil.copy(moulinette._actionsmap_path, path)
+        return Api(actionsmap=str(path)), path
+
+    def test_reload_actionsmap(self, moulinette, tmp_path, monkeypatch):
+        from webtest import TestApp
+        from webtest.app import CookiePolicy
+
+        # Reuse the session cookie, see the moulinette_webapi fixture
+        monkeypatch.setattr(CookiePolicy, "return_ok_secure", lambda *args: True)
+
+        api, path = self.interface(moulinette, tmp_path)
+        webapi = TestApp(api._app)
+        webapi.post(
+            "/login", {"credentials": "dummy"}, headers={"X-Requested-With": ""}
+        )
+        webapi.get("/test-auth/none", status=200)
+        webapi.get("/test-stream/list/1", status=200)
+        assert not api.reload_actionsmap()
+
+        content = path.read_text()
+        content = content.replace("GET /test-auth/none", "GET /test-auth/renamed")
+        content = content.replace("concurrency: 1", "concurrency: 2")
+        path.write_text(content)
+
+        previous = api.actionsmap
+        assert api.reload_actionsmap()
+        assert api.actionsmap is not previous
+
+        webapi.get("/test-auth/renamed", status=200)
+        webapi.get("/test-auth/none", status=404)
+        # The session is kept
+        webapi.get("/test-auth/default", status=200)
+
+        webapi.get("/test-stream/list/1", status=200)
+        admission = next(p for p in webapi.app.plugins if p.name == "admission")
+        assert admission._route_limits[("GET", "/test-stream/list/<count>")].limit == 2
+
+    def test_reload_invalid_actionsmap(self, moulinette, tmp_path):
+        from webtest import TestApp
+
+        api, path = self.interface(moulinette, tmp_path)
+        path.write_text("{not: valid")
+
+        previous = api.actionsmap
+        assert not api.reload_actionsmap()
+        assert api.actionsmap is previous
+        TestApp(api._app).get("/test-auth/none", status=200)
+
+
+class TestPrefork:
+    def test_log_queues_channel(self):
+        from gevent.socket import socketpair
+        from moulinette.interfaces.api import LogChannel, LogQueues
+
+        parent_sock, child_sock = socketpair()
+        parent = LogChannel(parent_sock)
+        queues = LogQueues()
+        queues.channel = LogChannel(child_sock)
+
+        # New streams and publications are sent to the parent ...
+        stream = queues.stream("session")
+        assert parent.recv() == ("session", None)
+        assert queues.publish("session", ("info", "foo"))
+        assert not queues.publish("unknown", ("info", "foo"))
+        assert parent.recv() == ("session", ("info", "foo"))
+        assert stream.seq == 0
+
+        # ... which relays them to all workers
+        queues.receive("session", ("info", "foo"))
+        queues.receive("other", None)
+        assert stream.get(0, timeout=0) == [(1, ("info", "foo"))]
+        assert "other" in queues
+
+        child_sock.close()
+        with pytest.raises(EOFError):
+            parent.recv()
+
+    def test_log_queues_pending(self):
+        from gevent.socket import socketpair
+        from moulinette.interfaces.api import LogChannel, LogQueues
+
+        parent_sock, child_sock = socketpair()
+        parent = LogChannel(parent_sock)
+        queues = LogQueues()
+        queues.channel = LogChannel(child_sock)
+
+        # Publications for a stream created by another worker are kept ...
+        assert not queues.publish("session", ("info", "foo"))
+        assert not queues.publish("expired", ("info", "bar"))
+        queues._pending["expired"] = (0, queues._pending["expired"][1])
+
+        # ... and sent once its notice is received, unless expired
+        queues.receive("expired", None)
+        queues.receive("session", None)
+        assert parent.recv() == ("session", ("info", "foo"))
+        assert queues._pending == {}
+
+    def test_log_queues_evicted(self):
+        from gevent.socket import socketpair
+        from moulinette.interfaces.api import LogChannel, LogQueues
+
+        parent_sock, child_sock = socketpair()
+        parent = LogChannel(parent_sock)
+        queues = LogQueues()
+        queues.channel = LogChannel(child_sock)
+
+        # A stream created by another worker, idle for this one
+        queues.receive("session", None)
+        queues["session"].last_activity -= queues.ttl + 1
+        queues.evict_idle(force=True)
+        assert "session" not in queues
+
+        # It is announced again by a publication of this worker, for the
+        # clients of the others which may still listen to it
+        assert queues.publish("session", ("info", "foo"))
+        assert parent.recv() == ("session", None)
+        assert parent.recv() == ("session", ("info", "foo"))
+        assert "session" in queues
+
+    def test_relay_slow_worker(self, mocker):
+        from gevent import sleep
+        from gevent.socket import socketpair
+        from moulinette.interfaces import api
+        from moulinette.interfaces.api import LogChannel, PreforkServer, _Worker
+
+        mocker.patch.object(api, "PREFORK_RELAY_QUEUE_SIZE", 2)
+        kill = mocker.patch.object(PreforkServer, "_kill")
+        server = PreforkServer(None, 2, None)
+
+        socks = {}
+        for pid in (1, 2):
+            parent_sock, socks[pid] = socketpair()
+            worker = server._workers[pid] = _Worker(pid, LogChannel(parent_sock))
+            worker.sender = mocker.Mock()
+        publisher = LogChannel(socks[1])
+        relay = api.spawn(server._relay, server._workers[1])
+
+        # Nothing is sent to the workers, whose queues fill up without
+        # blocking the relay: they are restarted
+        for i in range(3):
+            publisher.send("session", i)
+        sleep(0.1)
+        assert not relay.dead
+        assert all(w.lagging for w in server._workers.values())
+        assert kill.call_count == 2
+        relay.kill()
+
+    def wait_for(self, func, timeout=10):
+        import time
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                ret = func()
+            except OSError:
+                ret = None
+            if ret or time.monotonic() > deadline:
+                return ret
+            time.sleep(0.1)
+
+    def test_prefork_server(self, moulinette):
+        import time
+        import signal
+        import socket
+        import urllib.request
+        from gevent import fork
+        from moulinette.interfaces.api import Interface as Api
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        def get_pid():
+            url = "http://127.0.0.1:%d/pid" % port
+            with urllib.request.urlopen(url, timeout=5) as r:
+                return int(r.read())
+
+        api = Api(
+            routes={("GET", "/pid"): lambda: str(os.getpid())},
+            actionsmap=moulinette._actionsmap_path,
+        )
+        server_pid = fork()
+        if server_pid == 0:
+            try:
+                api.run("127.0.0.1", port, workers=2)
+            finally:
+                os._exit(0)
+
+        try:
+            worker_pid = self.wait_for(get_pid)
+            assert worker_pid and worker_pid != server_pid
+
+            # A dead worker is respawned
+            os.kill(worker_pid, signal.SIGKILL)
+            assert self.wait_for(lambda: get_pid() != worker_pid)
+
+            # All workers are replaced on SIGHUP
+            old_pids = {get_pid() for _ in range(10)}
+            os.kill(server_pid, signal.SIGHUP)
+            assert self.wait_for(lambda: get_pid() not in old_pids)
+        finally:
+            os.kill(server_pid, signal.SIGTERM)
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline:
+                pid, status = os.waitpid(server_pid, os.WNOHANG)
+                if pid:
+                    break
+                time.sleep(0.1)
+            else:
+                os.kill(server_pid, signal.SIGKILL)
+                os.waitpid(server_pid, 0)
+
+        assert os.waitstatus_to_exitcode(status) == 0
+
+
+class TestListeners:
+    def serve(self, listener):
+        from gevent.pywsgi import WSGIServer
+
+        def app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [b"pong"]
+
+        server = WSGIServer(listener, app, log=None)
+        server.start()
+        return server
+
+    def get(self, family, address):
+        from gevent import socket
+
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.connect(address)
+            sock.sendall(b"GET / HTTP/1.0\r\n\r\n")
+            return sock.makefile("rb").read()
+
+    def test_unix_listener(self, tmp_path):
+        import errno
+        import socket
+        from moulinette.interfaces.api import get_listener
+
+        path = str(tmp_path / "api.sock")
+        server = self.serve(get_listener("unix:" + path, None))
+        try:
+            assert self.get(socket.AF_UNIX, path).endswith(b"pong")
+
+            # A socket which is still in use is not replaced ...
+            with pytest.raises(OSError) as exception:
+                get_listener("unix:" + path, None)
+            assert exception.value.errno == errno.EADDRINUSE
+        finally:
+            server.stop()
+
+        # ... but a stale one is
+        server = self.serve(get_listener("unix:" + path, None))
+        try:
+            assert self.get(socket.AF_UNIX, path).endswith(b"pong")
+        finally:
+            server.stop()
+
+    def test_unix_listener_permissions(self, tmp_path):
+        import stat
+        from moulinette.interfaces.api import get_listener
+
+        path = str(tmp_path / "api.sock")
+        with get_listener("unix:" + path, None):
+            assert stat.S_IMODE(os.stat(path).st_mode) == 0o660
+        os.unlink(path)
+
+        owner = "%d:%d" % (os.getuid(), os.getgid())
+        with get_listener("unix:" + path, None, 0o600, owner):
+            info = os.stat(path)
+            assert stat.S_IMODE(info.st_mode) == 0o600
+            assert (info.st_uid, info.st_gid) == (os.getuid(), os.getgid())
+
+    def test_unix_listener_removed(self, moulinette, tmp_path, mocker):
+        from gevent.pywsgi import WSGIServer
+        from moulinette.interfaces.api import Interface as Api
+
+        path = str(tmp_path / "api.sock")
+
+        def serve_forever(server):
+            assert os.path.exists(path)
+
+        mocker.patch.object(WSGIServer, "serve_forever", serve_forever)
+        api = Api(routes={}, actionsmap=moulinette._actionsmap_path)
+        api.run("unix:" + path)
+
+        assert not os.path.exists(path)
+
+    def test_systemd_listener(self, monkeypatch):
+        import socket
+        from moulinette.interfaces import api
+
+        sock = socket.create_server(("127.0.0.1", 0))
+        address = sock.getsockname()
+        fd = sock.detach()
+
+        monkeypatch.setattr(api, "SD_LISTEN_FDS_START", fd)
+        monkeypatch.setenv("LISTEN_PID", str(os.getpid()))
+        monkeypatch.setenv("LISTEN_FDS", "1")
+
+        listener = api.get_listener("localhost", 80)
+        assert listener.fileno() == fd
+        assert "LISTEN_FDS" not in os.environ
+
+        server = self.serve(listener)
+        try:
+            assert self.get(socket.AF_INET, address).endswith(b"pong")
+        finally:
+            server.stop()
+
+    def test_tcp_listener(self):
+        from moulinette.interfaces.api import get_listener
+
+        assert get_listener("localhost", 6787) == ("localhost", 6787)
+
+
+def test_api_options(mocker):
+    import moulinette
+
+    interface = mocker.patch("moulinette.interfaces.api.Interface")
+
+    assert (
+        moulinette.api(
+            upload_max_size=1024,
+            upload_checksum="sha256",
+            max_concurrency=4,
+            max_queued=8,
+        )
+        == 0
+    )
+    kwargs = interface.call_args.kwargs
+    assert kwargs["upload_max_size"] == 1024
+    assert kwargs["upload_checksum"] == "sha256"
+    assert kwargs["max_concurrency"] == 4
+    assert kwargs["max_queued"] == 8
+    assert interface.return_value.run.called
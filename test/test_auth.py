@@ -1,3 +1,4 @@
+import os
 import pytest
 
 from moulinette import MoulinetteError
@@ -306,3 +307,338 @@ class TestAuthCLI:
         message = capsys.readouterr()
 
         assert "error: the following arguments are required:" in message.err
+
+
+class TestSessionStore:
+    def test_sessions(self):
+        from moulinette.authentication import SessionStore
+
+        store = SessionStore()
+        key = store.create({"id": "foo", "user": "admin"})
+
+        assert store.get(key) == {"id": "foo", "user": "admin"}
+        assert store.get("unknown") is None
+
+        store.delete(key)
+        assert store.get(key) is None
+
+    def test_sessions_expire(self, mocker):
+        from moulinette.authentication import SessionStore
+
+        time = mocker.patch("moulinette.authentication.time", return_value=1000)
+        store = SessionStore(ttl=10)
+        key = store.create({"id": "foo"})
+
+        # Using a session postpones its expiration
+        time.return_value = 1009
+        assert store.get(key) == {"id": "foo"}
+        time.return_value = 1018
+        assert store.get(key) == {"id": "foo"}
+
+        time.return_value = 1028
+        assert store.get(key) is None
+
+    def test_sessions_lru(self):
+        from moulinette.authentication import SessionStore
+
+        store = SessionStore(maxsize=2)
+        first = store.create({"id": "first"})
+        second = store.create({"id": "second"})
+        store.get(first)
+        store.create({"id": "third"})
+
+        # The least recently used session has been evicted
+        assert store.get(second) is None
+        assert store.get(first) == {"id": "first"}
+
+    def test_sessions_database(self, tmp_path, mocker):
+        from moulinette.authentication import SessionStore
+
+        path = str(tmp_path / "sessions.db")
+        time = mocker.patch("moulinette.authentication.time", return_value=1000)
+        worker_a = SessionStore(maxsize=1, path=path)
+        worker_b = SessionStore(path=path)
+
+        key = worker_a.create({"id": "foo"})
+        assert worker_b.get(key) == {"id": "foo"}
+
+        # Sessions evicted from memory are still in the database
+        worker_a.create({"id": "bar"})
+        assert worker_a.get(key) == {"id": "foo"}
+
+        # A deleted session is forgotten by other workers once rechecked
+        worker_a.delete(key)
+        assert worker_b.get(key) == {"id": "foo"}
+        time.return_value += worker_b.recheck
+        assert worker_b.get(key) is None
+        assert oct(os.stat(path).st_mode & 0o777) == "0o600"
+
+    def test_authenticator_sessions(self):
+        from bottle import request, response
+        from moulinette.authentication import BaseAuthenticator, SessionStore
+        from moulinette.core import MoulinetteAuthenticationError
+
+        class Authenticator(BaseAuthenticator):
+            name = "stored"
+            session_store = SessionStore()
+
+        def send_cookie():
+            cookie = dict(response.headerlist)["Set-Cookie"].split(";")[0]
+            request.bind({"HTTP_COOKIE": cookie})
+            response.bind()
+            return cookie.split("=", 1)[1]
+
+        authenticator = Authenticator()
+        request.bind({})
+        response.bind()
+        with pytest.raises(MoulinetteAuthenticationError):
+            authenticator.get_session_cookie()
+
+        # The cookie only holds the key of the session
+        authenticator.set_session_cookie({"user": "admin"})
+        key = send_cookie()
+        infos = authenticator.get_session_cookie()
+        assert infos == {"id": infos["id"], "user": "admin"}
+        assert "admin" not in key
+
+        # Logging in again gives a new key, but keeps the session id
+        authenticator.set_session_cookie({"user": "other"})
+        assert Authenticator.session_store.get(key) is None
+        send_cookie()
+        assert authenticator.get_session_cookie() == {
+            "id": infos["id"],
+            "user": "other",
+        }
+
+        authenticator.delete_session_cookie()
+        with pytest.raises(MoulinetteAuthenticationError):
+            authenticator.get_session_cookie()
+
+
+class TestCredentialsCache:
+    def authenticator(self, **kwargs):
+        from moulinette.authentication import BaseAuthenticator, CredentialsCache
+
+        class Authenticator(BaseAuthenticator):
+            name = "cached"
+            credentials_cache = CredentialsCache(**kwargs)
+
+            def _authenticate_credentials(self, credentials=None):
+                if credentials != "secret":
+                    raise MoulinetteError("invalid_password", raw_msg=True)
+                return {"user": "admin"}
+
+        return Authenticator()
+
+    def test_cache_successful_verifications(self, mocker):
+        authenticator = self.authenticator()
+        backend = mocker.spy(authenticator, "_authenticate_credentials")
+
+        assert authenticator.authenticate_credentials("secret") == {"user": "admin"}
+        assert authenticator.authenticate_credentials("secret") == {"user": "admin"}
+        assert backend.call_count == 1
+
+        # Failures always reach the backend
+        for _ in range(2):
+            with pytest.raises(MoulinetteError):
+                authenticator.authenticate_credentials("wrong")
+        assert backend.call_count == 3
+
+    def test_cache_invalidate(self, mocker):
+        authenticator = self.authenticator()
+        backend = mocker.spy(authenticator, "_authenticate_credentials")
+
+        authenticator.authenticate_credentials("secret")
+        authenticator.invalidate_credentials("secret")
+        authenticator.authenticate_credentials("secret")
+        authenticator.invalidate_credentials()
+        authenticator.authenticate_credentials("secret")
+
+        assert backend.call_count == 3
+
+    def test_cache_expire(self, mocker):
+        time = mocker.patch("moulinette.authentication.time", return_value=1000)
+        authenticator = self.authenticator(ttl=10)
+        backend = mocker.spy(authenticator, "_authenticate_credentials")
+
+        authenticator.authenticate_credentials("secret")
+        time.return_value = 1009
+        authenticator.authenticate_credentials("secret")
+        assert backend.call_count == 1
+
+        time.return_value = 1010
+        authenticator.authenticate_credentials("secret")
+        assert backend.call_count == 2
+
+    def test_cache_bounded(self):
+        from moulinette.authentication import CredentialsCache
+
+        cache = CredentialsCache(maxsize=2)
+        for password in ["a", "b", "c"]:
+            cache.set(password, {"user": password})
+
+        assert cache.get("a") is None
+        assert cache.get("c") == {"user": "c"}
+        # Only hashes of the credentials are kept
+        assert len(cache._entries) == 2
+        assert all(len(key) == 32 for key in cache._entries)
+
+
+class FakeBackend:
+    """Local fake of an authentication backend with connections"""
+
+    class Connection:
+        def __init__(self):
+            self.alive = True
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    def __init__(self):
+        self.connections = []
+
+    def connect(self):
+        connection = self.Connection()
+        self.connections.append(connection)
+        return connection
+
+
+class TestConnectionPool:
+    def pool(self, backend, **kwargs):
+        from moulinette.authentication import ConnectionPool
+
+        return ConnectionPool(
+            backend.connect,
+            check=lambda c: c.alive,
+            close=lambda c: c.close(),
+            **kwargs,
+        )
+
+    def test_pool_reuse(self):
+        backend = FakeBackend()
+        pool = self.pool(backend)
+
+        with pool.connection() as first:
+            with pool.connection() as second:
+                assert first is not second
+        # The most recently used connection is reused first
+        with pool.connection() as third:
+            assert third is first
+
+        stats = pool.stats()
+        assert stats["created"] == 2
+        assert stats["reused"] == 1
+        assert stats["in_use"] == 0
+        assert stats["open"] == stats["idle"] == 2
+
+    def test_pool_bounded(self):
+        import gevent
+
+        pool = self.pool(FakeBackend(), maxsize=1, timeout=0.01)
+        connection = pool.checkout()
+
+        with pytest.raises(MoulinetteError):
+            pool.checkout()
+        assert pool.stats()["timeouts"] == 1
+
+        # A waiting checkout gets the connection once checked in
+        pool.timeout = 1
+        waiter = gevent.spawn(pool.checkout)
+        gevent.sleep(0)
+        pool.checkin(connection)
+        assert waiter.get(timeout=1) is connection
+
+    def test_pool_threads(self):
+        import time
+        import threading
+
+        backend = FakeBackend()
+        pool = self.pool(backend, maxsize=2, timeout=5)
+        in_use, peak = [], []
+
+        def use():
+            for _ in range(20):
+                with pool.connection() as connection:
+                    in_use.append(connection)
+                    peak.append(len(in_use))
+                    time.sleep(0.001)
+                    in_use.remove(connection)
+
+        threads = [threading.Thread(target=use) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # The pool is bounded across threads and its statistics are exact
+        assert max(peak) <= 2
+        stats = pool.stats()
+        assert len(backend.connections) == stats["created"] <= 2
+        assert stats["created"] + stats["reused"] == 80
+        assert stats["in_use"] == 0 and stats["timeouts"] == 0
+
+    def test_pool_health_check(self):
+        backend = FakeBackend()
+        pool = self.pool(backend)
+
+        with pool.connection() as connection:
+            pass
+        connection.alive = False
+        with pool.connection() as other:
+            assert other is not connection
+        assert connection.closed
+
+        # A connection broken while being used is discarded
+        with pytest.raises(RuntimeError):
+            with pool.connection() as other:
+                other.alive = False
+                raise RuntimeError()
+        assert other.closed
+        assert pool.stats()["discarded"] == 2
+        assert pool.stats()["open"] == 0
+
+    def test_pool_reap_idle(self, mocker):
+        monotonic = mocker.patch(
+            "moulinette.authentication.monotonic", return_value=1000
+        )
+        pool = self.pool(FakeBackend(), max_idle=10)
+
+        with pool.connection() as recent:
+            with pool.connection() as old:
+                pass
+        monotonic.return_value = 1005
+        assert pool.checkout() is recent
+        pool.checkin(recent)
+
+        # Idle connections are also reaped when another one is checked in
+        connection = pool.checkout()
+        monotonic.return_value = 1012
+        pool.checkin(connection)
+        assert old.closed and not recent.closed
+        assert pool.stats()["reaped"] == 1
+
+        monotonic.return_value = 1030
+        pool.reap()
+        assert recent.closed
+        assert pool.stats()["reaped"] == 2
+
+    def test_authenticator_pool(self):
+        from moulinette.authentication import BaseAuthenticator
+
+        backend = FakeBackend()
+
+        class Authenticator(BaseAuthenticator):
+            name = "pooled"
+            pool_size = 2
+
+            def _connect(self):
+                return backend.connect()
+
+        authenticator = Authenticator()
+        with authenticator.connection() as connection:
+            assert connection is backend.connections[0]
+        assert authenticator.pool.stats()["maxsize"] == 2
+
+        authenticator.pool.close()
+        assert connection.closed
@@ -0,0 +1,280 @@
+import io
+import os
+import json
+
+import pytest
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+
+from moulinette.interfaces.cli import (
+    DateFormatter,
+    OutputBuffer,
+    date_formatter,
+    plain_print_dict,
+    pretty_date,
+    pretty_print_dict,
+    print_result,
+    render_pretty,
+)
+
+
+def test_plain_print_dict(capsys):
+    d = {"key": "value", "list": [1, 2], "dict": {"key2": "value2"}}
+    plain_print_dict(d)
+
+    assert (
+        capsys.readouterr().out == "#key\nvalue\n#list\n1\n2\n#dict\n##key2\nvalue2\n"
+    )
+
+
+def test_plain_print_dict_skip_first_key(capsys):
+    d = {"items": ["a", "b"]}
+    plain_print_dict(d)
+
+    assert capsys.readouterr().out == "a\nb\n"
+    # The printed dictionary is left untouched
+    assert d == {"items": ["a", "b"]}
+
+
+def test_pretty_print_dict(capsys):
+    d = {
+        "b": {"c": 1, "a": [("x", 2), {"y": 3}, 4]},
+        "a": ["single"],
+        "c": OrderedDict([("z", None), ("y", True)]),
+    }
+    pretty_print_dict(d)
+
+    assert capsys.readouterr().out == (
+        "a: single\n"
+        "b: \n"
+        "  a: \n"
+        "    x: 2\n"
+        "    1: \n"
+        "      y: 3\n"
+        "    - 4\n"
+        "  c: 1\n"
+        "c: \n"
+        "  z: None\n"
+        "  y: True\n"
+    )
+
+
+def test_pretty_print_dict_dates_in_list(capsys, mocker, monkeypatch):
+    monkeypatch.setenv("TZ", "UTC")
+    format_all = mocker.spy(DateFormatter, "format_all")
+    pretty_print_dict({"dates": [datetime(2020, 1, 1), datetime(2020, 1, 2)]})
+
+    # The dates of a list are formatted in bulk
+    assert format_all.call_count == 1
+    assert capsys.readouterr().out == (
+        "dates: \n  - 2020-01-01 00:00:00\n  - 2020-01-02 00:00:00\n"
+    )
+
+
+def test_pretty_print_dict_deep(capsys):
+    d = value = {}
+    for i in range(5000):
+        value["k"] = value = {}
+    value["k"] = "leaf"
+    pretty_print_dict(d)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 5001
+    assert lines[-1] == "  " * 5000 + "k: leaf"
+
+
+def test_pretty_print_dict_single_tty_check(capsys, mocker):
+    isatty = mocker.patch("os.isatty", return_value=True)
+    pretty_print_dict({"k%d" % i: i for i in range(100)})
+
+    assert isatty.call_count == 1
+    assert "\033[35m\033[1mk0\033[m: 0\n" in capsys.readouterr().out
+
+
+def test_output_buffer_streams_iterators():
+    stream = io.StringIO()
+
+    def items():
+        yield {"id": 0}
+        # The first item is output before the second one is produced
+        assert stream.getvalue() == "0: \n  id: 0\n"
+        yield "last"
+
+    with OutputBuffer(stream) as out:
+        render_pretty(items(), out)
+
+    assert stream.getvalue() == "0: \n  id: 0\n- last\n"
+
+
+def test_print_result_iterator(capsys):
+    print_result(iter([{"id": 0}, {"id": 1}]), "json")
+    assert json.loads(capsys.readouterr().out) == [{"id": 0}, {"id": 1}]
+
+    print_result(iter([]), "json")
+    assert json.loads(capsys.readouterr().out) == []
+
+    print_result(iter([{"id": 0}, {"id": 1}]), "plain")
+    # As a list
+    assert capsys.readouterr().out == "##id\n0\n##id\n1\n"
+
+
+def test_stream_cli_pretty(moulinette_cli, capsys):
+    moulinette_cli.run(["teststream", "list", "2"])
+
+    assert capsys.readouterr().out == (
+        "0: \n  id: 0\n  name: item0\n1: \n  id: 1\n  name: item1\n"
+    )
+
+
+def test_print_result_ndjson(capsys):
+    print_result({"users": {"alice": {"id": 1}, "bob": {"id": 2}}}, "ndjson")
+    lines = capsys.readouterr().out.splitlines()
+    # The keys of the users are kept
+    assert [json.loads(line) for line in lines] == [
+        {"key": "alice", "id": 1},
+        {"key": "bob", "id": 2},
+    ]
+
+    lines = []
+    for ret in (
+        iter([{"id": 0}, {"id": 1}]),
+        [{"id": 0}, {"id": 1}],
+        {"items": [{"id": 0}, {"id": 1}]},
+    ):
+        print_result(ret, "ndjson")
+        lines.append(
+            [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        )
+    assert lines == [[{"id": 0}, {"id": 1}]] * 3
+
+    # Other dictionaries are single records
+    for ret in ({"a": 1, "b": 2}, {"status": "ok"}, {"status": {"a": 1}}):
+        print_result(ret, "ndjson")
+        assert json.loads(capsys.readouterr().out) == ret
+
+
+def test_print_result_csv(capsys):
+    records = [
+        {"name": "alice", "groups": ["admins", "all"], "mail": None},
+        {"name": "bob, jr", "groups": [], "mail": "bob@example.org"},
+    ]
+    print_result(iter(records), "csv")
+    assert capsys.readouterr().out == (
+        "name,groups,mail\n"
+        'alice,"[""admins"",""all""]",\n'
+        '"bob, jr",[],bob@example.org\n'
+    )
+
+    print_result({"users": records}, "tsv", columns=["mail", "name"])
+    assert capsys.readouterr().out == (
+        "mail\tname\n\talice\nbob@example.org\tbob, jr\n"
+    )
+
+
+def test_print_result_table(capsys):
+    print_result(
+        [{"name": "alice", "uid": 1001}, {"name": "bob", "uid": 1002}], "table"
+    )
+    assert capsys.readouterr().out == (
+        "name   uid\n" "-----  ----\n" "alice  1001\n" "bob    1002\n"
+    )
+
+    print_result(iter([]), "table")
+    assert capsys.readouterr().out == ""
+
+
+def test_print_result_table_streams(mocker):
+    mocker.patch("moulinette.interfaces.cli.TABLE_SAMPLE_SIZE", 2)
+    stream = io.StringIO()
+    mocker.patch("sys.stdout", stream)
+
+    def records():
+        yield {"name": "a"}
+        # The widths of the columns are computed from the first rows, the
+        # header and the first record, which are output straight away
+        assert stream.getvalue() == "name\n----\na\n"
+        yield {"name": "longer"}
+
+    print_result(records(), "table")
+
+    assert stream.getvalue() == "name\n----\na\nlonger\n"
+
+
+def test_stream_cli_ndjson(moulinette_cli, capsys):
+    moulinette_cli.run(["teststream", "list", "2"], output_as="ndjson")
+    lines = capsys.readouterr().out.splitlines()
+
+    assert [json.loads(line) for line in lines] == [
+        {"id": 0, "name": "item0"},
+        {"id": 1, "name": "item1"},
+    ]
+
+
+def test_cli_broken_pipe(moulinette_cli, mocker):
+    import signal
+
+    mocker.patch(
+        "moulinette.interfaces.cli.print_result", side_effect=BrokenPipeError()
+    )
+    dup2 = mocker.patch("os.dup2")
+
+    with pytest.raises(SystemExit) as exception:
+        moulinette_cli.run(["teststream", "list", "2"])
+    assert exception.value.code == 128 + signal.SIGPIPE
+    assert dup2.called
+
+
+def test_cli_invalid_output(moulinette_cli):
+    from moulinette.core import MoulinetteValidationError
+
+    with pytest.raises(MoulinetteValidationError):
+        moulinette_cli.run(["teststream", "list", "2"], output_as="xml")
+
+
+def test_pretty_date():
+    from zoneinfo import ZoneInfo
+
+    formatter = DateFormatter(ZoneInfo("Europe/Paris"))
+
+    # Naive datetimes are UTC, and daylight saving time is taken into account
+    assert formatter.format(datetime(2023, 1, 15, 12, 0, 0, 1234)) == (
+        "2023-01-15 13:00:00"
+    )
+    assert formatter.format(datetime(2023, 7, 15, 12, 0)) == "2023-07-15 14:00:00"
+    aware = datetime(2023, 7, 15, 12, 0, tzinfo=timezone(timedelta(hours=-5)))
+    assert formatter.format(aware) == "2023-07-15 19:00:00"
+    assert formatter.format(date(2023, 7, 15)) == "2023-07-15"
+    assert formatter.format_all([date(2023, 7, 15), datetime(2023, 1, 1)]) == [
+        "2023-07-15",
+        "2023-01-01 01:00:00",
+    ]
+
+
+def test_pretty_date_local_timezone(monkeypatch):
+    monkeypatch.setenv("TZ", "Asia/Kolkata")
+    assert pretty_date(datetime(2023, 1, 1)) == "2023-01-01 05:30:00"
+    assert date_formatter() is date_formatter()
+
+    # The zone follows TZ, e.g. for the commands of a CLI server
+    monkeypatch.setenv("TZ", "America/New_York")
+    assert pretty_date(datetime(2023, 1, 1)) == "2022-12-31 19:00:00"
+
+
+def test_pretty_date_timezone_file(monkeypatch):
+    from zoneinfo import TZPATH
+
+    path = next(
+        (
+            os.path.join(d, "Europe/Paris")
+            for d in TZPATH
+            if os.path.exists(os.path.join(d, "Europe/Paris"))
+        ),
+        None,
+    )
+    if path is None:
+        pytest.skip("no time zone database")
+
+    # The zone is read from the file, and daylight saving time is applied
+    monkeypatch.setenv("TZ", ":" + path)
+    assert pretty_date(datetime(2023, 1, 1)) == "2023-01-01 01:00:00"
+    assert pretty_date(datetime(2023, 7, 1)) == "2023-07-01 02:00:00"
@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+
+import pytest
+
+from moulinette.core import MoulinetteLock
+from moulinette.interfaces.cliserver import CLIServer, run_client
+
+CLIENT = """
+import sys
+from moulinette.interfaces.cliserver import run_client
+
+status = run_client(sys.argv[1], sys.argv[2:], options={"pid": 1})
+sys.exit(127 if status is None else status)
+"""
+
+
+CALLS = []
+
+
+def handler(args, pid=None):
+    CALLS.append(args)
+    print(
+        json.dumps(
+            {
+                "args": args,
+                "calls": len(CALLS),
+                "cwd": os.getcwd(),
+                "foo": os.environ.get("FOO"),
+                "client": MoulinetteLock.client_pid,
+                "pid": pid,
+            }
+        )
+    )
+    if args == ["fail"]:
+        raise ValueError("boom")
+    elif args == ["sleep"]:
+        time.sleep(30)
+    return len(args)
+
+
+@pytest.fixture(params=[False, True], ids=["warm", "fork"])
+def server(request, tmp_path):
+    path = str(tmp_path / "cli.sock")
+    pid = os.fork()
+    if pid == 0:
+        try:
+            CLIServer(
+                path, handler, preload=["json"], fork=request.param
+            ).serve_forever()
+        finally:
+            os._exit(1)
+
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    yield path
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+
+def client(path, *args, **kwargs):
+    env = dict(os.environ, PYTHONPATH=os.getcwd(), **kwargs.pop("env", {}))
+    return subprocess.Popen(
+        [sys.executable, "-c", CLIENT, path] + list(args),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+        text=True,
+        **kwargs,
+    )
+
+
+def test_run_command(server, tmp_path):
+    p = client(server, "a", "b", cwd=str(tmp_path), env={"FOO": "bar"})
+    out, err = p.communicate(timeout=10)
+
+    assert p.returncode == 2
+    result = json.loads(out)
+    assert result["args"] == ["a", "b"]
+    assert result["cwd"] == str(tmp_path)
+    assert result["foo"] == "bar"
+    # The client is identified by the credentials of its connection
+    assert result["client"] == p.pid
+    assert result["pid"] == 1
+
+    # The server keeps its own state
+    p = client(server, "c")
+    out, err = p.communicate(timeout=10)
+    assert p.returncode == 1
+    assert json.loads(out)["foo"] is None
+    assert MoulinetteLock.client_pid is None
+
+
+def test_run_command_error(server):
+    p = client(server, "fail")
+    out, err = p.communicate(timeout=10)
+
+    assert p.returncode == 1
+    assert "ValueError: boom" in err
+
+
+def test_interrupt_command(server):
+    p = client(server, "sleep")
+    time.sleep(0.5)
+    p.send_signal(signal.SIGINT)
+    out, err = p.communicate(timeout=10)
+
+    assert p.returncode == 128 + signal.SIGINT
+
+    p = client(server, "a")
+    p.communicate(timeout=10)
+    assert p.returncode == 1
+
+
+def test_fork_isolation(request, server):
+    fork = "fork" in request.node.callspec.id
+
+    calls = []
+    for _ in range(2):
+        p = client(server, "a")
+        out, err = p.communicate(timeout=10)
+        calls.append(json.loads(out)["calls"])
+
+    # Each command starts from the state of the server
+    assert calls == ([1, 1] if fork else [1, 2])
+
+
+def test_fork_concurrency(request, server):
+    if "fork" not in request.node.callspec.id:
+        pytest.skip("commands are run one at a time in the server process")
+
+    sleeping = client(server, "sleep")
+    time.sleep(0.5)
+    p = client(server, "a")
+    p.communicate(timeout=10)
+    assert p.returncode == 1
+
+    # The signals of the client are received by the command as is
+    sleeping.send_signal(signal.SIGTERM)
+    sleeping.communicate(timeout=10)
+    assert sleeping.returncode == 128 + signal.SIGTERM
+
+
+def test_preload_actionsmap(moulinette, monkeypatch):
+    from moulinette.interfaces.cliserver import preload_actionsmap
+
+    monkeypatch.delitem(sys.modules, "moulitest.testauth", raising=False)
+    preload_actionsmap(moulinette._actionsmap_path)
+
+    assert "moulitest.testauth" in sys.modules
+    assert "moulitest.authenticators.dummy" in sys.modules
+
+
+def test_client_fallback(tmp_path, monkeypatch):
+    assert run_client(str(tmp_path / "missing.sock"), ["a"]) is None
+
+    # Commands run by a command of the server do not use it while busy
+    import socket
+
+    path = str(tmp_path / "busy.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(path)
+        sock.listen(1)
+        monkeypatch.setenv("MOULINETTE_CLI_SERVER_BUSY", path)
+        assert run_client(path, ["a"]) is None
+
+
+def test_lock_held_by_client_ancestor(monkeypatch):
+    import psutil
+
+    lock = MoulinetteLock("moulitest")
+    # A process holding the lock, which runs a client
+    holder = subprocess.Popen(["sh", "-c", "sleep 30 & wait"])
+    try:
+        for _ in range(100):
+            children = psutil.Process(holder.pid).children()
+            if children:
+                break
+            time.sleep(0.05)
+
+        assert not lock._is_son_of([holder.pid])
+
+        # The client pid is set by the CLI server
+        monkeypatch.setattr(MoulinetteLock, "client_pid", children[0].pid)
+        assert lock._is_son_of([holder.pid])
+    finally:
+        for child in psutil.Process(holder.pid).children():
+            child.kill()
+        holder.wait()
+
+
+def test_cli_through_server(mocker):
+    import moulinette
+
+    run_client = mocker.patch(
+        "moulinette.interfaces.cliserver.run_client", return_value=3
+    )
+    interface = mocker.patch("moulinette.interfaces.cli.Interface")
+
+    assert moulinette.cli(["a"], None, output_as="json", server="/cli.sock") == 3
+    run_client.assert_called_once_with(
+        "/cli.sock",
+        ["a"],
+        options={"output_as": "json", "timeout": None, "columns": None},
+    )
+    assert not interface.called
+
+    # The action is run in-process if the server is not available
+    run_client.return_value = None
+    assert moulinette.cli(["a"], None, server="/cli.sock") == 0
+    assert interface.return_value.run.called
+
+
+def test_cli_server_interface_built_once(mocker):
+    import moulinette
+
+    server = mocker.patch("moulinette.interfaces.cliserver.CLIServer")
+    mocker.patch("moulinette.interfaces.cliserver.preload_actionsmap")
+    interface = mocker.patch("moulinette.interfaces.cli.Interface")
+    interface.return_value.actionsmap.changed.return_value = False
+
+    moulinette.cli_server("/cli.sock", None, actionsmap="/actionsmap.yml")
+    path, handler = server.call_args.args
+    server.call_args.kwargs["warmup"]()
+    assert interface.call_count == 1
+
+    # The actions map and its parsers are not built again for each action
+    assert handler(["a"], output_as="json") == 0
+    assert handler(["b"]) == 0
+    assert interface.call_count == 1
+    interface.return_value.run.assert_called_with(["b"])
+
+    # ... unless its file changed
+    interface.return_value.actionsmap.changed.return_value = True
+    assert handler(["a"]) == 0
+    assert interface.call_count == 2
@@ -0,0 +1,150 @@
+import os
+import sys
+import argparse
+import shutil
+import subprocess
+
+import pytest
+
+from moulinette.utils.completion import (
+    build_completion_index,
+    complete,
+    completion_hook,
+    completion_index_path,
+    load_index,
+)
+
+ACTIONSMAP = {
+    "_global": {"namespace": "moulitest"},
+    "domain": {
+        "actions": {
+            "list": {
+                "arguments": {
+                    "-f": {"full": "--filter", "choices": ["main", "all"]},
+                    "--json": {"action": "store_true"},
+                }
+            },
+            "remove": {
+                "deprecated_alias": ["delete"],
+                "arguments": {
+                    "domain": {"help": "Domain"},
+                    "action": {"choices": ["purge", "keep"]},
+                },
+            },
+            "old": {"deprecated": True},
+        },
+        "subcategories": {
+            "cert": {
+                "actions": {
+                    "status": {"arguments": {"--full": {"action": "store_true"}}}
+                }
+            }
+        },
+    },
+    "diagnosis": {"actions": {"run": {}}},
+}
+
+
+@pytest.fixture
+def index():
+    return build_completion_index(ACTIONSMAP)
+
+
+@pytest.fixture
+def global_arguments():
+    import argparse
+
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--output-as", choices=["json", "plain"])
+    parser.add_argument("--debug", action="store_true")
+    return parser._actions
+
+
+@pytest.mark.parametrize(
+    "words, cword, candidates",
+    [
+        ([""], 0, ["diagnosis", "domain"]),
+        (["do"], 0, ["domain"]),
+        (["domain", ""], 1, ["cert", "list", "remove"]),
+        (["domain", "-"], 1, ["--help", "-h"]),
+        (["domain", "cert", ""], 2, ["status"]),
+        (["domain", "cert", "status", "--"], 3, ["--full", "--help"]),
+        (["domain", "list", "-"], 2, ["--filter", "--help", "--json", "-f", "-h"]),
+        (["domain", "list", "--filter", ""], 3, ["all", "main"]),
+        (["domain", "list", "-f", "m"], 3, ["main"]),
+        (["domain", "list", "--json", ""], 3, []),
+        (["domain", "delete", "example.org", ""], 3, ["keep", "purge"]),
+        (["domain", "remove", "example.org", "p"], 3, ["purge"]),
+        (["unknown", ""], 1, []),
+    ],
+)
+def test_complete(index, words, cword, candidates):
+    assert complete(index, words, cword) == candidates
+
+
+@pytest.mark.parametrize(
+    "words, cword, candidates",
+    [
+        (["-"], 0, ["--debug", "--help", "--output-as", "-h"]),
+        (["--output-as", ""], 1, ["json", "plain"]),
+        (["--output-as", "json", "do"], 2, ["domain"]),
+        (["--debug", "domain", ""], 2, ["cert", "list", "remove"]),
+        (["domain", "--output-as", "j"], 2, ["json"]),
+        (["domain", "list", "--o"], 2, ["--output-as"]),
+        (["domain", "list", "--output-as", "p"], 3, ["plain"]),
+        (["domain", "remove", "--output-as", "json", "x", "k"], 5, ["keep"]),
+    ],
+)
+def test_complete_global_arguments(global_arguments, words, cword, candidates):
+    index = build_completion_index(ACTIONSMAP, global_arguments)
+    assert complete(index, words, cword) == candidates
+
+
+def test_completion_index_written_with_cache(moulinette, tmp_path, global_arguments):
+    from moulinette.actionsmap import ActionsMap
+    from moulinette.interfaces.api import ActionsMapParser as ApiParser
+    from moulinette.interfaces.cli import ActionsMapParser
+
+    path = str(tmp_path / "moulitest.yml")
+    shutil.copy(moulinette._actionsmap_path, path)
+
+    # The index is only written for the CLI
+    ActionsMap(path, ApiParser())
+    assert not os.path.exists(completion_index_path(path))
+
+    top_parser = argparse.ArgumentParser(add_help=False)
+    for action in global_arguments:
+        top_parser._add_action(action)
+    ActionsMap(path, ActionsMapParser(top_parser=top_parser))
+    index = load_index(completion_index_path(path))
+    assert complete(index, ["teststream", ""], 1) == ["error", "list", "log"]
+    assert complete(index, ["--output-as", ""], 1) == ["json", "plain"]
+
+    # It is written again from the cache if missing
+    os.remove(completion_index_path(path))
+    ActionsMap(path, ActionsMapParser(top_parser=top_parser))
+    assert load_index(completion_index_path(path)) == index
+
+
+def test_completion_script(moulinette, tmp_path):
+    from moulinette.utils.filesystem import read_yaml
+    from moulinette.utils.completion import write_completion_index
+
+    path = str(tmp_path / "index.json")
+    write_completion_index(path, read_yaml(moulinette._actionsmap_path))
+
+    # The script does not import the moulinette
+    script = completion_hook("bash", "moulitest", path).split(" -S ")[1].split()[0]
+    out = subprocess.check_output(
+        [sys.executable, "-S", script, path, "1", "testauth", "s"], text=True
+    )
+    assert out.splitlines() == ["subcat"]
+
+
+def test_completion_hook():
+    assert "complete -o default -F _moulitest_complete moulitest" in completion_hook(
+        "bash", "moulitest", "/index.json"
+    )
+    assert "#compdef moulitest" in completion_hook("zsh", "moulitest", "/index.json")
+    with pytest.raises(ValueError):
+        completion_hook("fish", "moulitest", "/index.json")
@@ -0,0 +1,106 @@
+import os
+import re
+import sys
+import shutil
+import subprocess
+
+import pytest
+
+from moulinette.utils.lazy import lazy_import
+
+# Budget in microseconds of the cumulative import time of the CLI interface,
+# as reported by 'python -X importtime'. It was measured around 40-60 ms on
+# a laptop: it leaves room for slower hardware and loaded test machines, but
+# not for a heavy dependency imported at module level.
+CLI_IMPORT_BUDGET = 200000
+
+# Modules which must not be loaded when importing the CLI interface
+CLI_UNWANTED_MODULES = [
+    "yaml",
+    "toml",
+    "gevent",
+    "geventwebsocket",
+    "bottle",
+    "moulinette.interfaces.api",
+]
+
+# Same for the modules loaded by authenticated actions, i.e. the actions map
+# and the authenticator - which are imported along with the CLI interface
+AUTH_IMPORT_BUDGET = 200000
+AUTH_UNWANTED_MODULES = CLI_UNWANTED_MODULES + ["sqlite3"]
+
+
+def importtime(*modules, path=()):
+    """Return the cumulative import time in microseconds of the modules
+    loaded by importing some modules in a fresh interpreter"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.join(os.path.dirname(__file__), "..")] + list(path)
+    )
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % ", ".join(modules)],
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in p.stderr.splitlines():
+        m = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)$", line)
+        if m:
+            times[m.group(3)] = int(m.group(1))
+    return times
+
+
+def test_cli_import_time():
+    times = importtime("moulinette.interfaces.cli")
+
+    assert "moulinette.interfaces.cli" in times
+    for module in CLI_UNWANTED_MODULES:
+        assert module not in times, "%s is imported by the CLI" % module
+    assert times["moulinette.interfaces.cli"] < CLI_IMPORT_BUDGET
+
+
+def test_authentication_import_time():
+    times = importtime("moulinette.authentication")
+
+    for module in AUTH_UNWANTED_MODULES:
+        assert module not in times, "%s is imported by authentication" % module
+    assert times["moulinette.authentication"] < AUTH_IMPORT_BUDGET
+
+
+def test_actionsmap_import_time(tmp_path):
+    # The test authenticators, as loaded by ActionsMap.get_authenticator
+    shutil.copytree(
+        os.path.join(os.path.dirname(__file__), "src"), str(tmp_path / "moulitest")
+    )
+    times = importtime(
+        "moulinette.actionsmap",
+        "moulitest.authenticators.dummy",
+        path=[str(tmp_path)],
+    )
+
+    for module in AUTH_UNWANTED_MODULES:
+        assert module not in times, "%s is imported by the actions map" % module
+    total = times["moulinette.actionsmap"] + times["moulitest.authenticators.dummy"]
+    assert total < AUTH_IMPORT_BUDGET
+
+
+def test_lazy_import():
+    # Already imported modules are returned as is
+    assert lazy_import("os") is os
+
+    name = "moulinette.utils.completion"
+    module = sys.modules.pop(name, None)
+    try:
+        completion = lazy_import(name)
+        assert sys.modules[name] is completion
+        assert completion.INDEX_VERSION == 1
+    finally:
+        if module is not None:
+            sys.modules[name] = module
+
+
+def test_lazy_import_not_found():
+    with pytest.raises(ImportError):
+        lazy_import("moulinette_nonexistent_module")
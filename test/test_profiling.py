@@ -0,0 +1,71 @@
+import time
+
+from moulinette.utils.profiling import SamplingProfiler, collapse_stack
+
+
+def busy_loop(duration):
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        pass
+
+
+def test_collapse_stack():
+    import sys
+
+    stack = collapse_stack(sys._getframe())
+
+    assert stack.endswith("test_profiling.py:test_collapse_stack")
+    assert ";" in stack
+
+
+def test_sampling_profiler(tmp_path):
+    profiler = SamplingProfiler(str(tmp_path), interval=0.001)
+    profiler.start()
+    busy_loop(0.2)
+    profiler.tag = "1234.1"
+    path = profiler.stop()
+
+    assert path == str(tmp_path / "1234.1.folded")
+    lines = open(path).read().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert any("test_profiling.py:busy_loop" in line for line in lines)
+
+
+def test_sampling_profiler_greenlet(tmp_path):
+    import gevent
+
+    profiler = SamplingProfiler(str(tmp_path), interval=0.001)
+
+    def profiled():
+        profiler.start()
+        gevent.sleep(0.1)
+        return profiler.stop()
+
+    # The profiled greenlet waits while another one runs: its own stack is
+    # sampled, not the one of the running greenlet
+    glet = gevent.spawn(profiled)
+    gevent.sleep(0)
+    busy_loop(0.2)
+    profile = open(glet.get(timeout=5)).read()
+
+    assert "test_profiling.py:profiled" in profile
+    assert "test_profiling.py:busy_loop" not in profile
+
+
+def test_sampling_profiler_not_started(tmp_path):
+    profiler = SamplingProfiler(str(tmp_path))
+
+    assert profiler.stop() is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profile_cli(moulinette_cli, monkeypatch, tmp_path, capsys):
+    monkeypatch.setenv("MOULINETTE_PROFILE", str(tmp_path))
+
+    moulinette_cli.run(["teststream", "list", "2"], output_as="none")
+
+    profiles = list(tmp_path.iterdir())
+    assert len(profiles) == 1
+    assert profiles[0].name.endswith(".folded")
@@ -1,5 +1,9 @@
-from datetime import datetime as dt
-from moulinette.interfaces import JSONExtendedEncoder
+import json
+
+import pytest
+
+from datetime import date, datetime as dt, timezone, timedelta
+from moulinette.interfaces import JSONExtendedEncoder, json_backends
 
 
 def test_json_extended_encoder(caplog):
@@ -12,3 +16,104 @@ def test_json_extended_encoder(caplog):
     assert encoder.default(None) == "None"
     for message in caplog.messages:
         assert "cannot properly encode in JSON" in message
+
+
+def test_json_extended_encoder_dates():
+    encoder = JSONExtendedEncoder()
+
+    assert encoder.default(date(1917, 3, 8)) == "1917-03-08"
+
+    tz = timezone(timedelta(hours=2))
+    assert encoder.default(dt(1917, 3, 8, 12, tzinfo=tz)) == "1917-03-08T12:00:00+02:00"
+
+
+@pytest.mark.parametrize("backend", json_backends, ids=lambda b: b[0])
+def test_json_backends(backend):
+    _, module, encode = backend
+    pytest.importorskip(module)
+
+    content = {
+        "string": "héhé",
+        "int": 42,
+        "big_int": 2**70,
+        "float": 1.5,
+        "none": None,
+        "bool": True,
+        "list": [1, "2", {"three": 3}],
+        "tuple": (1, 2),
+        "set": {1},
+        "date": date(1917, 3, 8),
+        "naive": dt(1917, 3, 8, 1, 2, 3, 4),
+        "aware": dt(1917, 3, 8, tzinfo=timezone(timedelta(hours=-5))),
+        1: "non str key",
+    }
+
+    assert json.loads(encode(content)) == {
+        "string": "héhé",
+        "int": 42,
+        "big_int": 2**70,
+        "float": 1.5,
+        "none": None,
+        "bool": True,
+        "list": [1, "2", {"three": 3}],
+        "tuple": [1, 2],
+        "set": [1],
+        "date": "1917-03-08",
+        "naive": "1917-03-08T01:02:03.000004+00:00",
+        "aware": "1917-03-08T00:00:00-05:00",
+        "1": "non str key",
+    }
+
+
+@pytest.mark.parametrize("backend", json_backends, ids=lambda b: b[0])
+def test_json_backends_unknown_object(backend, caplog):
+    _, module, encode = backend
+    pytest.importorskip(module)
+
+    class Foo:
+        def __repr__(self):
+            return "<Foo>"
+
+    assert json.loads(encode({"foo": Foo()})) == {"foo": "<Foo>"}
+    assert any("cannot properly encode in JSON" in m for m in caplog.messages)
+
+
+def test_json_backends_parity():
+    import enum
+    import uuid
+    from collections import namedtuple
+    from dataclasses import dataclass
+    from datetime import time
+
+    pytest.importorskip("orjson")
+
+    Point = namedtuple("Point", ["x", "y"])
+
+    @dataclass
+    class Data:
+        a: int
+
+    class Color(enum.Enum):
+        RED = "red"
+
+    content = {
+        "nan": float("nan"),
+        "inf": [float("inf"), -float("inf"), 1.5],
+        "namedtuple": Point(1, 2),
+        "dataclass": Data(1),
+        "enum": Color.RED,
+        "uuid": uuid.UUID(int=1),
+        "time": time(12, 30),
+    }
+
+    encoded = {name: encode(content) for name, _, encode in json_backends}
+    assert encoded["orjson"].replace(" ", "") == encoded["json"].replace(" ", "")
+    assert json.loads(encoded["json"]) == {
+        "nan": None,
+        "inf": [None, None, 1.5],
+        "namedtuple": [1, 2],
+        "dataclass": repr(Data(1)),
+        "enum": "red",
+        "uuid": "00000000-0000-0000-0000-000000000001",
+        "time": "12:30:00",
+    }